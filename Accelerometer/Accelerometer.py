@@ -3,6 +3,7 @@ import time
 
 import serial
 
+from Accelerometer.AccelerometerBuffer import AccelerometerRingBuffer
 
 class AccelerometerException(Exception):
     def __init__(self, message):
@@ -16,9 +17,8 @@ class AccelerometerADXL313:
     _connected = False
     _interrupt_function = None
     _interrupt_watcher_thread = None
-    _x = None
-    _y = None
-    _z = None
+    _buffer = None
+    _calibration = None
 
     # Define class variables for incoming communication messages
     SER_SUCCESS = "SER_SUCCESS"
@@ -52,23 +52,50 @@ class AccelerometerADXL313:
     # input: port - string - the serial port the accelerometer is expected to be on
     #        baudrate - int - the baudrate on the serial connection the devices will be communicating on
     #        timeout - int - default 1s, the serial timeout for when the program is blocking execution and waiting for a message
-    def __init__(self, port, baudrate, timeout=1):
+    #        buffer_capacity - int - default 1024, the amount of samples kept in the ring buffer
+    #        transport - function(port, baudrate, timeout) - opens the connection, defaults to serial.Serial. Emulators
+    #                    use it to replace the board
+    #        reset_delay - float - default 0s, fixed time to wait for the board to restart after the port is opened.
+    #                      Not needed anymore, connect_to_slave retries the handshake until the board answers
+    def __init__(self, port, baudrate, timeout=1, buffer_capacity=1024, transport=None, reset_delay=0):
+        if transport is None:
+            transport = serial.Serial
         if timeout is None:
-            self.__serial = serial.Serial(port, baudrate=baudrate)
+            self.__serial = transport(port, baudrate=baudrate)
         else:
-            self.__serial = serial.Serial(port, baudrate=baudrate, timeout=timeout)
-        time.sleep(3)
+            self.__serial = transport(port, baudrate=baudrate, timeout=timeout)
+        time.sleep(reset_delay)
 
+        self._buffer = AccelerometerRingBuffer(buffer_capacity)
         self._interrupt_watcher_thread = threading.Thread(target=self._interrupt_mode_recv_xyz)
 
-    # Initialises a connection to the board and raises an exception if not successful
-    def connect_to_slave(self):
+    # Initialises a connection to the board and raises an exception if not successful.
+    # Opening the port restarts the board, which does not listen until its bootloader and setup are done. Instead of
+    # sleeping for a fixed time, BEGIN is sent again every retry_interval until the board answers or ready_timeout
+    # expires.
+    # input: ready_timeout - float - default 10s, the maximum amount of time to wait for the board
+    #        retry_interval - float - default 0.25s, the time to wait for an answer before sending BEGIN again
+    # raises: AccelerometerException - if the handshake is not successful
+    def connect_to_slave(self, ready_timeout=10, retry_interval=0.25):
         if not self.__serial.is_open:
             self.__serial.open()
 
-        self.__serial.write(self.BEGIN.encode())
+        timeout = self.__serial.timeout
+        self.__serial.timeout = retry_interval
+        deadline = time.monotonic() + ready_timeout
+        attempts = 0
+        response = ""
+        try:
+            while time.monotonic() < deadline:
+                self.__serial.write(self.BEGIN.encode())
+                attempts += 1
+                response = self.__serial.readline().decode(errors='replace').strip()
+                # the board answers SER_FAIL and restarts if it receives something else than BEGIN first
+                if self.SER_SUCCESS == response:
+                    break
+        finally:
+            self.__serial.timeout = timeout
 
-        response = self.__serial.readline().decode().strip()
         if self.SER_SUCCESS != response:
             raise AccelerometerException("Arduino handshake incomplete. Received response: " + response)
 
@@ -76,6 +103,15 @@ class AccelerometerADXL313:
         if self.ACC_SUCCESS != response:
             raise AccelerometerException("Arduino handshake incomplete. Received response: " + response)
 
+        # the BEGINs that arrived after the successful one are answered with UNKNOWN_ERR, discard the answers
+        if attempts > 1:
+            self.__serial.timeout = retry_interval
+            try:
+                while self.__serial.readline().decode(errors='replace').strip() != "":
+                    pass
+            finally:
+                self.__serial.timeout = timeout
+
         self._connected = True
 
     # Closes the connection to the board and resets the board. Raises an exception if the accelerometer unit is not connected.
@@ -155,7 +191,7 @@ class AccelerometerADXL313:
         if set_value != supposed_value:
             raise AccelerometerException("Interval set incomplete. Received response: " + response)
 
-    # reads x, y, z coordinates from the accelerometer.
+    # reads x, y, z coordinates from the accelerometer. The frame is also added to the sample buffer.
     # raises: AcceleromterException - if the connection is not working properly
     # returns: x, y, z - int, int, int - acceleration values from the accelerometer
     def get_frame(self):
@@ -164,6 +200,7 @@ class AccelerometerADXL313:
 
         self.__serial.write(self.REQUEST_FRAME.encode())
         x, y, z = self._read_frame()
+        self._buffer.push(time.time_ns(), x, y, z)
         return x, y, z
 
 
@@ -209,41 +246,74 @@ class AccelerometerADXL313:
 
         self._interrupt_mode = False
         self._interrupt_watcher_thread.join()
-        self._x = None
-        self._y = None
-        self._z = None
 
     # Callable only while in interrupt mode. Returns the read x coordinate from the accelerometer.
     # raises: Accelerometer exception if not in interrupt mode
     # returns: x - int - coordinate read from the accelerometer
     def get_x(self):
-        if not self._interrupt_mode:
-            raise AccelerometerException("Accelerometer must be in interrupt mode to use these methods.")
-        return self._x
+        return self.get_xyz()[0]
 
     # Callable only while in interrupt mode. Returns the read y coordinate from the accelerometer.
     # raises: Accelerometer exception if not in interrupt mode
     # returns: y - int - coordinate read from the accelerometer
     def get_y(self):
-        if not self._interrupt_mode:
-            raise AccelerometerException("Accelerometer must be in interrupt mode to use these methods.")
-        return self._y
+        return self.get_xyz()[1]
 
     # Callable only while in interrupt mode. Returns the read z coordinate from the accelerometer.
     # raises: Accelerometer exception if not in interrupt mode
     # returns: z - int - coordinate read from the accelerometer
     def get_z(self):
+        return self.get_xyz()[2]
+
+    # Callable only while in interrupt mode. Returns the latest frame read from the accelerometer. The three values always
+    # belong to the same frame.
+    # raises: Accelerometer exception if not in interrupt mode
+    # returns: x, y, z - int, int, int - coordinates read from the accelerometer, None if no frame was received yet
+    def get_xyz(self):
         if not self._interrupt_mode:
             raise AccelerometerException("Accelerometer must be in interrupt mode to use these methods.")
-        return self._z
+        _, _, x, y, z = self._buffer.latest()
+        return x, y, z
+
+    # Sets the calibration used to convert frames to g in the vehicle frame.
+    # input: calibration - AccelerometerCalibration or None to remove it
+    def set_calibration(self, calibration):
+        self._calibration = calibration
+
+    # Callable only while in interrupt mode and after a calibration was set. Returns the latest frame converted to g in
+    # the vehicle frame.
+    # raises: Accelerometer exception if not in interrupt mode or not calibrated
+    # returns: x, y, z - float, float, float - lateral, longitudinal and vertical acceleration in g, None if no frame was
+    #          received yet
+    def get_xyz_g(self):
+        if self._calibration is None:
+            raise AccelerometerException("Accelerometer must be calibrated to use this method.")
+        x, y, z = self.get_xyz()
+        if x is None:
+            return None, None, None
+        return self._calibration.transform_sample(x, y, z)
+
+    # Returns the frames received after the given sequence number. See AccelerometerRingBuffer.since
+    # input: seq - int - the last sequence number already seen, 0 to get every buffered frame
+    # returns: times, xyz, seq - read-only arrays of the times in ns and the x, y, z values, and the newest sequence number
+    def get_samples_since(self, seq=0):
+        return self._buffer.since(seq)
+
+    # Returns the aggregates (mean, min, max, RMS) of the frames received after the given sequence number.
+    # input: seq - int - the last sequence number already seen
+    # returns: window, seq - AccelerometerWindow or None if no frames were received, and the newest sequence number
+    def get_window_since(self, seq=0):
+        return self._buffer.window(seq)
 
     # Designed to run in a separate thread. Loops continuously while in interrupt mode and reads the parameters from
-    # the accelerometer. It sets the x, y, z properties in the object to the coordinates read.
+    # the accelerometer. Every frame read is added to the sample buffer.
     def _interrupt_mode_recv_xyz(self):
         while self._interrupt_mode:
             try:
-                self._x, self._y, self._z = self._read_frame()
-                self._interrupt_function()
+                x, y, z = self._read_frame()
+                self._buffer.push(time.time_ns(), x, y, z)
+                if self._interrupt_function is not None:
+                    self._interrupt_function()
             except AccelerometerException:
                 continue
 
@@ -275,6 +345,5 @@ class AccelerometerADXL313:
             raise AccelerometerException("Accelerometer not connected")
         self.__serial.write(cmd.encode())
         self.__serial.write(parameter.encode())
-        time.sleep(0.2)
         response = self.__serial.readline().decode().strip()
         return response
@@ -0,0 +1,125 @@
+import threading
+
+import numpy
+
+
+# Fixed-size ring buffer of timestamped accelerometer samples. Memory is allocated once, when the buffer is created.
+# Every sample gets a sequence number, increasing by one for each sample pushed, starting at 1. Readers remember the last
+# sequence number they have seen and ask for everything after it, so no sample is lost between two reads as long as
+# the reader keeps up with the buffer capacity.
+# Each sample is written twice, at position i and i + capacity, so that any window of at most capacity samples is a
+# contiguous slice of the storage and can be returned as a view without copying.
+class AccelerometerRingBuffer:
+    _capacity = None
+    _times = None
+    _xyz = None
+    _seq = 0
+    _lock = None
+
+    # input: capacity - int - the maximum amount of samples kept. Older samples are overwritten.
+    def __init__(self, capacity=1024):
+        if capacity < 1:
+            raise ValueError("Buffer capacity must be at least 1")
+        self._capacity = capacity
+        self._times = numpy.zeros(2 * capacity, dtype=numpy.int64)
+        self._xyz = numpy.zeros((2 * capacity, 3), dtype=numpy.int32)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    # Adds a sample to the buffer.
+    # input: t - int - time in ns when the sample was read
+    #        x, y, z - int, int, int - acceleration values read from the accelerometer
+    # returns: int - the sequence number of the sample
+    def push(self, t, x, y, z):
+        with self._lock:
+            i = self._seq % self._capacity
+            j = i + self._capacity
+            self._times[i] = self._times[j] = t
+            self._xyz[i, 0] = self._xyz[j, 0] = x
+            self._xyz[i, 1] = self._xyz[j, 1] = y
+            self._xyz[i, 2] = self._xyz[j, 2] = z
+            self._seq += 1
+            return self._seq
+
+    # returns: int - the sequence number of the newest sample, 0 if the buffer is empty
+    @property
+    def seq(self):
+        return self._seq
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    # returns: seq, t, x, y, z - the newest sample and its sequence number. All values are None if the buffer is empty.
+    def latest(self):
+        with self._lock:
+            if self._seq == 0:
+                return None, None, None, None, None
+            i = (self._seq - 1) % self._capacity
+            x, y, z = self._xyz[i].tolist()
+            return self._seq, int(self._times[i]), x, y, z
+
+    # Gets the samples pushed after the given sequence number. If the reader fell behind more than the capacity of the
+    # buffer, only the samples still available are returned.
+    # The arrays are read-only views into the buffer and are only valid until the writer wraps around. Copy them if
+    # they need to be kept.
+    # input: seq - int - the last sequence number already seen by the reader, 0 to get every available sample
+    # returns: times, xyz, seq
+    #          times - numpy array of int64, shape (n,) - time in ns of each sample
+    #          xyz - numpy array of int32, shape (n, 3) - the x, y, z values of each sample
+    #          seq - int - the sequence number of the newest returned sample, to be passed on the next call
+    def since(self, seq=0):
+        with self._lock:
+            times, xyz, newest = self._slice(seq)
+
+        times = times.view()
+        xyz = xyz.view()
+        times.flags.writeable = False
+        xyz.flags.writeable = False
+        return times, xyz, newest
+
+    # Computes aggregates over the samples pushed after the given sequence number. The samples are copied while the
+    # lock is held, so the writer cannot overwrite them while the aggregates are computed.
+    # input: seq - int - the last sequence number already seen by the reader
+    # returns: summary, seq
+    #          summary - AccelerometerWindow - aggregates of the window, None if no new sample was pushed
+    #          seq - int - the sequence number to be passed on the next call
+    def window(self, seq=0):
+        with self._lock:
+            times, xyz, newest = self._slice(seq)
+            times = times.copy()
+            xyz = xyz.copy()
+        if len(times) == 0:
+            return None, newest
+        return AccelerometerWindow(times, xyz), newest
+
+    # The slices of the storage holding the samples pushed after seq. Must be called with the lock held.
+    # returns: times, xyz, seq - see since
+    def _slice(self, seq):
+        newest = self._seq
+        count = min(newest - seq, self._capacity)
+        if count <= 0:
+            return self._times[:0], self._xyz[:0], newest
+        start = (newest - count) % self._capacity
+        return self._times[start:start + count], self._xyz[start:start + count], newest
+
+
+# Aggregates of a window of accelerometer samples. Values are per axis, ordered x, y, z.
+class AccelerometerWindow:
+    count = None
+    start = None
+    end = None
+    mean = None
+    min = None
+    max = None
+    rms = None
+
+    def __init__(self, times, xyz):
+        values = xyz.astype(numpy.float64)
+        self.count = len(times)
+        self.start = int(times[0])
+        self.end = int(times[-1])
+        self.mean = values.mean(axis=0).tolist()
+        self.min = xyz.min(axis=0).tolist()
+        self.max = xyz.max(axis=0).tolist()
+        self.rms = numpy.sqrt((values * values).mean(axis=0)).tolist()
@@ -0,0 +1,222 @@
+import csv
+import json
+import math
+
+import numpy
+
+# nominal ADXL313 sensitivity in LSB/g for each range setting. The keys are the values sent with SET_RANGE
+LSB_PER_G = {0: 1024, 1: 512, 2: 256, 3: 128}
+
+# standard gravity in m/s^2
+GRAVITY = 9.80665
+
+INPUT_FILE = '../Data/Raw/test15_05_2024_1.csv'
+OUTPUT_FILE = '../Data/Raw/test15_05_2024_1.calibration.json'
+
+
+class CalibrationException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+# Converts raw ADXL313 counts to g in the vehicle frame. The vehicle frame keeps the axes the rest of the project
+# already assumes for raw values: x is lateral (positive to the right), y is longitudinal (positive forward) and z
+# points up. A sensor at rest reads (0, 0, 1).
+# The transform is vehicle = rotation @ counts / scale - bias, where the rows of rotation are the vehicle axes
+# expressed in the sensor frame.
+class AccelerometerCalibration:
+    _rotation = None
+    _scale = None
+    _bias = None
+    _matrix = None
+    _bias_list = None
+
+    # input: rotation - 3x3 array-like - rows are the lateral, forward and up axes in the sensor frame
+    #        scale - float - counts per g
+    #        bias - 3 array-like - offset in g subtracted after rotating, in the vehicle frame
+    def __init__(self, rotation=None, scale=LSB_PER_G[3], bias=None):
+        if rotation is None:
+            rotation = numpy.identity(3)
+        if bias is None:
+            bias = numpy.zeros(3)
+        self._rotation = numpy.array(rotation, dtype=numpy.float64)
+        self._scale = float(scale)
+        self._bias = numpy.array(bias, dtype=numpy.float64)
+        # the matrix and bias as python floats, for the per-sample transform
+        self._matrix = (self._rotation / self._scale).tolist()
+        self._bias_list = self._bias.tolist()
+
+    @property
+    def rotation(self):
+        return self._rotation.copy()
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @property
+    def bias(self):
+        return self._bias.copy()
+
+    # Converts a whole trip at once.
+    # input: xyz - array-like, shape (n, 3) - raw counts. NaN values stay NaN
+    # returns: numpy array, shape (n, 3) - acceleration in g in the vehicle frame
+    def transform(self, xyz):
+        xyz = numpy.asarray(xyz, dtype=numpy.float64)
+        return xyz @ (self._rotation.T / self._scale) - self._bias
+
+    # Converts a single sample. Meant for the live reader, where building numpy arrays would cost more than the math.
+    # input: x, y, z - numbers - raw counts
+    # returns: x, y, z - float, float, float - acceleration in g in the vehicle frame
+    def transform_sample(self, x, y, z):
+        m = self._matrix
+        b = self._bias_list
+        return (m[0][0] * x + m[0][1] * y + m[0][2] * z - b[0],
+                m[1][0] * x + m[1][1] * y + m[1][2] * z - b[1],
+                m[2][0] * x + m[2][1] * y + m[2][2] * z - b[2])
+
+    # Converts the x, y, z attributes of AutomotiveDataRows to g in the vehicle frame, in place. Rows without
+    # accelerometer values are left unchanged.
+    def apply_to_rows(self, automotive_data):
+        xyz = rows_to_arrays(automotive_data)[2]
+        converted = self.transform(xyz).tolist()
+        for adr, (x, y, z) in zip(automotive_data, converted):
+            if adr.x is None or adr.y is None or adr.z is None:
+                continue
+            adr.x, adr.y, adr.z = x, y, z
+
+    def to_dict(self):
+        return {'rotation': self._rotation.tolist(), 'scale': self._scale, 'bias': self._bias.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        return AccelerometerCalibration(d['rotation'], d['scale'], d['bias'])
+
+    def save(self, file):
+        with open(file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, file):
+        with open(file, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    # Estimates the mounting rotation, scale and bias from a trip.
+    # Stationary samples (speed 0) give the up axis and, unless the range is known, the scale.
+    # Samples on straight lines while the car speeds up or slows down give the forward axis: the horizontal part of the
+    # reading follows the longitudinal acceleration computed from the vehicle speed.
+    # Samples on straight lines give the lateral bias, since the average lateral acceleration there should be 0.
+    # input: times - array-like of ns
+    #        speeds - array-like of km/h
+    #        xyz - array-like, shape (n, 3) - raw counts, NaN where missing
+    #        headings - array-like of degrees or None - used to find straight lines. If None, every moving sample is
+    #                   considered on a straight line
+    #        accelerometer_range - int or None - the range set on the sensor, if known
+    #        heading_rate_threshold - float - max heading change in deg/s for a sample to be on a straight line
+    #        min_acceleration - float - min longitudinal acceleration in g for a sample to be used for the forward axis
+    #        min_samples - int - min number of samples for each of the estimations
+    # raises: CalibrationException - if there are not enough stationary samples
+    @classmethod
+    def fit(cls, times, speeds, xyz, headings=None, accelerometer_range=None, heading_rate_threshold=3.0,
+            min_acceleration=0.05, min_samples=20):
+        times = numpy.asarray(times, dtype=numpy.float64) / 1e9
+        speeds = numpy.asarray(speeds, dtype=numpy.float64)
+        xyz = numpy.asarray(xyz, dtype=numpy.float64)
+        valid = numpy.isfinite(xyz).all(axis=1) & numpy.isfinite(speeds)
+
+        stationary = valid & (speeds == 0)
+        if stationary.sum() < min_samples:
+            raise CalibrationException("Not enough stationary samples to calibrate: " + str(stationary.sum()))
+
+        gravity = xyz[stationary].mean(axis=0)
+        norm = numpy.linalg.norm(gravity)
+        up = gravity / norm
+        scale = norm if accelerometer_range is None else LSB_PER_G[int(accelerometer_range)]
+
+        acceleration = _longitudinal_acceleration(times, speeds)
+        straight = valid & (speeds > 0) & numpy.isfinite(acceleration)
+        if headings is not None:
+            straight &= numpy.abs(_heading_rate(times, numpy.asarray(headings, dtype=numpy.float64))) \
+                        < heading_rate_threshold
+
+        # horizontal part of each reading, in g
+        readings = xyz / scale
+        horizontal = readings - numpy.outer(readings @ up, up)
+
+        accelerating = straight & (numpy.abs(acceleration) >= min_acceleration)
+        forward = None
+        if accelerating.sum() >= min_samples:
+            a = acceleration[accelerating]
+            forward = (horizontal[accelerating] * a[:, None]).sum(axis=0) / (a * a).sum()
+        if forward is None or numpy.linalg.norm(forward) == 0:
+            # not enough data, assume the sensor y axis points forward
+            forward = numpy.array([0.0, 1.0, 0.0]) - up[1] * up
+        forward = forward / numpy.linalg.norm(forward)
+        lateral = numpy.cross(forward, up)
+        rotation = numpy.array([lateral, forward, up])
+
+        bias = rotation @ gravity / scale - numpy.array([0.0, 0.0, 1.0])
+        if straight.sum() >= min_samples:
+            bias[0] = (readings[straight] @ lateral).mean()
+
+        return AccelerometerCalibration(rotation, scale, bias)
+
+    # Estimates the calibration from AutomotiveDataRows. The rows should not be sanitized, since the stationary rows
+    # are needed.
+    @classmethod
+    def fit_rows(cls, automotive_data, **kwargs):
+        times, speeds, xyz, headings = rows_to_arrays(automotive_data)
+        return cls.fit(times, speeds, xyz, headings, **kwargs)
+
+
+# Builds numpy arrays from AutomotiveDataRows, with NaN where values are missing.
+# returns: times, speeds, xyz, headings
+def rows_to_arrays(automotive_data):
+    nan = math.nan
+    times = numpy.array([nan if adr.latest is None else adr.latest for adr in automotive_data], dtype=numpy.float64)
+    speeds = numpy.array([nan if adr.speed is None else adr.speed for adr in automotive_data], dtype=numpy.float64)
+    headings = numpy.array([nan if adr.heading is None else adr.heading for adr in automotive_data],
+                           dtype=numpy.float64)
+    xyz = numpy.array([[nan if adr.x is None else adr.x, nan if adr.y is None else adr.y,
+                        nan if adr.z is None else adr.z] for adr in automotive_data], dtype=numpy.float64)
+    return times, speeds, xyz.reshape(-1, 3), headings
+
+
+# Longitudinal acceleration in g from the vehicle speed. The logger repeats rows between OBD updates, so the speed is
+# differentiated over a window of a few rows. NaN where it cannot be computed.
+def _longitudinal_acceleration(times, speeds, window=3):
+    acceleration = numpy.full(len(speeds), numpy.nan)
+    if len(speeds) <= 2 * window:
+        return acceleration
+    dt = times[2 * window:] - times[:-2 * window]
+    dv = (speeds[2 * window:] - speeds[:-2 * window]) / 3.6
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        acceleration[window:-window] = numpy.where(dt > 0, dv / dt / GRAVITY, numpy.nan)
+    return acceleration
+
+
+# Heading change rate in deg/s, over the same window as the acceleration. NaN where it cannot be computed.
+def _heading_rate(times, headings, window=3):
+    rate = numpy.full(len(headings), numpy.nan)
+    if len(headings) <= 2 * window:
+        return rate
+    dt = times[2 * window:] - times[:-2 * window]
+    dh = (headings[2 * window:] - headings[:-2 * window] + 180) % 360 - 180
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rate[window:-window] = numpy.where(dt > 0, dh / dt, numpy.nan)
+    return rate
+
+
+if __name__ == '__main__':
+    from DataPreprocessing.Model.AutomotiveDataRow import AutomotiveDataRow
+
+    with open(INPUT_FILE, 'r') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        header = next(csv_reader)
+        automotive_data = [AutomotiveDataRow(header, row) for row in csv_reader]
+
+    calibration = AccelerometerCalibration.fit_rows(automotive_data)
+    print("Rotation:", calibration.rotation.tolist())
+    print("Scale:", calibration.scale)
+    print("Bias:", calibration.bias.tolist())
+    calibration.save(OUTPUT_FILE)
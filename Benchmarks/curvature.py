@@ -0,0 +1,67 @@
+import time
+
+from DataPreprocessing.Model.AutomotiveDataRow import load_csv
+from DataPreprocessing.get_corners_from_route import determinant, get_determinants_and_radiuses, get_nodes, get_radius
+
+# the largest snapped trip
+INPUT_FILE = 'Data/MovedToMapNodes/snap_points_test_15_05_2024_1.csv'
+REPEAT = 50
+STRAIGHT_RADIUS_THRESHOLD = 0.006
+MIN_DETERMINANT_ABS = float('2e-10')
+
+
+# get_determinants_and_radiuses before it was vectorized, one triple at a time
+def loop_determinants_and_radiuses(automotive_data, straight_radius_threshold, min_determinant_abs):
+    determinants = []
+    radiuses_all = []
+
+    for i in range(len(automotive_data) - 2):
+        row1 = automotive_data[i]
+        row2 = automotive_data[i + 1]
+        row3 = automotive_data[i + 2]
+
+        if row1.latitude == row2.latitude and row1.longitude == row2.longitude or row3.latitude == row2.latitude and \
+                row3.longitude == row2.longitude or row1.latitude == row3.latitude and row1.longitude == row3.longitude:
+            determinants.append(0)
+            radiuses_all.append(None)
+            continue
+
+        det = determinant(row1.latitude, row1.longitude, row2.latitude, row2.longitude, row3.latitude, row3.longitude)
+        radius = None
+
+        if det != 0:
+            radius = get_radius(row1.latitude, row1.longitude, row2.latitude, row2.longitude, row3.latitude,
+                                row3.longitude)
+
+        if radius is not None and radius > straight_radius_threshold or abs(det) < min_determinant_abs:
+            det = 0
+
+        determinants.append(det)
+        radiuses_all.append(radius)
+
+    return determinants, radiuses_all
+
+
+# returns: best time in s
+def measure(function, *args):
+    best = None
+    for i in range(REPEAT):
+        started = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    automotive_data, header = load_csv(INPUT_FILE)
+    nodes = get_nodes(automotive_data)
+    print("nodes:", len(nodes))
+
+    expected = loop_determinants_and_radiuses(nodes, STRAIGHT_RADIUS_THRESHOLD, MIN_DETERMINANT_ABS)
+    assert get_determinants_and_radiuses(nodes, STRAIGHT_RADIUS_THRESHOLD, MIN_DETERMINANT_ABS) == expected
+
+    for name, function in [('python loop', loop_determinants_and_radiuses),
+                           ('numpy', get_determinants_and_radiuses)]:
+        elapsed = measure(function, nodes, STRAIGHT_RADIUS_THRESHOLD, MIN_DETERMINANT_ABS)
+        print("%-12s %8.2f ms" % (name, elapsed * 1000))
@@ -0,0 +1,49 @@
+import time
+
+from DataPreprocessing.classify_corners_manually_export_gpx import _parse_corners
+
+INPUT_FILE = 'Data/CornersSplitAndLabels/split_15_05_2024_1.json'
+REPEAT = 20
+
+# the Corner properties AIModels/predict_fuel_ai.py reads in corner_to_feature_array with every feature enabled.
+# AIModels needs keras and sklearn, so the properties are read here directly.
+PROPERTIES = ['min_radius', 'avg_radius', 'median_radius', 'max_radius', 'distance_traveled', 'median_speed',
+              'min_speed', 'max_speed', 'avg_speed', 'max_deceleration', 'max_acceleration', 'max_centrifugal',
+              'median_centrifugal', 'avg_centrifugal', 'max_rise', 'min_rise', 'avg_rise', 'median_rise', 'entry_speed',
+              'exit_speed', 'decelerated_speed', 'accelerated_speed', 'min_map', 'max_map', 'avg_map', 'median_map',
+              'min_load', 'max_load', 'avg_load', 'median_load', 'entry_map', 'exit_map', 'entry_load', 'exit_load']
+
+
+def extract_features(corners, properties):
+    return [[getattr(corner, name) for name in properties] for corner in corners]
+
+
+def read_node_samples(corners, properties):
+    return [[len(n.speeds) + len(n.maps) + len(n.Xs) for n in c.nodes] for c in corners]
+
+
+# Runs function on freshly loaded corners, so nothing computed by a previous run is reused. Loading is not timed.
+# returns: best time in s of the first and of the second run on the same corners
+def measure(function, properties):
+    best_first = None
+    best_second = None
+    for i in range(REPEAT):
+        corners = _parse_corners(INPUT_FILE)
+        started = time.perf_counter()
+        function(corners, properties)
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        function(corners, properties)
+        second = time.perf_counter() - started
+        best_first = first if best_first is None else min(best_first, first)
+        best_second = second if best_second is None else min(best_second, second)
+    return best_first, best_second
+
+
+if __name__ == '__main__':
+    print("corners:", len(_parse_corners(INPUT_FILE)))
+    for name, function, properties in [("all features", extract_features, PROPERTIES),
+                                       ("speed changes", extract_features, ['decelerated_speed', 'accelerated_speed']),
+                                       ("node samples", read_node_samples, None)]:
+        first, second = measure(function, properties)
+        print("%-16s first %8.2f ms  again %8.2f ms" % (name, first * 1000, second * 1000))
@@ -0,0 +1,95 @@
+import contextlib
+import io
+import math
+import shutil
+import tempfile
+import time
+
+from DataPreprocessing import move_nodes_to_road_median_axis
+from DataPreprocessing.Model.RoadNetwork import RoadNetwork, load_road_network
+from DataPreprocessing.Model.RowFilter import DEFAULT_FILTER
+from DataPreprocessing.Model.TripData import load_trip_cached
+from DataPreprocessing.move_nodes_to_road_median_axis import snap_trip
+from DataPreprocessing.overpass_cache import MAX_TILES_PER_REQUEST, PREFETCH_MARGIN, OverpassTiles, open_tiles
+from Emulators.overpass_emulator import OverpassEmulator
+
+INPUT_FILE = 'Data/Raw/test15_05_2024_1.csv'
+# OSM extract around the trip, see load_road_network. None builds a stand-in network from SNAPPED_FILE, whose points
+# are on the median axis of the roads the trip was snapped to
+OSM_FILE = None
+SNAPPED_FILE = 'Data/MovedToMapNodes/snap_points_test_15_05_2024_1.csv'
+# nodes of every way of the stand-in network
+WAY_NODES = 8
+# s every answer of the emulator waits for, like the latency of the Overpass API
+DELAY = 0.05
+
+
+# Builds a network of secondary roads through the points of a snapped trip, WAY_NODES nodes per way.
+def stand_in_network(snapped_file):
+    trip = load_trip_cached(snapped_file)
+    points = []
+    for point in zip(trip['LATITUDE'].tolist(), trip['LONGITUDE'].tolist()):
+        if len(points) == 0 or point != points[-1]:
+            points.append(point)
+
+    nodes = {ref: point for ref, point in enumerate(points, 1)}
+    refs = list(nodes)
+    ways = [(way_id, {'highway': 'secondary'}, refs[first:first + WAY_NODES])
+            for way_id, first in enumerate(range(0, len(refs) - 1, WAY_NODES - 1), 1)]
+    return RoadNetwork.from_ways(ways, nodes)
+
+
+# input: overpass_cache - see snap_trip, used when network is None
+# returns: the coordinates of the snapped points of the trip and the time snapping took in s
+def snap(input_file, network, overpass_cache=None):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        snapped = [(adr.latitude, adr.longitude) for adr in snap_trip(input_file, row_filter=DEFAULT_FILTER,
+                                                                      network=network, overpass_cache=overpass_cache)]
+    return snapped, time.perf_counter() - started
+
+
+# Snaps the trip on the network directly, through the Overpass API emulated on the network, point by point, and through
+# OverpassTiles, with an empty cache, the default path of snap_trip, and with the cache filled by the first run. Every
+# way gives the same points. The tiles are fetched in the fewest requests when the cache is empty and none when it is
+# filled.
+if __name__ == '__main__':
+    network = load_road_network(OSM_FILE) if OSM_FILE is not None else stand_in_network(SNAPPED_FILE)
+    expected, elapsed = snap(INPUT_FILE, network)
+    print("%-22s %8.2f s  %4d requests" % ('RoadNetwork', elapsed, 0))
+
+    emulator = OverpassEmulator(network, delay=DELAY).start()
+    directory = tempfile.mkdtemp()
+    overpass_url = move_nodes_to_road_median_axis.overpass_url
+    try:
+        move_nodes_to_road_median_axis.overpass_url = emulator.url
+        snapped, elapsed = snap(INPUT_FILE, None)
+        assert snapped == expected, "snapping point by point gives other points"
+        print("%-22s %8.2f s  %4d requests" % ('Overpass per point', elapsed, emulator.requests_served))
+
+        trip = load_trip_cached(INPUT_FILE)
+        mask = DEFAULT_FILTER.mask(trip)
+
+        # snap_trip prefetches the tiles of the trip itself
+        served = emulator.requests_served
+        snapped, elapsed = snap(INPUT_FILE, None, directory)
+        tiles = open_tiles(directory)
+        needed = len(tiles.tiles_around(trip['LATITUDE'][mask], trip['LONGITUDE'][mask], PREFETCH_MARGIN))
+        assert snapped == expected, "OverpassTiles cold gives other points"
+        assert tiles.requests == emulator.requests_served - served
+        assert tiles.requests == math.ceil(needed / MAX_TILES_PER_REQUEST), "snap_trip requested tiles while snapping"
+        print("%-22s %8.2f s  %4d requests" % ('OverpassTiles cold', elapsed, tiles.requests))
+
+        tiles = OverpassTiles(directory, url=emulator.url)
+        served = emulator.requests_served
+        started = time.perf_counter()
+        tiles.prefetch(trip['LATITUDE'][mask], trip['LONGITUDE'][mask])
+        snapped = snap(INPUT_FILE, tiles)[0]
+        elapsed = time.perf_counter() - started
+        assert snapped == expected, "OverpassTiles warm gives other points"
+        assert tiles.requests == emulator.requests_served - served == 0
+        print("%-22s %8.2f s  %4d requests" % ('OverpassTiles warm', elapsed, tiles.requests))
+    finally:
+        move_nodes_to_road_median_axis.overpass_url = overpass_url
+        emulator.stop()
+        shutil.rmtree(directory)
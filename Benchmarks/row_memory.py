@@ -0,0 +1,85 @@
+import csv
+import time
+import tracemalloc
+
+from DataPreprocessing.Model.AutomotiveDataRow import AutomotiveDataRow, CSV_COLUMNS
+from DataPreprocessing.Model.TripData import load_trip
+
+# the largest trip in Data/Raw
+INPUT_FILE = 'Data/Raw/test15_05_2024_1.csv'
+
+
+# Same attributes as AutomotiveDataRow, kept in a per-instance dict, like AutomotiveDataRow before __slots__
+class DictRow:
+    pass
+
+
+def load_dict_rows(rows):
+    result = []
+    for row in rows:
+        adr = AutomotiveDataRow(*row)
+        d = DictRow()
+        for attribute, value_type in CSV_COLUMNS.values():
+            setattr(d, attribute, getattr(adr, attribute))
+        result.append(d)
+    return result
+
+
+def load_slotted_rows(rows):
+    return [AutomotiveDataRow(*row) for row in rows]
+
+
+# rows with every attribute None, to measure the memory taken by the objects themselves, without the values
+def empty_dict_rows(count):
+    result = []
+    for i in range(count):
+        d = DictRow()
+        for attribute, value_type in CSV_COLUMNS.values():
+            setattr(d, attribute, None)
+        # the dict is built when it is first used, which snapping and corner code eventually do
+        vars(d)
+        result.append(d)
+    return result
+
+
+def empty_slotted_rows(count):
+    return [AutomotiveDataRow() for i in range(count)]
+
+
+# returns: time in s, memory kept by the result in bytes
+def measure(function, *args):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - started
+    kept = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return elapsed, kept, result
+
+
+if __name__ == '__main__':
+    with open(INPUT_FILE, 'r') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        header = next(csv_reader)
+        rows = [(header, row) for row in csv_reader]
+
+    for name, function in [("dict-backed objects", empty_dict_rows), ("slotted objects", empty_slotted_rows)]:
+        elapsed, kept, result = measure(function, len(rows))
+        print("%-22s %8.1f ms  %7.2f MB  %6.0f B/row  (without values)" % (name, elapsed * 1000, kept / 2 ** 20,
+                                                                           kept / len(rows)))
+        del result
+
+    elapsed, kept, dict_rows = measure(load_dict_rows, rows)
+    print("%-22s %8.1f ms  %7.2f MB  %6.0f B/row" % ("dict-backed rows", elapsed * 1000, kept / 2 ** 20,
+                                                     kept / len(rows)))
+    del dict_rows
+
+    elapsed, kept, slotted_rows = measure(load_slotted_rows, rows)
+    print("%-22s %8.1f ms  %7.2f MB  %6.0f B/row" % ("slotted rows", elapsed * 1000, kept / 2 ** 20,
+                                                     kept / len(rows)))
+    del slotted_rows
+
+    elapsed, kept, trip = measure(load_trip, INPUT_FILE)
+    print("%-22s %8.1f ms  %7.2f MB  %6.0f B/row" % ("columnar TripData", elapsed * 1000, kept / 2 ** 20,
+                                                     kept / len(rows)))
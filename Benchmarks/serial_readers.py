@@ -0,0 +1,98 @@
+import threading
+import time
+
+from Accelerometer.Accelerometer import AccelerometerADXL313, AccelerometerException
+from Emulators.accelerometer_emulator import AccelerometerEmulator
+from Emulators.gps_emulator import GPSEmulator
+from Emulators.transports import loopback, PseudoTerminal
+from GPS.gps import read_serial_gps
+
+# seconds each reader is measured for
+DURATION = 3
+
+
+# Creates a transport and a device endpoint, either in-process or through a pseudo-terminal.
+# returns: transport, endpoint, cleanup
+def make_link(kind):
+    if kind == 'loopback':
+        transport, endpoint = loopback()
+        return transport, endpoint, endpoint.close
+    pty = PseudoTerminal()
+    return pty.transport(), pty, pty.close
+
+
+# Measures REQUEST_FRAME round trips per second with AccelerometerADXL313.get_frame
+def accelerometer_polling(kind, duration=DURATION):
+    transport, endpoint, cleanup = make_link(kind)
+    emulator = AccelerometerEmulator(endpoint).start()
+    accelerometer = AccelerometerADXL313('emulated', 115200, transport=transport, reset_delay=0)
+    accelerometer.connect_to_slave()
+
+    frames = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        try:
+            accelerometer.get_frame()
+            frames += 1
+        except AccelerometerException:
+            pass
+
+    accelerometer.close_connection()
+    emulator.stop()
+    cleanup()
+    return frames / duration
+
+
+# Measures the frames per second received in interrupt mode while the emulator streams as fast as the link allows.
+# The link applies back pressure, so the rate is the one the reader sustains.
+def accelerometer_interrupt(kind, duration=DURATION):
+    transport, endpoint, cleanup = make_link(kind)
+    emulator = AccelerometerEmulator(endpoint, interrupt_mode_interval=0).start()
+    accelerometer = AccelerometerADXL313('emulated', 115200, transport=transport, reset_delay=0)
+    accelerometer.connect_to_slave()
+    accelerometer.enable_interrupts()
+
+    time.sleep(0.2)
+    start_seq = accelerometer.get_samples_since(0)[2]
+    time.sleep(duration)
+    end_seq = accelerometer.get_samples_since(0)[2]
+
+    accelerometer.disable_interrupts()
+    accelerometer.close_connection()
+    emulator.stop()
+    cleanup()
+    return (end_seq - start_seq) / duration
+
+
+# Measures the NMEA sentences per second parsed by read_serial_gps while the emulator streams as fast as possible.
+def gps(kind, duration=DURATION):
+    transport, endpoint, cleanup = make_link(kind)
+    emulator = GPSEmulator(endpoint, rate=None).start()
+    stop = threading.Event()
+    counter = [0]
+
+    def count(msg):
+        counter[0] += 1
+
+    reader = threading.Thread(target=read_serial_gps, args=('emulated',),
+                              kwargs={'transport': transport, 'stop_event': stop, 'callback': count})
+    reader.start()
+
+    time.sleep(0.2)
+    start = counter[0]
+    time.sleep(duration)
+    end = counter[0]
+
+    stop.set()
+    emulator.stop()
+    reader.join(2)
+    cleanup()
+    return (end - start) / duration
+
+
+if __name__ == '__main__':
+    for kind in ['loopback', 'pty']:
+        print(kind)
+        print("  accelerometer polling (frames/s):  ", round(accelerometer_polling(kind)))
+        print("  accelerometer interrupt (frames/s):", round(accelerometer_interrupt(kind)))
+        print("  gps (sentences/s):                 ", round(gps(kind)))
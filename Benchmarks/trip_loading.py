@@ -0,0 +1,40 @@
+import csv
+import time
+import tracemalloc
+
+from DataPreprocessing.Model.AutomotiveDataRow import AutomotiveDataRow
+from DataPreprocessing.Model.TripData import load_trip
+
+INPUT_FILE = 'Data/Raw/test15_05_2024_1.csv'
+REPEAT = 5
+
+
+# the loading done by load_csv before the columnar loader, without the sanitization
+def load_rows(file):
+    with open(file, 'r') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        header = next(csv_reader)
+        return [AutomotiveDataRow(header, row) for row in csv_reader], header
+
+
+# returns: best time in s, memory kept by the result in bytes, peak memory while loading in bytes
+def measure(function, *args):
+    best = None
+    for i in range(REPEAT):
+        started = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    result = function(*args)
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, kept, peak
+
+
+if __name__ == '__main__':
+    for name, function in [('AutomotiveDataRow per row', load_rows), ('columnar load_trip', load_trip)]:
+        elapsed, kept, peak = measure(function, INPUT_FILE)
+        print("%-26s %8.1f ms  kept %7.2f MB  peak %7.2f MB" % (name, elapsed * 1000, kept / 2 ** 20, peak / 2 ** 20))
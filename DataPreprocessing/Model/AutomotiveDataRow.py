@@ -1,189 +1,123 @@
 import csv
 
+# csv column -> (AutomotiveDataRow attribute, type of the value)
+CSV_COLUMNS = {
+    'LATEST': ('latest', int),
+    'SPEED': ('speed', float),
+    'LOAD': ('load', float),
+    'MAP': ('MAP', int),
+    'IAT': ('IAT', int),
+    'RPM': ('RPM', float),
+    'DISTANCE': ('distance', float),
+    'FUEL_USED': ('fuel_used', float),
+    'FUEL_CONSUMPTION': ('fuel_consumption', float),
+    'INSTANT_FUEL_CONSUMPTION': ('instant_fuel_consumption', float),
+    'LATITUDE': ('latitude', float),
+    'LONGITUDE': ('longitude', float),
+    'ALTITUDE': ('altitude', float),
+    'HEADING': ('heading', float),
+    'SPEED_GPS': ('speed_gps', float),
+    'TIME_GPS': ('time_gps', str),
+    'X': ('x', int),
+    'Y': ('y', int),
+    'Z': ('z', int),
+    'AAT': ('AAT', float),
+    'AAP': ('AAP', float),
+}
 
-# Wrapper class for rows in csv files. Makes it easier to process the data read
+
+# Parser and writer of AutomotiveDataRows for a given csv header. The header is resolved once, instead of comparing each
+# column name for every cell.
+class RowCodec:
+    _header = None
+    _parsers = None
+    _attributes = None
+
+    def __init__(self, header):
+        self._header = tuple(header)
+        # (index in the row, attribute, type) for every column AutomotiveDataRow knows
+        self._parsers = [(i, CSV_COLUMNS[name][0], CSV_COLUMNS[name][1]) for i, name in enumerate(header)
+                         if name in CSV_COLUMNS]
+        # attribute for every column, None for the columns that are not loaded
+        self._attributes = [CSV_COLUMNS[name][0] if name in CSV_COLUMNS else None for name in header]
+
+    @property
+    def header(self):
+        return list(self._header)
+
+    # Sets the attributes of adr from a csv row. Values that cannot be parsed are left as they are, None by default.
+    def parse(self, row, adr=None):
+        assert len(self._header) == len(row)
+        if adr is None:
+            adr = AutomotiveDataRow()
+        for i, attribute, value_type in self._parsers:
+            value = row[i]
+            if value_type is str:
+                setattr(adr, attribute, value)
+                continue
+            if value == '':
+                continue
+            try:
+                setattr(adr, attribute, value_type(value))
+            except ValueError:
+                pass
+        return adr
+
+    # returns: list - the values of adr in the order of the header. Columns that are not loaded are None, which keeps
+    #          the row aligned with the header, i.e. for accelerometer summaries
+    def format(self, adr):
+        return [None if attribute is None else getattr(adr, attribute) for attribute in self._attributes]
+
+
+_codecs = {}
+
+
+# Gets the RowCodec for a header. Codecs are compiled once per header and reused.
+def compile_header(header):
+    key = tuple(header)
+    codec = _codecs.get(key)
+    if codec is None:
+        codec = RowCodec(key)
+        _codecs[key] = codec
+    return codec
+
+
+# Wrapper class for rows in csv files. Makes it easier to process the data read.
+# The class uses __slots__, since trips are loaded as thousands of rows and a per-instance dict would take most of the
+# memory.
 class AutomotiveDataRow:
-    latest = None
-    speed = None
-    load = None
-    MAP = None
-    IAT = None
-    RPM = None
-    distance = None
-    fuel_used = None
-    fuel_consumption = None
-    instant_fuel_consumption = None
-    latitude = None
-    longitude = None
-    altitude = None
-    heading = None
-    speed_gps = None
-    time_gps = None
-    x = None
-    y = None
-    z = None
-    AAP = None
-    AAT = None
+    __slots__ = tuple(attribute for attribute, value_type in CSV_COLUMNS.values())
 
     def __init__(self, header=None, row=None):
+        self.latest = None
+        self.speed = None
+        self.load = None
+        self.MAP = None
+        self.IAT = None
+        self.RPM = None
+        self.distance = None
+        self.fuel_used = None
+        self.fuel_consumption = None
+        self.instant_fuel_consumption = None
+        self.latitude = None
+        self.longitude = None
+        self.altitude = None
+        self.heading = None
+        self.speed_gps = None
+        self.time_gps = None
+        self.x = None
+        self.y = None
+        self.z = None
+        self.AAP = None
+        self.AAT = None
         if header is not None and row is not None:
             self.load_from_csv_row(header, row)
 
     def load_from_csv_row(self, header, row):
-        assert len(header) == len(row)
-        for i in range(len(header)):
-            if header[i] == 'LATITUDE':
-                try:
-                    self.latitude = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'LONGITUDE':
-                try:
-                    self.longitude = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'ALTITUDE':
-                try:
-                    self.altitude = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'HEADING':
-                try:
-                    self.heading = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'SPEED':
-                try:
-                    self.speed = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'SPEED_GPS':
-                try:
-                    self.speed_gps = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'TIME_GPS':
-                try:
-                    self.time_gps = row[i]
-                except ValueError:
-                    pass
-            elif header[i] == 'X':
-                try:
-                    self.x = int(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'Y':
-                try:
-                    self.y = int(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'Z':
-                try:
-                    self.z = int(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'AAP':
-                try:
-                    self.AAP = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'AAT':
-                try:
-                    self.AAT = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'LOAD':
-                try:
-                    self.load = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'MAP':
-                try:
-                    self.MAP = int(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'IAT':
-                try:
-                    self.IAT = int(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'RPM':
-                try:
-                    self.RPM = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'DISTANCE':
-                try:
-                    self.distance = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'FUEL_USED':
-                try:
-                    self.fuel_used = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'FUEL_CONSUMPTION':
-                try:
-                    self.fuel_consumption = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'INSTANT_FUEL_CONSUMPTION':
-                try:
-                    self.instant_fuel_consumption = float(row[i])
-                except ValueError:
-                    pass
-            elif header[i] == 'LATEST':
-                try:
-                    self.latest = int(row[i])
-                except ValueError:
-                    pass
+        compile_header(header).parse(row, self)
 
     def get_csv_row(self, header):
-        row = []
-        for i in range(len(header)):
-            if header[i] == 'LATITUDE':
-                row.append(self.latitude)
-            elif header[i] == 'LONGITUDE':
-                row.append(self.longitude)
-            elif header[i] == 'ALTITUDE':
-                row.append(self.altitude)
-            elif header[i] == 'HEADING':
-                row.append(self.heading)
-            elif header[i] == 'SPEED':
-                row.append(self.speed)
-            elif header[i] == 'SPEED_GPS':
-                row.append(self.speed_gps)
-            elif header[i] == 'TIME_GPS':
-                row.append(self.time_gps)
-            elif header[i] == 'X':
-                row.append(self.x)
-            elif header[i] == 'Y':
-                row.append(self.y)
-            elif header[i] == 'Z':
-                row.append(self.z)
-            elif header[i] == 'AAP':
-                row.append(self.AAP)
-            elif header[i] == 'AAT':
-                row.append(self.AAT)
-            elif header[i] == 'LOAD':
-                row.append(self.load)
-            elif header[i] == 'MAP':
-                row.append(self.MAP)
-            elif header[i] == 'IAT':
-                row.append(self.IAT)
-            elif header[i] == 'RPM':
-                row.append(self.RPM)
-            elif header[i] == 'DISTANCE':
-                row.append(self.distance)
-            elif header[i] == 'FUEL_USED':
-                row.append(self.fuel_used)
-            elif header[i] == 'FUEL_CONSUMPTION':
-                row.append(self.fuel_consumption)
-            elif header[i] == 'INSTANT_FUEL_CONSUMPTION':
-                row.append(self.instant_fuel_consumption)
-            elif header[i] == 'LATEST':
-                row.append(self.latest)
-        return row
+        return compile_header(header).format(self)
 
     def is_sanitary(self, altitude=False, latitude=True, longitude=True, heading=False, speed=True, speed_gps=False,
                     time_gps=False, x=True, y=True, z=True, AAP=False, AAT=False, MAP=True, IAT=True, RPM=True,
@@ -233,24 +167,77 @@ class AutomotiveDataRow:
         return True
 
 
-# Loads AutomotiveDataRows from csv
-def load_csv(file):
-    csv_file = open(file, 'r')
-    csv_reader = csv.reader(csv_file, delimiter=',')
-    header = next(csv_reader)
+# Loads AutomotiveDataRows from csv, keeping the rows that pass row_filter. By default the rows is_sanitary accepts with
+# speed_threshold=10. The csv is parsed once and read from its binary cache afterwards.
+# input: row_filter - RowFilter, None for DEFAULT_FILTER
+def load_csv(file, row_filter=None):
+    # imported here, TripData and RowFilter build on this module
+    from DataPreprocessing.Model.TripData import load_trip_cached
+    from DataPreprocessing.Model.RowFilter import DEFAULT_FILTER
+
+    if row_filter is None:
+        row_filter = DEFAULT_FILTER
+    trip = load_trip_cached(file)
+    header = trip.header
     print(header)
-    automotive_data = []
-    for row in csv_reader:
-        adr = AutomotiveDataRow(header, row)
-        if adr.is_sanitary(speed_threshold=10):
-            automotive_data.append(adr)
-    return automotive_data, header
+    return trip.rows(row_filter.mask(trip)), header
+
+
+# Iterates over the AutomotiveDataRows of a csv in chunks, keeping only one chunk in memory. The rows are the ones
+# load_csv returns, in the same order.
+# input: chunk_size - amount of csv rows read at a time
+#        row_filter - RowFilter, None for DEFAULT_FILTER
+# returns: generator of lists of AutomotiveDataRow. Chunks where every row was filtered out are skipped
+def iter_csv(file, chunk_size=4096, row_filter=None):
+    from DataPreprocessing.Model.TripData import iter_trip
+    from DataPreprocessing.Model.RowFilter import DEFAULT_FILTER
+
+    if row_filter is None:
+        row_filter = DEFAULT_FILTER
+    for chunk in iter_trip(file, chunk_size, row_filter):
+        if len(chunk) > 0:
+            yield chunk.rows()
+
+
+# Writes AutomotiveDataRows to a csv as they are produced. Use it as a context manager, or call close.
+class CsvWriter:
+    _file = None
+    _writer = None
+    _codec = None
+    _count = None
+
+    def __init__(self, file, header):
+        self._codec = compile_header(header)
+        self._file = open(file, 'w', newline='')
+        self._writer = csv.writer(self._file, delimiter=',')
+        self._writer.writerow(header)
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def count(self):
+        return self._count
+
+    def write(self, adr):
+        self._writer.writerow(self._codec.format(adr))
+        self._count += 1
+
+    def write_rows(self, automotive_data):
+        for adr in automotive_data:
+            self.write(adr)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
 
 # Writes AutomotiveDataRows to csv
 def write_to_csv(automotive_data, header, file):
-    csv_file = open(file, 'w', newline='')
-    csv_writer = csv.writer(csv_file, delimiter=',')
-    csv_writer.writerow(header)
-    for adr in automotive_data:
-        row = adr.get_csv_row(header)
-        csv_writer.writerow(row)
+    with CsvWriter(file, header) as writer:
+        writer.write_rows(automotive_data)
@@ -2,11 +2,13 @@ import math
 
 import numpy
 
-from DataPreprocessing.Model.Node import Node
+from DataPreprocessing.Model.Node import NodeStore
 
 
 # Corner and Node classes that keep the properties calculated.
 # Node class should not be used outside of this file.
+# The sequences a Corner gives out, nodes, radiuses, centrifugals, acceleration_decelerations and rise_run, are tuples,
+# shared without copying.
 class Corner:
     _nodes = None
     _radiuses = None
@@ -41,13 +43,57 @@ class Corner:
     _max_load = None
     _avg_load = None
     _median_load = None
+    _decelerated_speed = None
+    _accelerated_speed = None
+    # names of the _compute_ methods that already ran. Each group of properties is computed the first time one of them
+    # is read
+    _computed = None
+    # NodeStore shared by all the nodes and their indices in it, None if the nodes come from different stores
+    _store = None
+    _node_indices = None
+    # True if the nodes follow each other in the store, their samples are then a slice of the columns
+    _contiguous = False
 
     def __init__(self, nodes, direction, radiuses):
         assert (len(nodes) == len(radiuses) + 1)
-        self._nodes = nodes
+        self._nodes = tuple(nodes)
         self._direction = direction
-        self._radiuses = radiuses
-        self._compute_all()
+        self._radiuses = tuple(radiuses)
+        self._computed = set()
+        self._find_store()
+        # the MAP, load and accelerometer statistics cannot be computed without values. Checked here, so corners
+        # without data are still rejected when they are created
+        if not any(n.sample_count > 0 for n in nodes[:len(nodes) - 1]) or not any(n.sample_count > 0 for n in nodes):
+            raise ValueError
+
+    def _find_store(self):
+        store = self._nodes[0].store if len(self._nodes) > 0 else None
+        if store is not None and all(n.store is store for n in self._nodes):
+            self._store = store
+            indices = [n.index for n in self._nodes]
+            self._node_indices = numpy.array(indices, dtype=numpy.int64)
+            self._contiguous = indices == list(range(indices[0], indices[0] + len(indices)))
+
+    # returns: numpy array - the samples of the nodes, one node after the other. Without the last node if last_node
+    #          is False, since the last node of a corner is the first of the next one. A read-only view if the nodes
+    #          are contiguous in the store, a copy otherwise
+    def _samples(self, name, last_node=True):
+        count = len(self._nodes) if last_node else len(self._nodes) - 1
+        if self._contiguous and count > 0:
+            first = self._nodes[0].index
+            return self._store.samples_range(name, first, first + count)
+        if self._store is not None:
+            return self._store.take(name, self._node_indices[:count])
+        parts = [n.samples(name) for n in self._nodes[:count]]
+        if len(parts) == 0:
+            return numpy.array([])
+        return numpy.concatenate(parts)
+
+    # runs a _compute_ method, if it did not run already
+    def _compute(self, group):
+        if group not in self._computed:
+            getattr(self, group)()
+            self._computed.add(group)
 
     def _compute_radius_properties(self):
         if len(self._radiuses) == 0:
@@ -78,56 +124,20 @@ class Corner:
             self._avg_radius = self._median_radius = 1
 
     def _compute_speed_properties(self):
-        if len(self._nodes) == 0:
-            return
-
-        sum = 0
-        cnt = 0
-        self._min_speed = math.inf
-        self._max_speed = 0
-        speeds = []
-        for sp in self._nodes[:len(self._nodes) - 1]:
-            for s in sp.speeds:
-                sum += s
-                cnt += 1
-                if s > self._max_speed:
-                    self._max_speed = s
-                if s < self.min_speed:
-                    self._min_speed = s
-                speeds.append(s)
-
-        if cnt == 0:
-            return
-
-        self._avg_speed = sum / cnt
-        self._median_speed = numpy.median(speeds)
+        _compute_speed_properties([self])
 
     def _compute_fuel_distance(self):
         self._fuel_used = self._nodes[-1].min_fuel_used - self._nodes[0].min_fuel_used
         self._distance_traveled = self._nodes[-1].min_distance - self._nodes[0].min_distance
 
     def _compute_maps_and_loads(self):
-        maps = []
-        loads = []
-
-        for n in self._nodes[:len(self._nodes) - 1]:
-            maps = maps + n.maps
-            loads = loads + n.calc_loads
-
-        self._min_map = min(maps)
-        self._max_map = max(maps)
-        self._avg_map = numpy.mean(maps)
-        self._median_map = numpy.median(maps)
-        self._min_load = min(loads)
-        self._max_load = max(loads)
-        self._avg_load = numpy.mean(loads)
-        self._median_load = numpy.median(loads)
+        _compute_maps_and_loads([self])
 
     def _compute_rise_run(self):
         if len(self._nodes) <= 1:
             return
 
-        self._rise_run = []
+        self._rise_run = ()
 
         altitudes = []
 
@@ -138,12 +148,14 @@ class Corner:
         if len(altitudes) <= 1:
             return
 
+        rise_run = []
         for i in range(len(altitudes) - 1):
             node1 = altitudes[i]
             node2 = altitudes[i + 1]
             run = node2.min_distance - node1.min_distance
             rise = node2.altitude - node1.altitude
-            self._rise_run.append(rise / run)
+            rise_run.append(rise / run)
+        self._rise_run = tuple(rise_run)
 
         self._max_rise = numpy.max(self._rise_run)
         self._min_rise = numpy.min(self._rise_run)
@@ -151,36 +163,26 @@ class Corner:
         self._median_rise = numpy.median(self._rise_run)
 
     def _compute_array_properties(self):
-        Xs = []
-        Ys = []
-
-        for i in self._nodes:
-            for j in i.Xs:
-                Xs.append(abs(j))
-            for j in i.Ys:
-                Ys.append(j)
-
-        self._acceleration_decelerations = Ys
-        self._centrifugals = Xs
+        _compute_array_properties([self])
 
-        self._max_centrifugal = max(self._centrifugals)
-        self._median_centrifugal = numpy.median(self._centrifugals)
-        self._avg_centrifugal = sum(self._centrifugals) / len(self._centrifugals)
+    # computed like the rest of the statistics, but not exported by to_array
+    def _compute_speed_changes(self):
+        speeds = self._samples('speeds')
+        decreases = speeds[:-1] - speeds[1:]
+        self._decelerated_speed = sum(decreases[decreases > 0].tolist())
 
-        self._max_acceleration = max(self._acceleration_decelerations)
-        self._max_deceleration = min(self._acceleration_decelerations)
+        speeds = self._samples('speeds', last_node=False)
+        increases = speeds[1:] - speeds[:-1]
+        self._accelerated_speed = sum(increases[increases > 0].tolist())
 
     # computes properties for corner
     def _compute_all(self):
-        self._compute_radius_properties()
-        self._compute_fuel_distance()
-        self._compute_maps_and_loads()
-        self._compute_array_properties()
-        self._compute_speed_properties()
-        self._compute_rise_run()
+        for group in _GROUPS:
+            self._compute(group)
 
     # encodes object to array for easier json parsing
     def to_array(self):
+        self._compute_all()
         nodes = []
 
         for i in self._nodes:
@@ -197,15 +199,14 @@ class Corner:
     # loads object from an array encoded with the to_array method for easier json parsing
     @classmethod
     def from_array(cls, array):
-        nodes = array[0]
-        ns = []
-
-        for node in nodes:
-            n = Node.from_array(node)
-            ns.append(n)
-
-        c = Corner(ns, '', array[1])
-
+        ns = NodeStore.from_arrays(array[0]).nodes()
+
+        # the properties are all in the array, none is computed
+        c = cls.__new__(cls)
+        c._nodes = tuple(ns)
+        c._find_store()
+        c._radiuses = tuple(array[1])
+        c._computed = set(_GROUPS)
         c._direction = array[2]
         c._max_radius = array[3]
         c._min_radius = array[4]
@@ -215,16 +216,16 @@ class Corner:
         c._min_speed = array[8]
         c._avg_speed = array[9]
         c._median_speed = array[10]
-        c._acceleration_decelerations = array[11]
+        c._acceleration_decelerations = tuple(array[11])
         c._max_acceleration = array[12]
         c._max_deceleration = array[13]
-        c._centrifugals = array[14]
+        c._centrifugals = tuple(array[14])
         c._max_centrifugal = array[15]
         c._median_centrifugal = array[16]
         c._avg_centrifugal = array[17]
         c._fuel_used = array[18]
         c._distance_traveled = array[19]
-        c._rise_run = array[20]
+        c._rise_run = None if array[20] is None else tuple(array[20])
         c._max_rise = array[21]
         c._min_rise = array[22]
         c._avg_rise = array[23]
@@ -240,61 +241,67 @@ class Corner:
 
         return c
 
+    # returns: dict - every statistic of STATISTICS and SEQUENCES by name
+    def statistics(self):
+        self._compute_all()
+        return {name: getattr(self, '_' + name) for name in STATISTICS + SEQUENCES}
+
+    # builds a corner from its nodes and the statistics returned by statistics(), without computing anything
+    @classmethod
+    def from_statistics(cls, nodes, direction, radiuses, statistics):
+        c = cls.__new__(cls)
+        c._nodes = tuple(nodes)
+        c._find_store()
+        c._radiuses = tuple(radiuses)
+        c._direction = direction
+        c._computed = set(_GROUPS)
+        for name in STATISTICS + SEQUENCES:
+            setattr(c, '_' + name, statistics[name])
+        return c
+
     @property
     def entry_speed(self):
-        return self._nodes[0].speeds[0]
+        return self._nodes[0].speeds[0].item()
 
     @property
     def exit_speed(self):
-        return self._nodes[-1].speeds[0]
+        return self._nodes[-1].speeds[0].item()
 
+    # sum of the speed decreases between successive samples
     @property
     def decelerated_speed(self):
-        speed = 0
-        prev_speed = self._nodes[0].speeds[0]
-        for i in self._nodes:
-            for j in i.speeds:
-                if prev_speed > j:
-                    speed += prev_speed - j
-                prev_speed = j
-
-        return speed
+        self._compute('_compute_speed_changes')
+        return self._decelerated_speed
 
+    # sum of the speed increases between successive samples, without the last node
     @property
     def accelerated_speed(self):
-        speed = 0
-        prev_speed = self._nodes[0].speeds[0]
-        for i in self._nodes[:len(self._nodes) - 1]:
-            for j in i.speeds:
-                if prev_speed < j:
-                    speed += j - prev_speed
-                prev_speed = j
-
-        return speed
+        self._compute('_compute_speed_changes')
+        return self._accelerated_speed
 
     @property
     def entry_map(self):
-        return self._nodes[0].maps[0]
+        return self._nodes[0].maps[0].item()
 
     @property
     def exit_map(self):
-        return self._nodes[-1].maps[0]
+        return self._nodes[-1].maps[0].item()
 
     @property
     def entry_load(self):
-        return self._nodes[0].loads[0]
+        return self._nodes[0].calc_loads[0].item()
 
     @property
     def exit_load(self):
-        return self._nodes[-1].loads[0]
+        return self._nodes[-1].calc_loads[0].item()
 
     @property
     def nodes(self):
-        return self._nodes.copy()
+        return self._nodes
 
     @property
     def radiuses(self):
-        return self._radiuses.copy()
+        return self._radiuses
 
     @property
     def direction(self):
@@ -302,121 +309,269 @@ class Corner:
 
     @property
     def max_radius(self):
+        self._compute('_compute_radius_properties')
         return self._max_radius
 
     @property
     def min_radius(self):
+        self._compute('_compute_radius_properties')
         return self._min_radius
 
     @property
     def avg_radius(self):
+        self._compute('_compute_radius_properties')
         return self._avg_radius
 
     @property
     def median_radius(self):
+        self._compute('_compute_radius_properties')
         return self._median_radius
 
     @property
     def max_speed(self):
+        self._compute('_compute_speed_properties')
         return self._max_speed
 
     @property
     def min_speed(self):
+        self._compute('_compute_speed_properties')
         return self._min_speed
 
     @property
     def avg_speed(self):
+        self._compute('_compute_speed_properties')
         return self._avg_speed
 
     @property
     def median_speed(self):
+        self._compute('_compute_speed_properties')
         return self._median_speed
 
     @property
     def acceleration_decelerations(self):
+        self._compute('_compute_array_properties')
         return self._acceleration_decelerations
 
     @property
     def max_acceleration(self):
+        self._compute('_compute_array_properties')
         return self._max_acceleration
 
     @property
     def max_deceleration(self):
+        self._compute('_compute_array_properties')
         return self._max_deceleration
 
     @property
     def centrifugals(self):
-        return self._centrifugals.copy()
+        self._compute('_compute_array_properties')
+        return self._centrifugals
 
     @property
     def max_centrifugal(self):
+        self._compute('_compute_array_properties')
         return self._max_centrifugal
 
     @property
     def median_centrifugal(self):
+        self._compute('_compute_array_properties')
         return self._median_centrifugal
 
     @property
     def avg_centrifugal(self):
+        self._compute('_compute_array_properties')
         return self._avg_centrifugal
 
     @property
     def fuel_used(self):
+        self._compute('_compute_fuel_distance')
         return self._fuel_used
 
     @property
     def distance_traveled(self):
+        self._compute('_compute_fuel_distance')
         return self._distance_traveled
 
     @property
     def rise_run(self):
+        self._compute('_compute_rise_run')
         return self._rise_run
 
     @property
     def max_rise(self):
+        self._compute('_compute_rise_run')
         return self._max_rise
 
     @property
     def min_rise(self):
+        self._compute('_compute_rise_run')
         return self._min_rise
 
     @property
     def avg_rise(self):
+        self._compute('_compute_rise_run')
         return self._avg_rise
 
     @property
     def median_rise(self):
+        self._compute('_compute_rise_run')
         return self._median_rise
 
     @property
     def min_map(self):
+        self._compute('_compute_maps_and_loads')
         return self._min_map
 
     @property
     def max_map(self):
+        self._compute('_compute_maps_and_loads')
         return self._max_map
 
     @property
     def avg_map(self):
+        self._compute('_compute_maps_and_loads')
         return self._avg_map
 
     @property
     def median_map(self):
+        self._compute('_compute_maps_and_loads')
         return self._median_map
 
     @property
     def min_load(self):
+        self._compute('_compute_maps_and_loads')
         return self._min_load
 
     @property
     def max_load(self):
+        self._compute('_compute_maps_and_loads')
         return self._max_load
 
     @property
     def avg_load(self):
+        self._compute('_compute_maps_and_loads')
         return self._avg_load
 
     @property
     def median_load(self):
+        self._compute('_compute_maps_and_loads')
         return self._median_load
 
+
+
+# Gets the samples of many corners one corner after the other.
+# returns: values - numpy array, starts - numpy array - index of the first sample of each corner, counts - numpy array
+def _segments(corners, name, last_node=True):
+    parts = [c._samples(name, last_node) for c in corners]
+    counts = numpy.array([len(p) for p in parts], dtype=numpy.int64)
+    starts = numpy.cumsum(counts) - counts
+    return numpy.concatenate(parts), starts, counts
+
+
+# Segmented reductions: one result for each segment [starts[i], starts[i] + counts[i]) of values. Every segment must have
+# values. The results are the ones min, max and numpy.median give for each segment on its own.
+def _segment_min(values, starts):
+    return numpy.minimum.reduceat(values, starts).tolist()
+
+
+def _segment_max(values, starts):
+    return numpy.maximum.reduceat(values, starts).tolist()
+
+
+def _segment_median(values, starts, counts):
+    segment = numpy.repeat(numpy.arange(len(starts)), counts)
+    ordered = values[numpy.lexsort((values, segment))]
+    # the middle value, or the mean of the 2 middle values, like numpy.median
+    return ((ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2).tolist()
+
+
+# Computes the speed statistics of many corners, over the samples of every node but the last.
+def _compute_speed_properties(corners):
+    values, starts, counts = _segments(corners, 'speeds', last_node=False)
+    for c in corners:
+        c._min_speed = math.inf
+        c._max_speed = 0
+
+    present = counts > 0
+    corners = [c for c, p in zip(corners, present) if p]
+    if len(corners) == 0:
+        return
+    starts = starts[present]
+    counts = counts[present]
+
+    mins = _segment_min(values, starts)
+    maxs = _segment_max(values, starts)
+    medians = _segment_median(values, starts, counts)
+    for i, c in enumerate(corners):
+        c._max_speed = maxs[i] if maxs[i] > 0 else 0
+        c._min_speed = mins[i]
+        # summed in order, like the samples were always summed
+        c._avg_speed = sum(values[starts[i]:starts[i] + counts[i]].tolist()) / counts[i].item()
+        c._median_speed = medians[i]
+
+
+# Computes the MAP and load statistics of many corners, over the samples of every node but the last.
+def _compute_maps_and_loads(corners):
+    for name, prefix in [('maps', '_map'), ('calc_loads', '_load')]:
+        values, starts, counts = _segments(corners, name, last_node=False)
+        if numpy.any(counts == 0):
+            raise ValueError
+        mins = _segment_min(values, starts)
+        maxs = _segment_max(values, starts)
+        medians = _segment_median(values, starts, counts)
+        for i, c in enumerate(corners):
+            setattr(c, '_min' + prefix, mins[i])
+            setattr(c, '_max' + prefix, maxs[i])
+            setattr(c, '_avg' + prefix, numpy.mean(values[starts[i]:starts[i] + counts[i]]))
+            setattr(c, '_median' + prefix, medians[i])
+
+
+# Computes the accelerometer statistics of many corners, over the samples of every node.
+def _compute_array_properties(corners):
+    xs, starts, counts = _segments(corners, 'Xs')
+    ys = _segments(corners, 'Ys')[0]
+    if numpy.any(counts == 0):
+        raise ValueError
+    xs = numpy.abs(xs)
+
+    max_centrifugals = _segment_max(xs, starts)
+    median_centrifugals = _segment_median(xs, starts, counts)
+    max_accelerations = _segment_max(ys, starts)
+    max_decelerations = _segment_min(ys, starts)
+    for i, c in enumerate(corners):
+        c._centrifugals = tuple(xs[starts[i]:starts[i] + counts[i]].tolist())
+        c._acceleration_decelerations = tuple(ys[starts[i]:starts[i] + counts[i]].tolist())
+        c._max_centrifugal = max_centrifugals[i]
+        c._median_centrifugal = median_centrifugals[i]
+        c._avg_centrifugal = sum(c._centrifugals) / len(c._centrifugals)
+        c._max_acceleration = max_accelerations[i]
+        c._max_deceleration = max_decelerations[i]
+
+
+# Computes every statistic of many corners, i.e. all the corners of a trip before exporting them. The statistics over
+# the samples are computed for all the corners at once, with segmented reductions, instead of corner by corner.
+def compute_statistics(corners):
+    for group, function in [('_compute_speed_properties', _compute_speed_properties),
+                            ('_compute_maps_and_loads', _compute_maps_and_loads),
+                            ('_compute_array_properties', _compute_array_properties)]:
+        pending = [c for c in corners if group not in c._computed]
+        if len(pending) > 0:
+            function(pending)
+            for c in pending:
+                c._computed.add(group)
+
+    for c in corners:
+        c._compute_all()
+
+
+# the statistics of a corner that are single values
+STATISTICS = ['max_radius', 'min_radius', 'avg_radius', 'median_radius', 'max_speed', 'min_speed', 'avg_speed',
+              'median_speed', 'max_acceleration', 'max_deceleration', 'max_centrifugal', 'median_centrifugal',
+              'avg_centrifugal', 'fuel_used', 'distance_traveled', 'max_rise', 'min_rise', 'avg_rise', 'median_rise',
+              'min_map', 'max_map', 'avg_map', 'median_map', 'min_load', 'max_load', 'avg_load', 'median_load']
+# the statistics of a corner that are tuples of values. rise_run can be None
+SEQUENCES = ['acceleration_decelerations', 'centrifugals', 'rise_run']
+
+# the _compute_ methods of Corner, in the order _compute_all runs them
+_GROUPS = ['_compute_radius_properties', '_compute_fuel_distance', '_compute_maps_and_loads', '_compute_array_properties',
+           '_compute_speed_properties', '_compute_rise_run']
@@ -0,0 +1,180 @@
+import json
+import math
+
+import numpy
+
+from DataPreprocessing.Model.Corner import Corner, STATISTICS, SEQUENCES, compute_statistics
+from DataPreprocessing.Model.Node import NodeStore, SAMPLE_COLUMNS, NODE_VALUES
+
+# Binary file of the corners of a trip. The file starts with MAGIC, the format version as uint32 and the length of a
+# json header as uint64, followed by the json header and by the arrays, each aligned to ALIGNMENT bytes. The header
+# gives the number of corners, their directions and the dtype, length and position of every array:
+#   statistic columns - one value per corner for each of Corner STATISTICS
+#   sequences - the values of every corner one after the other, and <name>_offsets, one more than the corners
+#   node_offsets - the nodes of corner i are [node_offsets[i], node_offsets[i + 1])
+#   node values - one value per node for each of NODE_VALUES
+#   sample_offsets and sample columns - the samples of node i are [sample_offsets[i], sample_offsets[i + 1])
+# Values that are None are stored as NaN. Columns that only hold integers are int64, the rest float64. A float64 column
+# holding some integers, like max_fuel_used which is 0 for a node without samples, has a <name>_integers mask so they
+# are read back as integers. The reader maps the file in memory, so the samples of the nodes are read from the file only when they are used.
+
+MAGIC = b'OBDCORN\0'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+CORNER_FILE_EXTENSION = '.corners'
+_PREAMBLE = len(MAGIC) + 4 + 8
+
+
+# a ValueError, so DataCache rebuilds a cache holding an unreadable corner file
+class CornerFileException(ValueError):
+    pass
+
+
+def _is_integer(value):
+    return isinstance(value, (int, numpy.integer)) and not isinstance(value, bool)
+
+
+# Adds the array of a list of values to the arrays written to the file
+def _encode(arrays, name, values):
+    integers = [_is_integer(v) for v in values]
+    if len(values) > 0 and all(integers):
+        arrays[name] = numpy.array(values, dtype=numpy.int64)
+        return
+    arrays[name] = numpy.array([math.nan if v is None else v for v in values], dtype=numpy.float64)
+    if any(integers):
+        arrays[name + '_integers'] = numpy.array(integers, dtype=numpy.int8)
+
+
+# Converts an array read from the file back to the list of values
+def _decode(arrays, name):
+    array = arrays[name]
+    values = array.tolist()
+    if array.dtype.kind != 'f':
+        return values
+    values = [None if v != v else v for v in values]
+    if name + '_integers' in arrays:
+        for i in numpy.flatnonzero(arrays[name + '_integers']).tolist():
+            values[i] = int(values[i])
+    return values
+
+
+def _samples_array(array):
+    if array.dtype.kind == 'O':
+        return numpy.array([math.nan if v is None else v for v in array.tolist()], dtype=numpy.float64)
+    return array
+
+
+# Writes corners in the binary format. Use CORNER_FILE_EXTENSION.
+def write_corners_binary(corners, output_file):
+    compute_statistics(corners)
+    statistics = [c.statistics() for c in corners]
+    arrays = {}
+
+    for name in STATISTICS:
+        _encode(arrays, name, [s[name] for s in statistics])
+
+    sequences = {'radiuses': [c.radiuses for c in corners]}
+    for name in SEQUENCES:
+        sequences[name] = [s[name] for s in statistics]
+    for name, values in sequences.items():
+        lengths = [0 if v is None else len(v) for v in values]
+        _encode(arrays, name, [value for v in values if v is not None for value in v])
+        arrays[name + '_offsets'] = numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int64)
+    arrays['rise_run_none'] = numpy.array([s['rise_run'] is None for s in statistics], dtype=numpy.int8)
+
+    nodes = [n for c in corners for n in c.nodes]
+    arrays['node_offsets'] = numpy.concatenate([[0], numpy.cumsum([len(c.nodes) for c in corners])]).astype(numpy.int64)
+    for name in NODE_VALUES:
+        _encode(arrays, 'node_' + name, [getattr(n, name) for n in nodes])
+    arrays['sample_offsets'] = numpy.concatenate([[0], numpy.cumsum([n.sample_count for n in nodes])]).astype(
+        numpy.int64)
+    for name in SAMPLE_COLUMNS:
+        parts = [_samples_array(c._samples(name)) for c in corners]
+        arrays['samples_' + name] = numpy.concatenate(parts) if len(parts) > 0 else numpy.array([])
+
+    header = {'corners': len(corners), 'directions': [c.direction for c in corners], 'arrays': {}}
+    position = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'length': len(array), 'offset': position}
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    encoded = json.dumps(header).encode()
+    start = -(-(_PREAMBLE + len(encoded)) // ALIGNMENT) * ALIGNMENT
+    with open(output_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(numpy.uint32(FORMAT_VERSION).tobytes())
+        f.write(numpy.uint64(len(encoded)).tobytes())
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(start + header['arrays'][name]['offset'])
+            f.write(numpy.ascontiguousarray(array).tobytes())
+        f.truncate(start + position)
+
+
+# returns: boolean - the file starts like a binary corner file
+def is_corner_file(file):
+    with open(file, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# Reads the arrays of a binary corner file.
+# input: mmap - boolean - map the file in memory instead of reading it
+# returns: header, dict name -> numpy array. Mapped arrays are read-only
+# raises: CornerFileException - the file is not a corner file or has another version
+def read_arrays(file, mmap=True):
+    with open(file, 'rb') as f:
+        preamble = f.read(_PREAMBLE)
+        if len(preamble) < _PREAMBLE or preamble[:len(MAGIC)] != MAGIC:
+            raise CornerFileException("Not a corner file: " + file)
+        version = int(numpy.frombuffer(preamble, dtype=numpy.uint32, count=1, offset=len(MAGIC))[0])
+        if version != FORMAT_VERSION:
+            raise CornerFileException("Unsupported corner file version %d: %s" % (version, file))
+        length = int(numpy.frombuffer(preamble, dtype=numpy.uint64, count=1, offset=len(MAGIC) + 4)[0])
+        header = json.loads(f.read(length).decode())
+        start = -(-(_PREAMBLE + length) // ALIGNMENT) * ALIGNMENT
+
+        if mmap:
+            data = numpy.memmap(file, dtype=numpy.uint8, mode='r')
+        else:
+            f.seek(0)
+            data = numpy.frombuffer(f.read(), dtype=numpy.uint8)
+
+    arrays = {}
+    for name, description in header['arrays'].items():
+        dtype = numpy.dtype(description['dtype'])
+        begin = start + description['offset']
+        arrays[name] = data[begin:begin + description['length'] * dtype.itemsize].view(dtype)
+    return header, arrays
+
+
+# Iterates over the corners of a binary corner file. The nodes of all the corners share one NodeStore whose sample
+# columns are views of the file.
+# returns: generator of Corner
+def iter_corners_binary(file, mmap=True):
+    header, arrays = read_arrays(file, mmap)
+
+    values = {name: _decode(arrays, 'node_' + name) for name in NODE_VALUES}
+    columns = {name: arrays['samples_' + name] for name in SAMPLE_COLUMNS}
+    store = NodeStore(columns, numpy.asarray(arrays['sample_offsets']), values)
+
+    statistics = {name: _decode(arrays, name) for name in STATISTICS}
+    sequences = {}
+    for name in ['radiuses'] + SEQUENCES:
+        sequences[name] = (_decode(arrays, name), arrays[name + '_offsets'].tolist())
+    rise_run_none = arrays['rise_run_none'].tolist()
+    node_offsets = arrays['node_offsets'].tolist()
+
+    for i in range(header['corners']):
+        corner_statistics = {name: column[i] for name, column in statistics.items()}
+        for name in ['radiuses'] + SEQUENCES:
+            flat, offsets = sequences[name]
+            corner_statistics[name] = tuple(flat[offsets[i]:offsets[i + 1]])
+        if rise_run_none[i]:
+            corner_statistics['rise_run'] = None
+        nodes = [store.node(j) for j in range(node_offsets[i], node_offsets[i + 1])]
+        yield Corner.from_statistics(nodes, header['directions'][i], corner_statistics.pop('radiuses'),
+                                     corner_statistics)
+
+
+def read_corners_binary(file, mmap=True):
+    return list(iter_corners_binary(file, mmap))
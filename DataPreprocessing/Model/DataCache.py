@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+
+# Binary caches of parsed data files. The cache of a file is a directory next to it, <file>.cache, holding the data and
+# a key.json with the path, size and modification time of the file it was made from. A cache is used only while the key
+# matches the file, otherwise it is rebuilt. key.json is written last, so an interrupted write leaves an invalid cache.
+
+# bumped when the layout of cache files changes. Invalidates every existing cache
+CACHE_VERSION = 7
+CACHE_SUFFIX = '.cache'
+KEY_FILE = 'key.json'
+
+# set to False to always parse the source files
+ENABLED = True
+
+
+def cache_directory(source):
+    return source + CACHE_SUFFIX
+
+
+def _source_key(source, kind):
+    stat = os.stat(source)
+    return {'version': CACHE_VERSION, 'kind': kind, 'path': os.path.abspath(source), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_key(directory):
+    try:
+        with open(os.path.join(directory, KEY_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Gets the data of source from its cache, building and caching it when the cache is missing or outdated. If the cache
+# cannot be written, i.e. on a read-only data directory, the built data is returned anyway.
+# input: source - path of the source file
+#        kind - str - what is cached, a cache of another kind is rebuilt
+#        build - function() -> value - parses the source file
+#        save - function(value, directory) -> json serializable metadata - writes value to the cache directory
+#        load - function(directory, metadata) -> value - reads the value written by save
+# returns: the value
+def cached(source, kind, build, save, load):
+    if not ENABLED:
+        return build()
+
+    directory = cache_directory(source)
+    key = _source_key(source, kind)
+    stored = _read_key(directory)
+    if stored is not None and stored.get('source') == key:
+        try:
+            return load(directory, stored.get('metadata'))
+        except (OSError, ValueError, KeyError, EOFError):
+            pass
+
+    value = build()
+    try:
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        metadata = save(value, directory)
+        with open(os.path.join(directory, KEY_FILE), 'w') as f:
+            json.dump({'source': key, 'metadata': metadata}, f, indent=4)
+    except OSError as e:
+        print("Could not cache", source, e)
+    return value
+
+
+# Removes the cache of source, if there is one
+def clear(source):
+    directory = cache_directory(source)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+
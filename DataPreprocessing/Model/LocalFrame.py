@@ -0,0 +1,123 @@
+import numpy
+
+# WGS84 ellipsoid, the datum of the gps coordinates
+SEMI_MAJOR_AXIS = 6378137.0
+FLATTENING = 1 / 298.257223563
+ECCENTRICITY_SQUARED = FLATTENING * (2 - FLATTENING)
+
+
+# returns: x, y, z - numpy arrays - earth centered, earth fixed coordinates in m
+def _to_ecef(latitudes, longitudes, altitudes):
+    phi = numpy.radians(latitudes)
+    lam = numpy.radians(longitudes)
+    sin_phi = numpy.sin(phi)
+    n = SEMI_MAJOR_AXIS / numpy.sqrt(1 - ECCENTRICITY_SQUARED * sin_phi * sin_phi)
+    return ((n + altitudes) * numpy.cos(phi) * numpy.cos(lam), (n + altitudes) * numpy.cos(phi) * numpy.sin(lam),
+            (n * (1 - ECCENTRICITY_SQUARED) + altitudes) * sin_phi)
+
+
+# returns: latitudes, longitudes in degrees, altitudes in m - numpy arrays
+def _from_ecef(x, y, z):
+    p = numpy.hypot(x, y)
+    phi = numpy.arctan2(z, p * (1 - ECCENTRICITY_SQUARED))
+    h = numpy.zeros_like(p)
+    # converges to well below a mm in a few iterations for points near the surface
+    for i in range(5):
+        sin_phi = numpy.sin(phi)
+        n = SEMI_MAJOR_AXIS / numpy.sqrt(1 - ECCENTRICITY_SQUARED * sin_phi * sin_phi)
+        h = p / numpy.cos(phi) - n
+        phi = numpy.arctan2(z, p * (1 - ECCENTRICITY_SQUARED * n / (n + h)))
+    return numpy.degrees(phi), numpy.degrees(numpy.arctan2(y, x)), h
+
+
+# Local east, north, up frame in m, tangent to the ellipsoid at an origin near the trip. Distances, areas and radiuses
+# computed on east and north are in m and m^2 whatever the latitude and direction of the trip, unlike on degrees, where
+# a degree of longitude shrinks with the latitude. Over the few tens of km of a trip the error of the plane is below a
+# few cm. All conversions work on numpy arrays as well as on single values.
+class LocalFrame:
+    _latitude = None
+    _longitude = None
+    _origin = None
+    _rotation = None
+
+    # input: latitude, longitude - degrees - the origin of the frame
+    def __init__(self, latitude, longitude):
+        self._latitude = float(latitude)
+        self._longitude = float(longitude)
+        self._origin = numpy.array(_to_ecef(self._latitude, self._longitude, 0.0))
+
+        phi = numpy.radians(self._latitude)
+        lam = numpy.radians(self._longitude)
+        # rows: east, north, up in ecef coordinates
+        self._rotation = numpy.array([
+            [-numpy.sin(lam), numpy.cos(lam), 0],
+            [-numpy.sin(phi) * numpy.cos(lam), -numpy.sin(phi) * numpy.sin(lam), numpy.cos(phi)],
+            [numpy.cos(phi) * numpy.cos(lam), numpy.cos(phi) * numpy.sin(lam), numpy.sin(phi)],
+        ])
+
+    # Frame with its origin in the middle of the bounding box of the points. NaN coordinates are ignored, as are the 0
+    # coordinates logged before the gps has a fix.
+    # raises: ValueError - there is no point with coordinates
+    @classmethod
+    def for_points(cls, latitudes, longitudes):
+        latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+        longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+        valid = numpy.isfinite(latitudes) & numpy.isfinite(longitudes) & (latitudes != 0) & (longitudes != 0)
+        if not numpy.any(valid):
+            raise ValueError("No coordinates to build a local frame from")
+        latitudes = latitudes[valid]
+        longitudes = longitudes[valid]
+        return LocalFrame((latitudes.min() + latitudes.max()) / 2, (longitudes.min() + longitudes.max()) / 2)
+
+    def to_dict(self):
+        return {'latitude': self._latitude, 'longitude': self._longitude}
+
+    @classmethod
+    def from_dict(cls, d):
+        return LocalFrame(d['latitude'], d['longitude'])
+
+    def __eq__(self, other):
+        return isinstance(other, LocalFrame) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash((self._latitude, self._longitude))
+
+    def __repr__(self):
+        return "LocalFrame(%r, %r)" % (self._latitude, self._longitude)
+
+    @property
+    def latitude(self):
+        return self._latitude
+
+    @property
+    def longitude(self):
+        return self._longitude
+
+    # Projects points on the ellipsoid, NaN coordinates give NaN.
+    # returns: north, east - m - numpy arrays, or floats for single values
+    def to_local(self, latitudes, longitudes):
+        x, y, z = _to_ecef(numpy.asarray(latitudes, dtype=numpy.float64),
+                           numpy.asarray(longitudes, dtype=numpy.float64), 0.0)
+        dx = x - self._origin[0]
+        dy = y - self._origin[1]
+        dz = z - self._origin[2]
+        r = self._rotation
+        east = r[0, 0] * dx + r[0, 1] * dy
+        north = r[1, 0] * dx + r[1, 1] * dy + r[1, 2] * dz
+        return north, east
+
+    # Inverse of to_local, for points on the ellipsoid.
+    # returns: latitudes, longitudes - degrees - numpy arrays, or floats for single values
+    def to_geodetic(self, north, east):
+        north = numpy.asarray(north, dtype=numpy.float64)
+        east = numpy.asarray(east, dtype=numpy.float64)
+        r = self._rotation
+        # the ellipsoid curves away from the plane, the up that brings the point back on it is found by iterating
+        up = numpy.zeros_like(north)
+        for i in range(3):
+            x = self._origin[0] + r[0, 0] * east + r[1, 0] * north + r[2, 0] * up
+            y = self._origin[1] + r[0, 1] * east + r[1, 1] * north + r[2, 1] * up
+            z = self._origin[2] + r[1, 2] * north + r[2, 2] * up
+            latitudes, longitudes, altitudes = _from_ecef(x, y, z)
+            up = up - altitudes
+        return latitudes, longitudes
@@ -1,121 +1,229 @@
 import math
 
-
+import numpy
+
+# Node property -> AutomotiveDataRow attribute of the samples kept for every node
+SAMPLE_COLUMNS = {
+    'Xs': 'x',
+    'Ys': 'y',
+    'Zs': 'z',
+    'speeds': 'speed',
+    'maps': 'MAP',
+    'calc_loads': 'load',
+}
+
+# values kept once per node, in the order of Node.to_array
+NODE_VALUES = ['latitude', 'longitude', 'max_fuel_used', 'max_distance', 'min_distance', 'min_fuel_used', 'altitude']
+
+
+# Samples of all the nodes of a trip. Every sample column is one numpy array, holding the samples of node 0, then the
+# samples of node 1 and so on. Node and Corner only keep indices into the store, so a trip is a few arrays instead of
+# thousands of lists. The columns are read-only, the samples of a node are given out as views without copying.
+class NodeStore:
+    _columns = None
+    _offsets = None
+    # offsets as a list, indexing it is much faster than indexing the array for a single node
+    _bounds = None
+    _values = None
+
+    # input: columns - dict SAMPLE_COLUMNS key -> numpy array
+    #        offsets - numpy int array - the samples of node i are [offsets[i], offsets[i + 1])
+    #        values - dict NODE_VALUES item -> list, one value per node
+    def __init__(self, columns, offsets, values):
+        for column in columns.values():
+            column.flags.writeable = False
+        self._columns = columns
+        self._offsets = offsets
+        self._bounds = offsets.tolist()
+        self._values = values
+
+    # Builds a store from groups of AutomotiveDataRows, one group per node. The values of a node are computed like
+    # Node(latitude, longitude, ad) always did.
+    # input: groups - list of (latitude, longitude, list of AutomotiveDataRow or None)
+    @classmethod
+    def from_groups(cls, groups):
+        samples = {name: [] for name in SAMPLE_COLUMNS}
+        values = {name: [] for name in NODE_VALUES}
+        offsets = [0]
+
+        for latitude, longitude, ad in groups:
+            values['latitude'].append(latitude)
+            values['longitude'].append(longitude)
+            if ad is None:
+                for name in NODE_VALUES[2:]:
+                    values[name].append(None)
+                offsets.append(offsets[-1])
+                continue
+
+            for name, attribute in SAMPLE_COLUMNS.items():
+                samples[name].extend(getattr(adr, attribute) for adr in ad)
+            fuel_used = [adr.fuel_used for adr in ad]
+            distances = [adr.distance for adr in ad]
+            values['max_fuel_used'].append(max([0] + fuel_used))
+            values['max_distance'].append(max([0] + distances))
+            values['min_distance'].append(min([math.inf] + distances))
+            values['min_fuel_used'].append(min([math.inf] + fuel_used))
+            values['altitude'].append(ad[-1].altitude if len(ad) > 0 else None)
+            offsets.append(offsets[-1] + len(ad))
+
+        return NodeStore({name: numpy.array(column) for name, column in samples.items()},
+                         numpy.array(offsets, dtype=numpy.int64), values)
+
+    # Builds a store from nodes encoded with Node.to_array
+    @classmethod
+    def from_arrays(cls, arrays):
+        samples = {name: [] for name in SAMPLE_COLUMNS}
+        values = {name: [] for name in NODE_VALUES}
+        offsets = [0]
+
+        for array in arrays:
+            latitude, longitude, Xs, Ys, Zs, max_fuel_used, max_distance, min_distance, min_fuel_used, altitude, \
+                speeds, maps, calc_loads = array
+            for name, value in zip(NODE_VALUES, [latitude, longitude, max_fuel_used, max_distance, min_distance,
+                                                 min_fuel_used, altitude]):
+                values[name].append(value)
+            for name, column in zip(['Xs', 'Ys', 'Zs', 'speeds', 'maps', 'calc_loads'],
+                                    [Xs, Ys, Zs, speeds, maps, calc_loads]):
+                assert len(column) == len(Xs)
+                samples[name].extend(column)
+            offsets.append(offsets[-1] + len(Xs))
+
+        return NodeStore({name: numpy.array(column) for name, column in samples.items()},
+                         numpy.array(offsets, dtype=numpy.int64), values)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def node(self, index):
+        return Node.from_store(self, index)
+
+    def nodes(self):
+        return [Node.from_store(self, i) for i in range(len(self))]
+
+    def value(self, name, index):
+        return self._values[name][index]
+
+    # returns: list - the values of the nodes first to last - 1
+    def values_range(self, name, first, last):
+        return self._values[name][first:last]
+
+    def sample_count(self, index):
+        return self._bounds[index + 1] - self._bounds[index]
+
+    # returns: read-only numpy array - the samples of one node, a view of the column
+    def samples(self, name, index):
+        return self._columns[name][self._bounds[index]:self._bounds[index + 1]]
+
+    # returns: read-only numpy array - the samples of the nodes first to last - 1, a view of the column
+    def samples_range(self, name, first, last):
+        return self._columns[name][self._bounds[first]:self._bounds[last]]
+
+    # returns: numpy array - the samples of the given nodes, one node after the other
+    def take(self, name, indices):
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        starts = self._offsets[indices]
+        counts = self._offsets[indices + 1] - starts
+        total = int(numpy.sum(counts))
+        column = self._columns[name]
+        if total == 0:
+            return column[:0]
+        # position of every sample: the start of its node plus its index in the node
+        firsts = numpy.cumsum(counts) - counts
+        positions = numpy.arange(total) + numpy.repeat(starts - firsts, counts)
+        return column[positions]
+
+
+# A point of the route and the samples logged while the car was at it. The samples are kept in a NodeStore.
 class Node:
-    _latitude = None
-    _longitude = None
-    _Xs = None
-    _Ys = None
-    _Zs = None
-    _max_fuel_used = None
-    _max_distance = None
-    _min_distance = None
-    _min_fuel_used = None
-    _altitude = None
-    _speeds = None
-    _maps = None
-    _calc_loads = None
+    _store = None
+    _index = None
 
     def __init__(self, latitude, longitude, ad=None):
-        self._latitude = latitude
-        self._longitude = longitude
-        self._Xs = []
-        self._Ys = []
-        self._Zs = []
-        self._speeds = []
-        self._maps = []
-        self._calc_loads = []
-
-        if ad is None:
-            return
-
-        self._max_distance = 0
-        self._min_distance = math.inf
-        self._max_fuel_used = 0
-        self._min_fuel_used = math.inf
-        for adr in ad:
-            self._Xs.append(adr.x)
-            self._Ys.append(adr.y)
-            self._Zs.append(adr.z)
-            self._max_fuel_used = max(self._max_fuel_used, adr.fuel_used)
-            self._max_distance = max(self._max_distance, adr.distance)
-            self._min_distance = min(self._min_distance, adr.distance)
-            self._min_fuel_used = min(self._min_fuel_used, adr.fuel_used)
-            self._altitude = adr.altitude
-            self._speeds.append(adr.speed)
-            self._maps.append(adr.MAP)
-            self._calc_loads.append(adr.load)
+        self._store = NodeStore.from_groups([(latitude, longitude, ad)])
+        self._index = 0
+
+    @classmethod
+    def from_store(cls, store, index):
+        n = cls.__new__(cls)
+        n._store = store
+        n._index = index
+        return n
 
     # encodes object to array for easier json parsing
     def to_array(self):
-        return [self.latitude, self.longitude, self.Xs, self.Ys, self.Zs, self.max_fuel_used, self.max_distance,
-                self.min_distance, self.min_fuel_used, self.altitude, self.speeds, self.maps, self.calc_loads]
+        return [self.latitude, self.longitude, self.Xs.tolist(), self.Ys.tolist(), self.Zs.tolist(),
+                self.max_fuel_used, self.max_distance, self.min_distance, self.min_fuel_used, self.altitude,
+                self.speeds.tolist(), self.maps.tolist(), self.calc_loads.tolist()]
 
     # returns object from array encoded with to_array
     @classmethod
     def from_array(cls, array):
-        n = Node(array[0], array[1])
-        n._Xs = array[2]
-        n._Ys = array[3]
-        n._Zs = array[4]
-        n._max_fuel_used = array[5]
-        n._max_distance = array[6]
-        n._min_distance = array[7]
-        n._min_fuel_used = array[8]
-        n._altitude = array[9]
-        n._speeds = array[10]
-        n._maps = array[11]
-        n._calc_loads = array[12]
-        return n
+        return NodeStore.from_arrays([array]).node(0)
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def sample_count(self):
+        return self._store.sample_count(self._index)
+
+    # returns: read-only numpy array - the samples of one of SAMPLE_COLUMNS
+    def samples(self, name):
+        return self._store.samples(name, self._index)
 
     @property
     def latitude(self):
-        return self._latitude
+        return self._store.value('latitude', self._index)
 
     @property
     def longitude(self):
-        return self._longitude
+        return self._store.value('longitude', self._index)
 
     @property
     def Xs(self):
-        return self._Xs.copy()
+        return self.samples('Xs')
 
     @property
     def Ys(self):
-        return self._Ys.copy()
+        return self.samples('Ys')
 
     @property
     def Zs(self):
-        return self._Zs.copy()
+        return self.samples('Zs')
 
     @property
     def max_fuel_used(self):
-        return self._max_fuel_used
+        return self._store.value('max_fuel_used', self._index)
 
     @property
     def max_distance(self):
-        return self._max_distance
+        return self._store.value('max_distance', self._index)
 
     @property
     def min_distance(self):
-        return self._min_distance
+        return self._store.value('min_distance', self._index)
 
     @property
     def min_fuel_used(self):
-        return self._min_fuel_used
+        return self._store.value('min_fuel_used', self._index)
 
     @property
     def altitude(self):
-        return self._altitude
+        return self._store.value('altitude', self._index)
 
     @property
     def speeds(self):
-        return self._speeds.copy()
+        return self.samples('speeds')
 
     @property
     def maps(self):
-        return self._maps.copy()
+        return self.samples('maps')
 
     @property
     def calc_loads(self):
-        return self._calc_loads.copy()
+        return self.samples('calc_loads')
@@ -0,0 +1,313 @@
+import itertools
+import json
+import math
+import os
+import xml.etree.ElementTree as ET
+
+import numpy
+
+from DataPreprocessing.Model import DataCache
+from DataPreprocessing.Model.LocalFrame import LocalFrame
+
+# m, side of the cells of the grid index
+CELL_SIZE = 100
+# radius get_way starts from and how much it grows by, like the Overpass queries of move_nodes_to_road_median_axis
+DEFAULT_RADIUS = 10
+RADIUS_STEP = 2
+
+
+# checks if the tags of a way make it a highway, like is_highway does for the ways of the Overpass API
+def _is_highway(tags):
+    return 'highway' in tags and tags['highway'] != 'proposed'
+
+
+# Highway ways of a local OSM extract, answering the queries move_nodes_to_road_median_axis sends to the Overpass API
+# without network access. The segments of the ways are projected to a LocalFrame of the extract and kept in a grid of
+# CELL_SIZE cells, a segment being in every cell its bounding box touches, so the ways around a point are found by
+# looking at a few cells. The ways are given out as the way elements of an Overpass "out geom" answer: an nd child with
+# ref, lat and lon for every node and a tag child for every tag, so point_in_way, get_lanes and way_similarity_grade
+# work on them unchanged. The elements are built the first time a way is given out.
+class RoadNetwork:
+    _ids = None
+    _tags = None
+    # the nodes of way i are [_offsets[i], _offsets[i + 1]) of _refs, _latitudes and _longitudes
+    _offsets = None
+    _refs = None
+    _latitudes = None
+    _longitudes = None
+    _elements = None
+
+    _frame = None
+    _cell_size = None
+    # the segments, in m in the frame, and the way each belongs to. A way of a single node is one segment of length 0
+    _ax = None
+    _ay = None
+    _bx = None
+    _by = None
+    _segment_ways = None
+    # grid: (x, y) of a cell -> numpy array of the segments in it
+    _cells = None
+    # corners of the bounding box of the grid, in m
+    _bounds = None
+    # south, west, north, east of every way, in degrees
+    _way_bounds = None
+
+    # input: ids - list of int - way ids
+    #        tags - list of dict - the tags of every way
+    #        offsets - numpy int array - the nodes of way i are [offsets[i], offsets[i + 1])
+    #        refs, latitudes, longitudes - numpy arrays - node ids and coordinates of the nodes of all the ways
+    #        cell_size - m
+    def __init__(self, ids, tags, offsets, refs, latitudes, longitudes, cell_size=CELL_SIZE):
+        self._ids = list(ids)
+        self._tags = list(tags)
+        self._offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self._refs = numpy.asarray(refs, dtype=numpy.int64)
+        self._latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+        self._longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+        self._elements = [None] * len(self._ids)
+        self._cell_size = cell_size
+        if len(self._refs) > 0:
+            self._build_index()
+
+    # Reads the highway ways of an OSM xml extract. Nodes missing from the extract split their way in parts, every part
+    # of at least one node being a way with the id of the original way.
+    @classmethod
+    def from_xml(cls, file, cell_size=CELL_SIZE):
+        nodes = {}
+        ways = []
+        for event, element in ET.iterparse(file, events=('end',)):
+            if element.tag == 'node':
+                nodes[int(element.attrib['id'])] = (float(element.attrib['lat']), float(element.attrib['lon']))
+                element.clear()
+            elif element.tag == 'way':
+                tags = {t.attrib['k']: t.attrib['v'] for t in element if t.tag == 'tag'}
+                if _is_highway(tags):
+                    ways.append((int(element.attrib['id']), tags,
+                                 [int(nd.attrib['ref']) for nd in element if nd.tag == 'nd']))
+                element.clear()
+        return cls.from_ways(ways, nodes, cell_size)
+
+    # Reads the highway ways of an OSM pbf extract. Needs pyosmium, which is imported here so the xml extracts and the
+    # Overpass API work without it.
+    @classmethod
+    def from_pbf(cls, file, cell_size=CELL_SIZE):
+        import osmium
+
+        nodes = {}
+        ways = []
+
+        class Handler(osmium.SimpleHandler):
+            def way(self, w):
+                tags = {t.k: t.v for t in w.tags}
+                if not _is_highway(tags):
+                    return
+                refs = []
+                for n in w.nodes:
+                    refs.append(n.ref)
+                    if n.location.valid():
+                        nodes[n.ref] = (n.location.lat, n.location.lon)
+                ways.append((w.id, tags, refs))
+
+        Handler().apply_file(file, locations=True)
+        return cls.from_ways(ways, nodes, cell_size)
+
+    # Builds a network from ways and the coordinates of their nodes. Nodes without coordinates split their way like in
+    # from_xml.
+    # input: ways - list of (id, tags, node refs)
+    #        nodes - dict node ref -> (latitude, longitude)
+    @classmethod
+    def from_ways(cls, ways, nodes, cell_size=CELL_SIZE):
+        ids, tags, refs, latitudes, longitudes = [], [], [], [], []
+        offsets = [0]
+        for way_id, way_tags, way_refs in ways:
+            part = []
+            for ref in way_refs + [None]:
+                if ref in nodes:
+                    part.append(ref)
+                    continue
+                if len(part) > 0:
+                    ids.append(way_id)
+                    tags.append(way_tags)
+                    refs.extend(part)
+                    latitudes.extend(nodes[r][0] for r in part)
+                    longitudes.extend(nodes[r][1] for r in part)
+                    offsets.append(len(refs))
+                part = []
+        return RoadNetwork(ids, tags, offsets, refs, latitudes, longitudes, cell_size)
+
+    def _build_index(self):
+        self._frame = LocalFrame.for_points(self._latitudes, self._longitudes)
+        north, east = self._frame.to_local(self._latitudes, self._longitudes)
+
+        # segment from every node to the next one of its way, and from the node to itself for ways of one node
+        counts = numpy.diff(self._offsets)
+        last = numpy.zeros(len(self._refs), dtype=bool)
+        last[self._offsets[1:] - 1] = True
+        single = numpy.zeros(len(self._refs), dtype=bool)
+        single[self._offsets[:-1][counts == 1]] = True
+        starts = numpy.flatnonzero(~last | single)
+        ends = numpy.where(single[starts], starts, starts + 1)
+        self._ax, self._ay = north[starts], east[starts]
+        self._bx, self._by = north[ends], east[ends]
+        self._segment_ways = numpy.repeat(numpy.arange(len(counts)), counts)[starts]
+        firsts = self._offsets[:-1]
+        self._way_bounds = (numpy.minimum.reduceat(self._latitudes, firsts),
+                            numpy.minimum.reduceat(self._longitudes, firsts),
+                            numpy.maximum.reduceat(self._latitudes, firsts),
+                            numpy.maximum.reduceat(self._longitudes, firsts))
+
+        # every cell the bounding box of a segment touches, as (segment, cell) pairs sorted by cell
+        size = self._cell_size
+        x0 = numpy.floor(numpy.minimum(self._ax, self._bx) / size).astype(numpy.int64)
+        x1 = numpy.floor(numpy.maximum(self._ax, self._bx) / size).astype(numpy.int64)
+        y0 = numpy.floor(numpy.minimum(self._ay, self._by) / size).astype(numpy.int64)
+        y1 = numpy.floor(numpy.maximum(self._ay, self._by) / size).astype(numpy.int64)
+        widths = x1 - x0 + 1
+        cells = widths * (y1 - y0 + 1)
+        segments = numpy.repeat(numpy.arange(len(cells)), cells)
+        positions = numpy.arange(len(segments)) - numpy.repeat(numpy.cumsum(cells) - cells, cells)
+        xs = x0[segments] + positions % widths[segments]
+        ys = y0[segments] + positions // widths[segments]
+
+        order = numpy.lexsort((ys, xs))
+        xs, ys, segments = xs[order], ys[order], segments[order]
+        changes = numpy.concatenate([[0], numpy.flatnonzero((xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])) + 1,
+                                     [len(xs)]]).tolist()
+        self._cells = {(x, y): segments[first:last] for x, y, first, last in
+                       zip(xs[changes[:-1]].tolist(), ys[changes[:-1]].tolist(), changes[:-1], changes[1:])}
+        self._bounds = (min(self._ax.min(), self._bx.min()), min(self._ay.min(), self._by.min()),
+                        max(self._ax.max(), self._bx.max()), max(self._ay.max(), self._by.max()))
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def frame(self):
+        return self._frame
+
+    # returns: ET.Element - way i as Overpass gives it out with "out geom"
+    def way(self, i):
+        if self._elements[i] is None:
+            element = ET.Element('way', id=str(self._ids[i]))
+            for j in range(self._offsets[i], self._offsets[i + 1]):
+                ET.SubElement(element, 'nd', ref=str(self._refs[j]), lat=repr(float(self._latitudes[j])),
+                              lon=repr(float(self._longitudes[j])))
+            for k, v in self._tags[i].items():
+                ET.SubElement(element, 'tag', k=k, v=v)
+            self._elements[i] = element
+        return self._elements[i]
+
+    # returns: the segments in the cells within reach of x, y, and their distances to x, y. Every segment closer than
+    #          reach is among them
+    def _candidates(self, x, y, reach):
+        size = self._cell_size
+        cells = [self._cells[key] for key in itertools.product(
+            range(math.floor((x - reach) / size), math.floor((x + reach) / size) + 1),
+            range(math.floor((y - reach) / size), math.floor((y + reach) / size) + 1)) if key in self._cells]
+        if len(cells) == 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        segments = cells[0] if len(cells) == 1 else numpy.unique(numpy.concatenate(cells))
+
+        ax, ay, bx, by = self._ax[segments], self._ay[segments], self._bx[segments], self._by[segments]
+        dx = bx - ax
+        dy = by - ay
+        length = dx * dx + dy * dy
+        t = numpy.clip(((x - ax) * dx + (y - ay) * dy) / numpy.where(length > 0, length, 1), 0, 1)
+        return segments, numpy.hypot(x - ax - t * dx, y - ay - t * dy)
+
+    # Gets the ways whose bounding box overlaps a box, in degrees. These are the ways crossing the box, and a few long
+    # ways passing by its corners.
+    # returns: list of way indices
+    def within_bounds(self, south, west, north, east):
+        if self._way_bounds is None:
+            return []
+        way_south, way_west, way_north, way_east = self._way_bounds
+        return numpy.flatnonzero((way_north >= south) & (way_south <= north) & (way_east >= west) &
+                                 (way_west <= east)).tolist()
+
+    # Gets the ways closer than radius m to a point.
+    # returns: dict way index -> distance in m
+    def nearby(self, latitude, longitude, radius):
+        if self._frame is None:
+            return {}
+        x, y = self._frame.to_local(latitude, longitude)
+        segments, distances = self._candidates(float(x), float(y), radius)
+        return self._closest(segments, distances, radius)
+
+    def _closest(self, segments, distances, radius):
+        ways = {}
+        for way, distance in zip(self._segment_ways[segments].tolist(), distances.tolist()):
+            if distance <= radius and distance < ways.get(way, math.inf):
+                ways[way] = distance
+        return ways
+
+    # Gets the highway ways around a point like get_way of move_nodes_to_road_median_axis does with the Overpass API:
+    # the ways within radius m, and if there are none, within a radius greater by RADIUS_STEP m, until a way is found.
+    # The radius the ways are found at is computed from the closest way instead of trying every radius.
+    # input: limit - m or None - for a network that only holds the ways within limit m of the point, the radius is not
+    #                grown past it
+    # returns: list of ET.Element - the ways, ordered by id like Overpass gives them out. None if there is no way in the
+    #          network, or within limit
+    def get_way(self, latitude, longitude, radius=DEFAULT_RADIUS, limit=None):
+        if self._frame is None:
+            return None
+        x, y = self._frame.to_local(latitude, longitude)
+        x, y = float(x), float(y)
+        reach = max(radius, RADIUS_STEP)
+        if limit is None:
+            # no way is farther than the farthest corner of the grid
+            limit = max(math.hypot(x - bx, y - by) for bx in self._bounds[0::2] for by in self._bounds[1::2]) + reach
+        reach = min(reach, limit)
+        while True:
+            segments, distances = self._candidates(x, y, reach)
+            close = distances <= reach
+            if numpy.any(close):
+                closest = float(distances[close].min())
+                found = radius
+                if closest > radius:
+                    found = radius + RADIUS_STEP * math.ceil((closest - radius) / RADIUS_STEP)
+                if found <= reach:
+                    ways = self._closest(segments, distances, found)
+                    return [self.way(i) for i in sorted(ways, key=lambda i: self._ids[i])]
+                if found > limit:
+                    return None
+                reach = found
+            elif reach >= limit:
+                return None
+            else:
+                reach = min(reach * 2, limit)
+
+
+def _save_network(network, directory):
+    numpy.save(os.path.join(directory, 'offsets.npy'), network._offsets)
+    numpy.save(os.path.join(directory, 'refs.npy'), network._refs)
+    numpy.save(os.path.join(directory, 'latitudes.npy'), network._latitudes)
+    numpy.save(os.path.join(directory, 'longitudes.npy'), network._longitudes)
+    with open(os.path.join(directory, 'ways.json'), 'w') as f:
+        json.dump({'ids': network._ids, 'tags': network._tags}, f)
+    return {'cell_size': network._cell_size}
+
+
+def _load_network(directory, metadata):
+    with open(os.path.join(directory, 'ways.json'), 'r') as f:
+        ways = json.load(f)
+    return RoadNetwork(ways['ids'], ways['tags'], numpy.load(os.path.join(directory, 'offsets.npy')),
+                       numpy.load(os.path.join(directory, 'refs.npy')),
+                       numpy.load(os.path.join(directory, 'latitudes.npy')),
+                       numpy.load(os.path.join(directory, 'longitudes.npy')), metadata['cell_size'])
+
+
+# networks already loaded by this process, by path, with the size and modification time of the file
+_loaded = {}
+
+
+# Loads an OSM extract, .pbf or xml, through its binary cache, see DataCache. The extract is parsed once, the next loads
+# read the ways from the cache and only build the index. A process keeps the networks it loaded, so the trips it
+# processes share them.
+def load_road_network(file):
+    stat = os.stat(file)
+    key = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    if key not in _loaded:
+        parse = RoadNetwork.from_pbf if file.endswith('.pbf') else RoadNetwork.from_xml
+        _loaded[key] = DataCache.cached(file, 'roads', lambda: parse(file), _save_network, _load_network)
+    return _loaded[key]
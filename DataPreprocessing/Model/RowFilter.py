@@ -0,0 +1,107 @@
+import numpy
+
+
+def _valid(values):
+    if values.dtype.kind in 'US':
+        return values != ''
+    return ~numpy.isnan(values)
+
+
+# predicate name -> function(column, threshold) returning the boolean mask of the rows that pass. Missing values (NaN,
+# '' for text columns) never pass, like None fails the checks of AutomotiveDataRow.is_sanitary.
+PREDICATES = {
+    'present': lambda values, threshold: _valid(values),
+    'nonzero': lambda values, threshold: _valid(values) & (values != 0),
+    'greater': lambda values, threshold: _valid(values) & (values > threshold),
+    'at_least': lambda values, threshold: _valid(values) & (values >= threshold),
+}
+
+
+# Declarative filter of trip rows. Each rule is a tuple (csv column, predicate, threshold), the predicate being one of
+# PREDICATES. A row is kept if it passes every rule. Rules are evaluated as numpy masks over a whole TripData, so the
+# same loaded trip can be filtered differently by different stages.
+class RowFilter:
+    _rules = None
+
+    # input: rules - list of (column, predicate, threshold). threshold is ignored by 'present' and 'nonzero'
+    def __init__(self, rules):
+        for column, predicate, threshold in rules:
+            if predicate not in PREDICATES:
+                raise ValueError("Unknown predicate %s for column %s" % (predicate, column))
+        self._rules = [tuple(rule) for rule in rules]
+
+    @property
+    def rules(self):
+        return list(self._rules)
+
+    # input: trip - TripData
+    # returns: numpy boolean array - the rows that pass every rule
+    #          list of (rule, rejected) - the amount of rows each rule rejects on its own. A row failing several rules
+    #          is counted by each of them
+    def evaluate(self, trip):
+        keep = numpy.ones(len(trip), dtype=bool)
+        rejected = []
+        for rule in self._rules:
+            column, predicate, threshold = rule
+            if column in trip:
+                passed = PREDICATES[predicate](trip[column], threshold)
+            else:
+                # a column that was not logged has no values, like an attribute left None
+                passed = numpy.zeros(len(trip), dtype=bool)
+            rejected.append((rule, int(len(trip) - numpy.count_nonzero(passed))))
+            keep &= passed
+        return keep, rejected
+
+    # returns: numpy boolean array - the rows that pass every rule
+    def mask(self, trip):
+        return self.evaluate(trip)[0]
+
+    # returns: TripData - the rows of trip that pass every rule
+    def apply(self, trip):
+        return trip.select(self.mask(trip))
+
+    # returns: str - how many rows each rule rejects, for printing
+    def report(self, trip):
+        keep, rejected = self.evaluate(trip)
+        lines = ["KEPT %d OF %d ROWS" % (numpy.count_nonzero(keep), len(trip))]
+        for (column, predicate, threshold), count in rejected:
+            rule = "%s %s" % (column, predicate)
+            if predicate in ('greater', 'at_least'):
+                rule += " %s" % threshold
+            lines.append("  %-32s rejects %d" % (rule, count))
+        return "\n".join(lines)
+
+
+# Builds the filter equivalent to AutomotiveDataRow.is_sanitary with the same keyword arguments. The only difference is
+# time_gps=True, which also rejects empty TIME_GPS values, where is_sanitary only rejects rows without the column.
+def sanitary_filter(altitude=False, latitude=True, longitude=True, heading=False, speed=True, speed_gps=False,
+                    time_gps=False, x=True, y=True, z=True, AAP=False, AAT=False, MAP=True, IAT=True, RPM=True,
+                    load=True, instant_fuel_consumption=False, fuel_consumption=False, speed_threshold=0):
+    rules = [('LATEST', 'present', None), ('DISTANCE', 'at_least', 0.0001)]
+    optional = [
+        (speed, ('SPEED', 'greater', speed_threshold)),
+        (load, ('LOAD', 'nonzero', None)),
+        (MAP, ('MAP', 'present', None)),
+        (IAT, ('IAT', 'present', None)),
+        (RPM, ('RPM', 'nonzero', None)),
+        (fuel_consumption, ('FUEL_CONSUMPTION', 'nonzero', None)),
+        (instant_fuel_consumption, ('INSTANT_FUEL_CONSUMPTION', 'present', None)),
+        (latitude, ('LATITUDE', 'nonzero', None)),
+        (longitude, ('LONGITUDE', 'nonzero', None)),
+        (altitude, ('ALTITUDE', 'nonzero', None)),
+        (heading, ('HEADING', 'present', None)),
+        (speed_gps, ('SPEED_GPS', 'present', None)),
+        (time_gps, ('TIME_GPS', 'present', None)),
+        (x, ('X', 'present', None)),
+        (y, ('Y', 'present', None)),
+        (z, ('Z', 'present', None)),
+        (AAP, ('AAP', 'nonzero', None)),
+        (AAT, ('AAT', 'at_least', -50)),
+    ]
+    rules += [rule for enabled, rule in optional if enabled]
+    rules.append(('FUEL_USED', 'nonzero', None))
+    return RowFilter(rules)
+
+
+# the filter load_csv applies to every trip
+DEFAULT_FILTER = sanitary_filter(speed_threshold=10)
@@ -0,0 +1,254 @@
+import csv
+import math
+import os
+
+import numpy
+
+from DataPreprocessing.Model import DataCache
+from DataPreprocessing.Model.AutomotiveDataRow import AutomotiveDataRow, CSV_COLUMNS
+from DataPreprocessing.Model.LocalFrame import LocalFrame
+from DataPreprocessing.Model.RowFilter import sanitary_filter
+
+
+# Columnar representation of a trip. Each csv column is kept as one numpy array:
+#   - numeric columns are float64, missing values are NaN
+#   - LATEST is int64 if every row has a value, since float64 cannot hold ns timestamps exactly. float64 otherwise
+#   - TIME_GPS is an array of strings, missing values are ''
+#   - columns that are not loaded by AutomotiveDataRow are parsed as numeric
+# AutomotiveDataRow objects can still be built for single rows or for the whole trip when the code needs them.
+# The LocalFrame of the trip is computed once and kept with it.
+class TripData:
+    _header = None
+    _columns = None
+    _length = None
+    # LocalFrame once local_frame was called
+    _frame = None
+
+    # input: header - list of column names, in csv order
+    #        columns - dict column name -> numpy array. All arrays must have the same length
+    #        frame - LocalFrame or None - the frame of the trip if it is already known, i.e. read from the cache
+    def __init__(self, header, columns, frame=None):
+        self._header = list(header)
+        self._columns = columns
+        self._length = 0 if len(columns) == 0 else len(next(iter(columns.values())))
+        for name in self._header:
+            assert len(self._columns[name]) == self._length
+        self._frame = frame
+
+    def __len__(self):
+        return self._length
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    @property
+    def header(self):
+        return self._header.copy()
+
+    @property
+    def columns(self):
+        return self._columns
+
+    # Keeps the rows selected by a boolean mask or an array of indices.
+    # returns: TripData - a new trip, the arrays are copies. The frame is kept
+    def select(self, selection):
+        return TripData(self._header, {name: column[selection] for name, column in self._columns.items()}, self._frame)
+
+    # The frame the coordinates of the trip are projected to, centered on the rows that pass sanitary_filter, the ones
+    # snapping and corner splitting work on. The rows logged before the gps had a fix, at 0, 0, are left out. A trip
+    # without sanitary rows, i.e. without the engine columns, is centered on all its coordinates.
+    # returns: LocalFrame
+    # raises: ValueError - the trip has no coordinates
+    def local_frame(self):
+        if self._frame is None:
+            latitudes = self._columns['LATITUDE']
+            longitudes = self._columns['LONGITUDE']
+            sanitary = sanitary_filter().mask(self)
+            if numpy.any(sanitary):
+                latitudes, longitudes = latitudes[sanitary], longitudes[sanitary]
+            self._frame = LocalFrame.for_points(latitudes, longitudes)
+        return self._frame
+
+    # Builds an AutomotiveDataRow from row i. NaN values are converted to None, like the row parser does for missing
+    # values.
+    def row(self, i):
+        adr = AutomotiveDataRow()
+        for name in self._header:
+            if name not in CSV_COLUMNS:
+                continue
+            attribute, value_type = CSV_COLUMNS[name]
+            setattr(adr, attribute, _to_python(self._columns[name][i], value_type))
+        return adr
+
+    # Builds AutomotiveDataRows for all rows, or for the given indices.
+    def rows(self, indices=None):
+        columns = self._columns
+        if indices is not None:
+            columns = {name: column[indices] for name, column in columns.items()}
+
+        known = [name for name in self._header if name in CSV_COLUMNS]
+        attributes = [CSV_COLUMNS[name][0] for name in known]
+        # converting a whole column to python values at once is much faster than element by element
+        values = [[_to_python(v, CSV_COLUMNS[name][1]) for v in columns[name].tolist()] for name in known]
+
+        automotive_data = []
+        for row_values in zip(*values):
+            adr = AutomotiveDataRow()
+            for attribute, value in zip(attributes, row_values):
+                setattr(adr, attribute, value)
+            automotive_data.append(adr)
+        return automotive_data
+
+
+# Converts a value from a column to the python value the row parser would have produced.
+def _to_python(value, value_type):
+    if value_type is str:
+        return str(value)
+    if isinstance(value, int):
+        return value
+    if math.isnan(value):
+        return None
+    if value_type is int:
+        return int(value)
+    return value
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return math.nan
+
+
+# Parses a column of strings. Values that cannot be parsed are NaN, like the row parser leaves them None.
+# Integer columns only accept integer literals, like int(): i.e. 1.71586E+18, written by spreadsheet editors, is NaN.
+# numpy converts the whole column at once, with the rules of float() and int(), leaving the empty cells NaN. Only a
+# column holding a value that is not a number is parsed one value at a time.
+# input: values - sequence of strings
+#        value_type - int or float - the type AutomotiveDataRow parses the column as
+#        exact - boolean - if every value is an integer, keep the column as int64 instead of float64
+def _parse_column(values, value_type=float, exact=False):
+    dtype = numpy.int64 if value_type is int else numpy.float64
+    try:
+        if '' in values:
+            cells = numpy.array(values, dtype=object)
+            present = cells != ''
+            column = numpy.full(len(cells), math.nan)
+            column[present] = cells[present].astype(dtype)
+            return column
+        column = numpy.array(values, dtype=dtype)
+    except (ValueError, OverflowError):
+        parse = _parse_int if value_type is int else _parse_float
+        return numpy.array([parse(v) for v in values], dtype=numpy.float64)
+
+    if value_type is int and not exact:
+        return column.astype(numpy.float64)
+    return column
+
+
+# Parses a block of csv rows, column by column.
+# returns: dict column name -> numpy array
+def _parse_rows(header, rows):
+    cells = list(zip(*rows)) if len(rows) > 0 else [()] * len(header)
+
+    columns = {}
+    for name, values in zip(header, cells):
+        value_type = CSV_COLUMNS[name][1] if name in CSV_COLUMNS else float
+        if value_type is str:
+            columns[name] = numpy.array(values, dtype=str)
+        else:
+            columns[name] = _parse_column(values, value_type, exact=name == 'LATEST')
+    return columns
+
+
+# Reads a trip csv a block of rows at a time. The header is resolved once and every column is parsed in bulk. Rows that
+# do not have the same amount of cells as the header are skipped, as are copies of the header, written when the logger
+# appends to an existing file. A file without rows gives one empty block.
+# returns: generator of (header, dict column name -> numpy array)
+def _read_blocks(file, block_size):
+    with open(file, 'r', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        header = next(csv_reader)
+        rows = []
+        empty = True
+        for row in csv_reader:
+            if len(row) != len(header) or row == header:
+                continue
+            rows.append(row)
+            if len(rows) == block_size:
+                yield header, _parse_rows(header, rows)
+                rows = []
+                empty = False
+        if len(rows) > 0 or empty:
+            yield header, _parse_rows(header, rows)
+
+
+# returns: list - the header of a trip csv
+def read_header(file):
+    with open(file, 'r', newline='') as csv_file:
+        return next(csv.reader(csv_file, delimiter=','))
+
+
+# Iterates over a trip csv in chunks of at most chunk_size rows, so trips larger than the memory can be processed. Only
+# one chunk is kept in memory at a time.
+# input: row_filter - RowFilter or None - applied to every chunk, chunks can end up shorter or empty
+# returns: generator of TripData
+def iter_trip(file, chunk_size=4096, row_filter=None):
+    for header, columns in _read_blocks(file, chunk_size):
+        chunk = TripData(header, columns)
+        if row_filter is not None:
+            chunk = row_filter.apply(chunk)
+        yield chunk
+
+
+# Loads a trip csv into a TripData. The file is parsed a block of rows at a time to keep the strings read from the file
+# from piling up.
+def load_trip(file, block_size=4096):
+    blocks = list(_read_blocks(file, block_size))
+    header = blocks[0][0]
+    if len(blocks) == 1:
+        return TripData(header, blocks[0][1])
+    return TripData(header, {name: numpy.concatenate([block[name] for h, block in blocks]) for name in header})
+
+
+# Writes every column of a trip as a .npy file, named by its index in the header, and the local frame of the trip, if it
+# has coordinates
+def _save_columns(trip, directory):
+    for i, name in enumerate(trip.header):
+        numpy.save(os.path.join(directory, '%d.npy' % i), trip[name])
+    metadata = {'header': trip.header, 'frame': None}
+
+    try:
+        metadata['frame'] = trip.local_frame().to_dict()
+    except (KeyError, ValueError):
+        pass
+    return metadata
+
+
+def _load_columns(directory, metadata, mmap):
+    header = metadata['header']
+    mmap_mode = 'r' if mmap else None
+    columns = {name: numpy.load(os.path.join(directory, '%d.npy' % i), mmap_mode=mmap_mode)
+               for i, name in enumerate(header)}
+
+    frame = LocalFrame.from_dict(metadata['frame']) if metadata['frame'] is not None else None
+    return TripData(header, columns, frame)
+
+
+# Loads a trip csv through its binary cache, see DataCache. The first load parses the csv and writes one .npy file per
+# column, and the local frame, the next ones read the columns without parsing. The cache is
+# rebuilt when the csv changes.
+# input: mmap - boolean - memory map the columns instead of reading them. Mapped columns are read-only
+def load_trip_cached(file, mmap=True):
+    return DataCache.cached(file, 'trip', lambda: load_trip(file), _save_columns,
+                            lambda directory, metadata: _load_columns(directory, metadata, mmap))
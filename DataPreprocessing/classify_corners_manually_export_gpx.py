@@ -1,11 +1,16 @@
+from DataPreprocessing.Model import DataCache
 from DataPreprocessing.Model.Corner import Corner
+from DataPreprocessing.Model.CornerFile import is_corner_file, read_corners_binary, write_corners_binary
+from DataPreprocessing.Model.LocalFrame import LocalFrame
 from DataPreprocessing.Model.Node import Node
+from DataPreprocessing.route_resampling import douglas_peucker
 import json
+import os
 import gpxpy.gpx
 import xml.etree.ElementTree as ET
 
 
-def load_corners(input_file):
+def _parse_corners(input_file):
     corners = []
 
     with open(input_file, 'r') as file:
@@ -17,15 +22,46 @@ def load_corners(input_file):
     return corners
 
 
-def export_to_gpx(corners, output_file):
+def _save_corners(corners, directory):
+    write_corners_binary(corners, os.path.join(directory, 'corners.corners'))
+    return None
+
+
+def _load_corners(directory, metadata):
+    return read_corners_binary(os.path.join(directory, 'corners.corners'))
+
+
+# Loads corners written by write_corners, either as json or in the binary format of CornerFile. The json is parsed once
+# and the corners are read from the binary cache next to it afterwards, without parsing or computing the corner
+# properties again.
+def load_corners(input_file):
+    if is_corner_file(input_file):
+        return read_corners_binary(input_file)
+    return DataCache.cached(input_file, 'corners', lambda: _parse_corners(input_file), _save_corners, _load_corners)
+
+
+# Writes the corners as gpx tracks, one per corner, colored in turns.
+# input: simplify_tolerance - m or None - leaves out the points of a track within this distance of the track simplified
+#                             with douglas_peucker. The first and last points of every corner are kept
+def export_to_gpx(corners, output_file, simplify_tolerance=None):
     gpx = gpxpy.gpx.GPX()
 
+    frame = None
+    if simplify_tolerance is not None and len(corners) > 0:
+        frame = LocalFrame.for_points([n.latitude for c in corners for n in c.nodes],
+                                      [n.longitude for c in corners for n in c.nodes])
+
     colors = ['#FF0000', '#00FF00', '#0000FF']
     color_index = 0
     for corner in corners:
         gpx_track = gpxpy.gpx.GPXTrack()
         gpx_segment = gpxpy.gpx.GPXTrackSegment()
-        for node in corner.nodes:
+        nodes = corner.nodes
+        if frame is not None:
+            north, east = frame.to_local([n.latitude for n in nodes], [n.longitude for n in nodes])
+            kept = douglas_peucker(north, east, simplify_tolerance)
+            nodes = [n for n, k in zip(nodes, kept.tolist()) if k]
+        for node in nodes:
             track_point = gpxpy.gpx.GPXTrackPoint(latitude=node.latitude, longitude=node.longitude)
             gpx_segment.points.append(track_point)
 
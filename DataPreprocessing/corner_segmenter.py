@@ -0,0 +1,255 @@
+import json
+import math
+
+from DataPreprocessing.Model.AutomotiveDataRow import compile_header
+from DataPreprocessing.Model.Corner import Corner
+from DataPreprocessing.Model.Node import Node
+from DataPreprocessing.get_corners_from_route import determinant, get_direction, get_radius
+
+
+# Splits a trip into corners and straights while it is read, one row or node at a time. Gives the same corners as
+# split_into_corners on the whole trip, but each one as soon as it is finished instead of after the last row:
+#   - rows are grouped into nodes like get_nodes does, a node is finished when the coordinates change
+#   - the determinant and radius of node[i - 2], node[i - 1], node[i] are computed when node[i] is finished, like
+#     get_determinants_and_radiuses does
+#   - a run of straight triples becomes a straight once it has succesive_0s_for_straight triples, shorter runs stay
+#     part of the corner around them. At most succesive_0s_for_straight triples wait to be decided
+#   - corners are closed when a straight begins or the direction changes, like find_corners does, and the first
+#     corner, the false identification find_corners drops, is dropped as well
+# The work for a new node does not depend on the length of the trip. Finished corners are returned by add_row, add_node
+# and finish, and passed to on_corner if it is given.
+# A triple with two identical points is straight and has no radius, like in get_determinants_and_radiuses.
+class CornerSegmenter:
+    _straight_radius_threshold = None
+    _min_determinant_abs = None
+    _succesive_0s_for_straight = None
+    _frame = None
+    _on_corner = None
+
+    # rows of the node being built and its coordinates
+    _rows = None
+    _latitude = None
+    _longitude = None
+    # the last 2 finished nodes, with their coordinates in the frame, for the next triple
+    _previous = None
+    _last_node = None
+
+    # straight triples not decided yet: (node, radius)
+    _pending = None
+    # the nodes and radiuses of the straight being built, None if the last triples are not a straight
+    _straight_nodes = None
+    _straight_radiuses = None
+    # the straight closed by the last triple, emitted by the corner step
+    _closed_straight = None
+
+    # state of the corner step, see find_corners
+    _prev_det = 0
+    _nodes = None
+    _radiuses = None
+    _first = True
+    _finished = False
+
+    # input: straight_radius_threshold, min_determinant_abs, succesive_0s_for_straight, frame - see split_into_corners
+    #        on_corner - function(Corner) or None - called for every finished corner or straight
+    def __init__(self, straight_radius_threshold=0.006, min_determinant_abs=float('2e-10'), succesive_0s_for_straight=7,
+                 frame=None, on_corner=None):
+        if succesive_0s_for_straight < 1:
+            raise ValueError("succesive_0s_for_straight must be at least 1")
+        self._straight_radius_threshold = straight_radius_threshold
+        self._min_determinant_abs = min_determinant_abs
+        self._succesive_0s_for_straight = succesive_0s_for_straight
+        self._frame = frame
+        self._on_corner = on_corner
+        self._rows = []
+        self._previous = []
+        self._pending = []
+        self._nodes = []
+        self._radiuses = []
+
+    # Adds the next row of the trip. Rows must be sanitized and snapped like the rows given to split_into_corners.
+    # returns: list of the corners finished by the row
+    def add_row(self, adr):
+        finished = []
+        if len(self._rows) > 0 and (adr.latitude != self._latitude or adr.longitude != self._longitude):
+            finished = self.add_node(Node(self._latitude, self._longitude, self._rows))
+            self._rows = []
+        if len(self._rows) == 0:
+            self._latitude = adr.latitude
+            self._longitude = adr.longitude
+        self._rows.append(adr)
+        return finished
+
+    # Adds the next node of the trip, for nodes built elsewhere. Not to be mixed with add_row.
+    # returns: list of the corners finished by the node
+    def add_node(self, node):
+        if self._finished:
+            raise ValueError("The segmenter is finished")
+        finished = []
+        x, y = node.latitude, node.longitude
+        if self._frame is not None:
+            x, y = self._frame.to_local(x, y)
+            x, y = float(x), float(y)
+
+        if len(self._previous) == 2:
+            det, radius = self._triple(self._previous[0][1:], self._previous[1][1:], (x, y))
+            self._add_triple(self._previous[0][0], det, radius, finished)
+            self._previous.pop(0)
+        self._previous.append((node, x, y))
+        self._last_node = node
+        return finished
+
+    # Ends the trip. The rows of the last node are dropped, like get_nodes does, since the node has not ended.
+    # returns: list of the corners finished at the end of the trip
+    def finish(self):
+        if self._finished:
+            return []
+        self._finished = True
+        finished = []
+        if self._last_node is None:
+            return finished
+
+        for node, radius in self._pending:
+            self._step(node, 0, radius, finished)
+        self._pending = []
+        if self._straight_nodes is not None:
+            self._closed_straight = Corner(self._straight_nodes + [self._last_node], get_direction(0),
+                                           self._straight_radiuses)
+
+        if self._prev_det is None:
+            self._emit(self._closed_straight, finished)
+        else:
+            self._nodes.append(self._last_node)
+            try:
+                self._emit(Corner(self._nodes, get_direction(self._prev_det), self._radiuses), finished)
+            except ValueError:
+                pass
+        return finished
+
+    # the determinant and radius of a triple, as get_determinants_and_radiuses gives them
+    def _triple(self, a, b, c):
+        if a == b or b == c or a == c:
+            return 0, None
+        det = determinant(a[0], a[1], b[0], b[1], c[0], c[1])
+        radius = None
+        if det != 0:
+            try:
+                radius = get_radius(a[0], a[1], b[0], b[1], c[0], c[1])
+            except (ValueError, ZeroDivisionError):
+                radius = None
+            if radius is not None and not math.isfinite(radius):
+                radius = None
+        if radius is None or radius > self._straight_radius_threshold or abs(det) < self._min_determinant_abs:
+            return 0, radius
+        return det, radius
+
+    # decides which triples are straights, the first loop of find_corners
+    def _add_triple(self, node, det, radius, finished):
+        if det == 0:
+            if self._straight_nodes is not None:
+                self._straight_nodes.append(node)
+                self._straight_radiuses.append(radius)
+                self._step(node, None, radius, finished)
+                return
+            self._pending.append((node, radius))
+            if len(self._pending) == self._succesive_0s_for_straight:
+                self._straight_nodes = [n for n, r in self._pending]
+                self._straight_radiuses = [r for n, r in self._pending]
+                for n, r in self._pending:
+                    self._step(n, None, r, finished)
+                self._pending = []
+            return
+
+        if self._straight_nodes is not None:
+            self._closed_straight = Corner(self._straight_nodes + [node], get_direction(0), self._straight_radiuses)
+            self._straight_nodes = None
+            self._straight_radiuses = None
+        for n, r in self._pending:
+            self._step(n, 0, r, finished)
+        self._pending = []
+        self._step(node, det, radius, finished)
+
+    # one iteration of the second loop of find_corners. det is None for the triples of a straight
+    def _step(self, node, det, radius, finished):
+        if self._prev_det is None and det is not None:
+            self._emit(self._closed_straight, finished)
+            self._closed_straight = None
+            self._nodes = []
+            self._radiuses = []
+            self._prev_det = det
+
+        if self._prev_det is not None and (det is None or self._prev_det * det < 0):
+            self._nodes.append(node)
+            try:
+                self._emit(Corner(self._nodes, get_direction(self._prev_det), self._radiuses), finished)
+            except ValueError:
+                pass
+            self._nodes = []
+            self._radiuses = []
+            self._prev_det = det
+
+        # the nodes of a straight are collected by _add_triple
+        if det is not None:
+            self._nodes.append(node)
+            self._radiuses.append(radius)
+
+    def _emit(self, corner, finished):
+        if self._first:
+            self._first = False
+            return
+        finished.append(corner)
+        if self._on_corner is not None:
+            self._on_corner(corner)
+
+
+# Features of a corner worth keeping while driving
+SUMMARY_PROPERTIES = ['direction', 'fuel_used', 'distance_traveled', 'entry_speed', 'exit_speed', 'avg_speed',
+                      'min_radius', 'avg_radius', 'max_centrifugal', 'avg_map', 'avg_load']
+
+
+# returns: dict - the SUMMARY_PROPERTIES of a corner, the time its first and last node were logged and its node count
+def corner_summary(corner):
+    summary = {name: getattr(corner, name) for name in SUMMARY_PROPERTIES}
+    summary['nodes'] = len(corner.nodes)
+    summary['start'] = corner.nodes[0].latitude, corner.nodes[0].longitude
+    summary['end'] = corner.nodes[-1].latitude, corner.nodes[-1].longitude
+    return summary
+
+
+# Splits the rows written by the data logger into corners while driving. Rows are sanitized and stationary rows are
+# collapsed like in process_trips, the points are not snapped. Every finished corner is appended to output_file as a line
+# of json, see corner_summary.
+class LiveCorners:
+    _codec = None
+    _output = None
+    _speed_threshold = None
+    _previous_distance = None
+    _segmenter = None
+
+    # input: header - the csv header of the rows
+    #        output_file - json lines file, appended to
+    #        speed_threshold - see sanitary_filter
+    #        segmenter_parameters - see CornerSegmenter
+    def __init__(self, header, output_file, speed_threshold=10, **segmenter_parameters):
+        self._codec = compile_header(header)
+        self._output = open(output_file, 'a')
+        self._speed_threshold = speed_threshold
+        self._segmenter = CornerSegmenter(on_corner=self._write, **segmenter_parameters)
+
+    # Adds a logged row, the values in the order of the header
+    def add(self, values):
+        # parsed from the text written to the csv, so the values are the ones the offline pipeline reads
+        adr = self._codec.parse(['' if v is None else str(v) for v in values])
+        if not adr.is_sanitary(speed_threshold=self._speed_threshold):
+            return
+        if adr.distance == self._previous_distance:
+            return
+        self._previous_distance = adr.distance
+        self._segmenter.add_row(adr)
+
+    def _write(self, corner):
+        self._output.write(json.dumps(corner_summary(corner)) + '\n')
+        self._output.flush()
+
+    def close(self):
+        self._segmenter.finish()
+        self._output.close()
@@ -1,14 +1,28 @@
 import math
 
+import numpy
+
 import DataPreprocessing.Model.AutomotiveDataRow
-import move_nodes_to_road_median_axis
 import json
 
-from DataPreprocessing.Model.Corner import Corner
-from DataPreprocessing.Model.Node import Node
+from Accelerometer.AccelerometerCalibration import AccelerometerCalibration
+from DataPreprocessing.Model.Corner import Corner, compute_statistics
+from DataPreprocessing.Model.CornerFile import CORNER_FILE_EXTENSION, write_corners_binary
+from DataPreprocessing.Model.Node import NodeStore
+from DataPreprocessing.Model.LocalFrame import LocalFrame
+from DataPreprocessing.route_resampling import resample_nodes, simplify_nodes
 
 INPUT_FILE = '/Users/antoniuficard/Documents/OBDlogs/Data/Prezentare/snap_floresti_centura_retur2.csv'
 OUTPUT_FILE = '/Users/antoniuficard/Documents/OBDlogs/Data/Prezentare/split_floresti_centura_retur2.json'
+# calibration fitted on the raw trip with Accelerometer/AccelerometerCalibration.py. If set, the corner accelerometer
+# statistics are in g in the vehicle frame instead of raw counts
+CALIBRATION_FILE = None
+
+# thresholds of split_into_corners for points projected to a LocalFrame, in m and m^2. They are the degree thresholds
+# converted at the latitude of the recorded trips, and give the same direction for about 95% of the node triples, the
+# rest being the triples whose degree radius was distorted by the direction of the road.
+METRIC_STRAIGHT_RADIUS_THRESHOLD = 450
+METRIC_MIN_DETERMINANT_ABS = 1.7
 
 
 # determinant of the matrix given by the coordinates of 3 points
@@ -41,49 +55,87 @@ def get_direction(det):
         return 'right'
     return 'left'
 
-# converts the AutomotiveDataRow objects to Node
+# converts the AutomotiveDataRow objects to Node. Consecutive rows with the same coordinates are one node, the nodes of
+# the trip share one NodeStore.
 def get_nodes(automotive_data):
-    data = []
-    nodes = []
+    groups = []
+    start = 0
     for i in range(len(automotive_data) - 1):
-        data.append(automotive_data[i])
         if automotive_data[i].latitude != automotive_data[i + 1].latitude or automotive_data[i].longitude != \
                 automotive_data[i + 1].longitude:
-            nodes.append(Node(automotive_data[i].latitude, automotive_data[i].longitude, data))
-            data = []
+            groups.append((automotive_data[i].latitude, automotive_data[i].longitude, automotive_data[start:i + 1]))
+            start = i + 1
+
+    return NodeStore.from_groups(groups).nodes()
+
+# get_radius for arrays of points. Where the radius cannot be computed, because the points are collinear or two of them
+# have the same latitude, it is inf or nan instead of raising.
+def get_radiuses(xa, ya, xb, yb, xc, yc):
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        yo = ((xa - xc) * (xa * xa + ya * ya - xb * xb - yb * yb) - (xa - xb) * (xa * xa + ya * ya - xc * xc - yc * yc)) / (
+                2 * ((ya - yb) * (xa - xc) - (ya - yc) * (xa - xb)))
+
+        xo = numpy.where(xa != xb,
+                         (xa * xa + ya * ya - xb * xb - yb * yb - 2 * yo * (ya - yb)) / (2 * (xa - xb)),
+                         (xa * xa + ya * ya - xc * xc - yc * yc - 2 * yo * (ya - yc)) / (2 * (xa - xc)))
+        xo[(xa == xb) & (xa == xc)] = numpy.inf
+
+        return numpy.sqrt((xb - xo) * (xb - xo) + (yb - yo) * (yb - yo))
+
+
+# gets the determinants and radiuses of the triples node[i - 1], node[i], node[i + 1] before any threshold. A triple
+# where two of the points are the same, i.e. a node going back to the coordinates of the node before the previous one,
+# has determinant 0 and radius nan, so it is straight and has no radius, like in CornerSegmenter. Where the radius
+# cannot be computed it is inf or nan, see get_radiuses.
+# The determinants and radiuses of all the triples are computed at once, with the operations of determinant and
+# get_radius in the same order, so the values are the same as computing them one triple at a time.
+# input: frame - LocalFrame or None - see get_determinants_and_radiuses
+# returns: determinants, radiuses - numpy arrays, one value per triple, len(automotive_data) - 2
+def get_triples(automotive_data, frame=None):
+    if len(automotive_data) < 3:
+        return numpy.zeros(0), numpy.zeros(0)
+
+    latitudes = numpy.array([row.latitude for row in automotive_data], dtype=numpy.float64)
+    longitudes = numpy.array([row.longitude for row in automotive_data], dtype=numpy.float64)
+    if frame is not None:
+        # north and east keep the orientation of latitude and longitude, so the sign of the determinants is the same
+        latitudes, longitudes = frame.to_local(latitudes, longitudes)
+    x1, y1 = latitudes[:-2], longitudes[:-2]
+    x2, y2 = latitudes[1:-1], longitudes[1:-1]
+    x3, y3 = latitudes[2:], longitudes[2:]
+
+    repeated = (x1 == x2) & (y1 == y2) | (x3 == x2) & (y3 == y2) | (x1 == x3) & (y1 == y3)
+    dets = determinant(x1, y1, x2, y2, x3, y3)
+    radiuses = get_radiuses(x1, y1, x2, y2, x3, y3)
+    dets[repeated] = 0
+    radiuses[repeated] = numpy.nan
+    return dets, radiuses
+
+
+# applies the thresholds of get_determinants_and_radiuses to the triples given by get_triples
+# returns: determinants, radiuses - lists, see get_determinants_and_radiuses
+def classify_triples(dets, radiuses, straight_radius_threshold, min_determinant_abs):
+    has_radius = (dets != 0) & numpy.isfinite(radiuses)
+    straight = ~has_radius | (radiuses > straight_radius_threshold) | (numpy.abs(dets) < min_determinant_abs)
+
+    determinants = [0 if s else det for det, s in zip(dets.tolist(), straight.tolist())]
+    radiuses_all = [radius if h else None for radius, h in zip(radiuses.tolist(), has_radius.tolist())]
+    return determinants, radiuses_all
 
-    return nodes
 
 # gets an array containing the determinants and radiuses determined by the sequence of points.
-# it evaluates node[i - 1], node[i] and node[i + 1]
+# it evaluates node[i - 1], node[i] and node[i + 1]. If two of the points are the same, the triple is straight, see
+# get_triples
 # if the points are collinear, the radius is set to None
 # if the radius or determinant do not reach the minimum threshold, the points are considered collinear.
-def get_determinants_and_radiuses(automotive_data, straight_radius_threshold=0.007, min_determinant_abs=float('1e-10')):
-    determinants = []
-    radiuses_all = []
-
-    for i in range(len(automotive_data) - 2):
-        row1 = automotive_data[i]
-        row2 = automotive_data[i + 1]
-        row3 = automotive_data[i + 2]
-
-        if row1.latitude == row2.latitude and row1.longitude == row2.longitude or row3.latitude == row2.latitude and row3.longitude == row2.longitude or row1.latitude == row3.latitude and row1.longitude == row3.longitude:
-            continue
-
-        det = determinant(row1.latitude, row1.longitude, row2.latitude, row2.longitude, row3.latitude, row3.longitude)
-        radius = None
-
-        if det != 0:
-            radius = get_radius(row1.latitude, row1.longitude, row2.latitude, row2.longitude, row3.latitude,
-                                row3.longitude)
-
-        if radius is not None and radius > straight_radius_threshold or abs(det) < min_determinant_abs:
-            det = 0
-
-        determinants.append(det)
-        radiuses_all.append(radius)
-
-    return determinants, radiuses_all
+# if the radius cannot be computed, i.e. the points are almost collinear and rounding makes the determinant not 0, the
+# points are considered collinear as well.
+# input: frame - LocalFrame or None. If given, the points are projected to it and the determinants, radiuses and
+#                thresholds are in m^2 and m, see METRIC_STRAIGHT_RADIUS_THRESHOLD. Otherwise they are in degrees
+def get_determinants_and_radiuses(automotive_data, straight_radius_threshold=0.007, min_determinant_abs=float('1e-10'),
+                                  frame=None):
+    dets, radiuses = get_triples(automotive_data, frame)
+    return classify_triples(dets, radiuses, straight_radius_threshold, min_determinant_abs)
 
 # gets an array of corners given the input nodes, determinants and and radiuses. For a sequence to be considered a
 # straight section there must be at least succesive_0s_for_straight adjacent nodes.
@@ -179,14 +231,100 @@ def find_corners(input_nodes, determinants, radiuses_all, succesive_0s_for_strai
     return corners[1:]
 
 
-if __name__ == '__main__':
-    automotive_data, header = DataPreprocessing.Model.AutomotiveDataRow.load_csv(INPUT_FILE)
+# Nodes that simplify_nodes must keep for find_corners to split the simplified nodes at the same nodes as all of them:
+# the first node of every straight, of every corner and of every change of direction and the node after it, the first
+# succesive_0s_for_straight nodes of every straight, so it is still long enough to be a straight, the node ending every
+# run of straight triples, so shorter runs are not joined into one long enough to be a straight, and the last 2 nodes.
+# Dropping any other node only removes a triple that does not start or end a corner.
+# returns: numpy boolean array, one value per node
+def corner_boundaries(determinants, node_count, succesive_0s_for_straight):
+    keep = numpy.zeros(node_count, dtype=bool)
+    keep[max(node_count - 2, 0):] = True
+    dets = numpy.array(determinants, dtype=numpy.float64)
+    if len(dets) == 0:
+        return keep
+
+    # runs of straight triples long enough to be straights, like the first loop of find_corners
+    zero = numpy.concatenate([[False], dets == 0, [False]])
+    changes = numpy.flatnonzero(zero[1:] != zero[:-1])
+    starts, ends = changes[0::2], changes[1::2]
+    long_enough = ends - starts >= succesive_0s_for_straight
+    straight = numpy.zeros(len(dets), dtype=bool)
+    for start, end in zip(starts[long_enough].tolist(), ends[long_enough].tolist()):
+        straight[start:end] = True
+        keep[start:start + succesive_0s_for_straight] = True
+    # the triple ending every run, so shorter runs are not joined into a straight
+    keep[ends[ends < len(dets)]] = True
+
+    # direction of every triple, a straight triple in a corner keeps the direction before it
+    signs = numpy.sign(dets)
+    signs[straight] = 2
+    known = signs != 0
+    carried = signs[numpy.maximum.accumulate(numpy.where(known, numpy.arange(len(dets)), 0))]
+    keep[0] = True
+    keep[1:len(dets)] |= carried[1:] != carried[:-1]
+    # the node after a first node is kept as well, so the first node, which is also the last node of the corner before,
+    # does not take over samples of the next corner
+    keep[1:] |= keep[:-1].copy()
+    return keep
+
+
+# Splits snapped AutomotiveDataRows into corners and straights, with the thresholds used for the snapped trips.
+# input: frame - LocalFrame or None - see get_determinants_and_radiuses. With a frame, the thresholds are in m and m^2,
+#                i.e. METRIC_STRAIGHT_RADIUS_THRESHOLD and METRIC_MIN_DETERMINANT_ABS, and the corner radiuses in m
+#        resample_spacing - m or None - resamples the nodes to this spacing along the route with resample_nodes before
+#                           computing the curvature. Needs a frame. succesive_0s_for_straight is then in nodes of
+#                           resample_spacing
+#        smoothing_window - see resample_nodes
+#        simplify_tolerance - m or None - drops the nodes within this distance of the simplified route with
+#                             simplify_nodes, keeping the corner_boundaries, before splitting. The corners start and end
+#                             at the same nodes and hold the same samples, only their radiuses and rise are computed on
+#                             fewer nodes
+def split_into_corners(automotive_data, straight_radius_threshold=0.006, min_determinant_abs=float('2e-10'),
+                       succesive_0s_for_straight=7, frame=None, resample_spacing=None, smoothing_window=None,
+                       simplify_tolerance=None):
+    nodes = get_nodes(automotive_data)
+    if resample_spacing is not None:
+        if frame is None:
+            raise ValueError("Resampling needs a LocalFrame")
+        nodes = resample_nodes(nodes, frame, resample_spacing, smoothing_window)
+
+    determinants, radiuses = get_determinants_and_radiuses(nodes, straight_radius_threshold=straight_radius_threshold,
+                                                           min_determinant_abs=min_determinant_abs, frame=frame)
+    if simplify_tolerance is not None and len(nodes) > 2:
+        simplify_frame = frame
+        if simplify_frame is None:
+            simplify_frame = LocalFrame.for_points([n.latitude for n in nodes], [n.longitude for n in nodes])
+        keep = corner_boundaries(determinants, len(nodes), succesive_0s_for_straight)
+        kept, nodes = simplify_nodes(nodes, simplify_frame, simplify_tolerance, keep)
+        determinants = [determinants[i] for i in kept[:-2]]
+        radiuses = [radiuses[i] for i in kept[:-2]]
+    return find_corners(nodes, determinants, radiuses, succesive_0s_for_straight=succesive_0s_for_straight)
+
+
+# Writes corners to json, encoded with Corner.to_array, or in the binary format of CornerFile if output_file has its
+# extension
+def write_corners(corners, output_file):
+    if output_file.endswith(CORNER_FILE_EXTENSION):
+        write_corners_binary(corners, output_file)
+        return
+    compute_statistics(corners)
+    arrayed_corners = []
+
+    for corner in corners:
+        arrayed_corners.append(corner.to_array())
+
+    with open(output_file, "w") as file:
+        json.dump(arrayed_corners, file, indent=4)
+
 
-    automotive_data = get_nodes(automotive_data)
+def process_data(input_file=INPUT_FILE, output_file=OUTPUT_FILE, calibration_file=CALIBRATION_FILE):
+    automotive_data, header = DataPreprocessing.Model.AutomotiveDataRow.load_csv(input_file)
 
-    determinants, radiuses = get_determinants_and_radiuses(automotive_data, straight_radius_threshold=0.006,
-                                                           min_determinant_abs=float('2e-10'))
-    corners = find_corners(automotive_data, determinants, radiuses, succesive_0s_for_straight=7)
+    if calibration_file is not None:
+        AccelerometerCalibration.load(calibration_file).apply_to_rows(automotive_data)
+
+    corners = split_into_corners(automotive_data)
 
     fuel_used = 0
     distance = 0
@@ -197,10 +335,8 @@ if __name__ == '__main__':
     print("Fuel used:", fuel_used)
     print("Distance:", distance)
 
-    arrayed_corners = []
+    write_corners(corners, output_file)
 
-    for corner in corners:
-        arrayed_corners.append(corner.to_array())
 
-    with open(OUTPUT_FILE, "w") as file:
-        json.dump(arrayed_corners, file, indent=4)
+if __name__ == '__main__':
+    process_data()
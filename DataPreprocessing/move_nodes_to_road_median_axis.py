@@ -1,15 +1,38 @@
+import collections
 import math
+import weakref
 
+import numpy
 import requests
 import xml.etree.ElementTree as ET
 
-from DataPreprocessing.Model.AutomotiveDataRow import load_csv, write_to_csv
+from DataPreprocessing.Model.AutomotiveDataRow import CsvWriter, iter_csv
+from DataPreprocessing.Model.RoadNetwork import load_road_network
+from DataPreprocessing.Model.TripData import read_header
 
 INPUT_FILE = '/Users/antoniuficard/Documents/OBDlogs/Data/Prezentare/test15_05_2024_1.csv'
 OUTPUT_FILE = '/Users/antoniuficard/Documents/OBDlogs/Data/Prezentare/snap_test15_05_2024_1.csv'
+# local OSM extract, .osm or .pbf, to snap on instead of querying the Overpass API. None uses the Overpass API
+OSM_FILE = None
+# directory of the Overpass tiles the roads of a trip are loaded into before it is snapped, see overpass_cache. None
+# queries the Overpass API for every point that leaves its way
+OVERPASS_CACHE = 'Data/OverpassCache'
 
 overpass_url = "http://overpass-api.de/api/interpreter"
 
+# distances of point_in_way, in degrees for gps coordinates and in m for coordinates projected to a LocalFrame
+# width of a lane, a point can be this far from the median axis for every lane on its side of the road
+LANE_WIDTH = float('369e-7')
+LANE_WIDTH_M = 4.1
+# how much further than the lanes a point can be, and how much further when no way of the previous point fits it
+MARGIN = float('28e-6')
+MARGIN_M = 3.1
+FORCED_MARGIN = float('738e-7')
+FORCED_MARGIN_M = 8.2
+# how far outside a segment its projection can be
+SEGMENT_TOLERANCE = float('6e-6')
+SEGMENT_TOLERANCE_M = 0.67
+
 
 # checks if an element has the highway tag
 def is_highway(element):
@@ -25,8 +48,12 @@ def is_highway(element):
 
 # gets the ways in the vicinity of a coordinate set on a given radius, if the ways are highways
 # if no ways were found, it recursively retries with a radius greater by 2 units and the process repeats until a way is found
-def get_way(request_latitude, request_longitude, request_radius=10):
+# input: network - RoadNetwork or None - answers from a local OSM extract instead of the Overpass API
+def get_way(request_latitude, request_longitude, request_radius=10, network=None):
     global overpass_url
+    if network is not None:
+        return network.get_way(request_latitude, request_longitude, request_radius)
+
     overpass_query = f"""
     [out:xml];
     (
@@ -72,8 +99,8 @@ def euclidian_distance(x1, y1, x2, y2):
 #        xh - float - x coordinate of the projection
 #        yh - float - y coordinate of the projection
 #        dist - float - distance to projection
-# raises: ValueError - no orthogonal projection can be found on the segment.
-def find_projection_on_segment(x, y, xa, ya, xb, yb):
+# raises: ValueError - no orthogonal projection can be found on the segment, farther than tolerance outside it.
+def find_projection_on_segment(x, y, xa, ya, xb, yb, tolerance=SEGMENT_TOLERANCE):
     a = ya - yb
     b = xb - xa
     c = xa * yb - xb * ya
@@ -96,7 +123,7 @@ def find_projection_on_segment(x, y, xa, ya, xb, yb):
         ya = yb
         yb = aux
 
-    if xh < xa - float('6e-6') or xh > xb + float('6e-6') or yh < ya - float('6e-6') or yh > yb + float('6e-6'):
+    if xh < xa - tolerance or xh > xb + tolerance or yh < ya - tolerance or yh > yb + tolerance:
         raise ValueError
 
     return xh, yh, d_pr
@@ -110,45 +137,152 @@ def get_lanes(w):
     return 1
 
 
+# The segments of a way: xa, ya, xb, yb of every pair of consecutive nd children, projected to frame if it is given, and
+# the lanes of the way, None if its lanes tag is not a number. Computed once per way and frame, while the way is used.
+def _way_segments(w, frame):
+    by_frame = _segment_cache.get(w)
+    if by_frame is None:
+        by_frame = {}
+        _segment_cache[w] = by_frame
+    if frame in by_frame:
+        return by_frame[frame]
+
+    ends = []
+    for i in range(len(w) - 1):
+        if w[i].tag == 'nd' and w[i + 1].tag == 'nd':
+            xa = float(w[i].attrib['lat'])
+            ya = float(w[i].attrib['lon'])
+            xb = float(w[i + 1].attrib['lat'])
+            yb = float(w[i + 1].attrib['lon'])
+            if frame is not None:
+                # one point at a time, so the coordinates are exactly the ones point_in_way always used
+                xa, ya = frame.to_local(xa, ya)
+                xb, yb = frame.to_local(xb, yb)
+            ends.append((float(xa), float(ya), float(xb), float(yb)))
+    try:
+        lanes = get_lanes(w)
+    except ValueError:
+        lanes = None
+
+    by_frame[frame] = (ends, lanes)
+    return by_frame[frame]
+
+
+# way element -> {frame: _way_segments}, forgotten with the way
+_segment_cache = weakref.WeakKeyDictionary()
+# (ways, frame, segments) of the last list of ways, which is used for every point until one is not on it. Keyed on the
+# ways of the list, not the list, so a list changed in place is read again
+_last_segments = None
+
+# segments from which point_in_way projects with numpy, below it one segment at a time is faster
+VECTORIZE_MIN_SEGMENTS = 48
+
+
+# The segments of all the ways of a list, one after the other, with the index of their way and the distances from the
+# median axis a point can be at on them, see point_in_way. Lists of VECTORIZE_MIN_SEGMENTS segments or more also get
+# the parts of find_projection_on_segment that do not depend on the point, as numpy arrays.
+def _ways_segments(way, frame, lane_width, margin, forced_margin, tolerance):
+    global _last_segments
+    key = tuple(way)
+    # read once, another thread replacing it only makes this one build the segments again
+    last = _last_segments
+    if last is not None and last[0] == key and last[1] == frame:
+        return last[2]
+
+    segments = []
+    for i, w in enumerate(way):
+        ends, lanes = _way_segments(w, frame)
+        if lanes is None:
+            # never fits a point, like get_lanes raising in point_in_way
+            continue
+        distance = lanes * lane_width + margin
+        forced_distance = lanes * lane_width + forced_margin
+        segments.extend((xa, ya, xb, yb, i, distance, forced_distance) for xa, ya, xb, yb in ends)
+
+    arrays = None
+    if len(segments) >= VECTORIZE_MIN_SEGMENTS:
+        xa, ya, xb, yb, _, distance, forced_distance = (numpy.array(column) for column in zip(*segments))
+        a = ya - yb
+        b = xb - xa
+        c = xa * yb - xb * ya
+        norm = a * a + b * b
+        arrays = {'a': a, 'b': b, 'c': c, 'norm': norm, 'length': numpy.sqrt(norm), 'ac': a * c, 'bc': b * c,
+                  'x_low': numpy.minimum(xa, xb) - tolerance, 'x_high': numpy.maximum(xa, xb) + tolerance,
+                  'y_low': numpy.minimum(ya, yb) - tolerance, 'y_high': numpy.maximum(ya, yb) + tolerance,
+                  'single': numpy.flatnonzero((a == 0) & (b == 0)), 'distance': distance,
+                  'forced_distance': forced_distance}
+
+    _last_segments = (key, frame, (segments, arrays))
+    return segments, arrays
+
+
+# find_projection_on_segment of a point on every segment of _ways_segments at once, with its operations in the same
+# order, so the projections are the same as finding them one segment at a time.
+# returns: indices of the segments the point fits on, xh, yh, distances - numpy arrays
+def _project(x, y, segments, arrays, force):
+    a, b = arrays['a'], arrays['b']
+    ay = a * y
+    bx = b * x
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        d_pr = numpy.abs(a * x + b * y + arrays['c']) / arrays['length']
+        xh = (b * (bx - ay) - arrays['ac']) / arrays['norm']
+        yh = (a * (ay - bx) - arrays['bc']) / arrays['norm']
+
+    fits = ~((xh < arrays['x_low']) | (xh > arrays['x_high']) | (yh < arrays['y_low']) | (yh > arrays['y_high']))
+    # a segment of one point projects to the point itself
+    for i in arrays['single'].tolist():
+        xa, ya = segments[i][0], segments[i][1]
+        xh[i], yh[i], d_pr[i] = xa, ya, euclidian_distance(xa, ya, x, y)
+        fits[i] = True
+    if not force:
+        fits &= ~(d_pr > arrays['distance'])
+    fits &= ~(d_pr > arrays['forced_distance'])
+    return numpy.flatnonzero(fits).tolist(), xh, yh, d_pr
+
+
 # Sees if a point is on a way. Checks each segment that composes the way and gets the projection to that segment if the distance
 #   is less than the amount of lanes and a set threshold. The threshold distance is greater if the force parameter is true.
+# The segments and lanes of the ways are read once, while the ways are used, and the projections on many segments are
+#   computed at once.
 # input: x - x coordinate of the point
 #        y - y coordinate of the point
 #        way - way given by the api
 #        force - boolean - defaults to False. Attempts to use a greater distance from the median axis of the road
+#        frame - LocalFrame or None - if given, the point and the segments are projected to it and the distances are
+#                in m instead of degrees. The coordinates of the projections are still latitude and longitude
 # returns: all projections on all eligible segments in the way
-def point_in_way(x, y, way, force=False):
+def point_in_way(x, y, way, force=False, frame=None):
     if way is None:
         return []
 
-    xa = math.inf
-    ya = math.inf
-    xb = math.inf
-    yb = math.inf
+    lane_width, margin, forced_margin, tolerance = LANE_WIDTH, MARGIN, FORCED_MARGIN, SEGMENT_TOLERANCE
+    if frame is not None:
+        lane_width, margin, forced_margin, tolerance = LANE_WIDTH_M, MARGIN_M, FORCED_MARGIN_M, SEGMENT_TOLERANCE_M
+        x, y = frame.to_local(x, y)
+
+    segments, arrays = _ways_segments(way, frame, lane_width, margin, forced_margin, tolerance)
+    if arrays is not None:
+        fits, xh, yh, d_pr = _project(x, y, segments, arrays, force)
+        projections = [(segments[i][4], xh[i], yh[i], d_pr[i]) for i in fits]
+    else:
+        projections = []
+        for xa, ya, xb, yb, i, distance, forced_distance in segments:
+            try:
+                xd, yd, dist = find_projection_on_segment(x, y, xa, ya, xb, yb, tolerance)
+            except ValueError:
+                continue
+            if not force and dist > distance:
+                continue
+            if dist > forced_distance:
+                continue
+            projections.append((i, xd, yd, dist))
 
     result = []
-
-    for w in way:
-        for i in range(len(w) - 1):
-            if w[i].tag == 'nd' and w[i + 1].tag == 'nd':
-                xa = float(w[i].attrib['lat'])
-                ya = float(w[i].attrib['lon'])
-                xb = float(w[i + 1].attrib['lat'])
-                yb = float(w[i + 1].attrib['lon'])
-
-                try:
-                    xd, yd, dist = find_projection_on_segment(x, y, xa, ya, xb, yb)
-                    if not force and dist > get_lanes(w) * float('369e-7') + float('28e-6'):
-                        continue
-                    if dist > get_lanes(w) * float('369e-7') + float('738e-7'):
-                        continue
-                    result.append([w, xd, yd, dist])
-                except ValueError:
-                    continue
-
-    if len(result) != 0:
-        return result
-    return []
+    for i, xd, yd, dist in projections:
+        if frame is not None:
+            xd, yd = frame.to_geodetic(xd, yd)
+        result.append([way[i], float(xd), float(yd), float(dist)])
+    return result
 
 
 # Gets the properties of a way.
@@ -202,6 +336,28 @@ def way_similarity_grade(w1, w2):
     return 0
 
 
+# Finds all eligible projections of a point. The ways of the previous point are tried first, if the point is not on
+#   them, the ways around the point are requested.
+# input: adr - AutomotiveDataRow
+#        way - the ways used for the previous point, None for the first point
+#        i - index of the point, for logging
+#        frame - LocalFrame or None - see point_in_way
+#        network - RoadNetwork or None - see get_way
+# returns: snapped - projections sorted by distance, way - the ways to use for the next point
+def find_point_projections(adr, way, i, frame=None, network=None):
+    snapped = point_in_way(adr.latitude, adr.longitude, way, frame=frame)
+    if way is not None and len(snapped) != 0:
+        return sorted(snapped, key=lambda p: p[3]), way
+
+    way = get_way(adr.latitude, adr.longitude, network=network)
+    snapped = point_in_way(adr.latitude, adr.longitude, way, force=True, frame=frame)
+
+    if way is None or len(snapped) == 0:
+        print('way is null for i:', i, adr.latitude, adr.longitude)
+
+    return sorted(snapped, key=lambda p: p[3]), way
+
+
 # Gets an array of AutomotiveDataRow and attempts to find all eligible projections on all ways for each set of coordinates.
 # Returns an array and for each corresponding AutomotiveDataRow there is an array that contains all projections, the way it
 #   it is projected on, the coordinates and distance of the projection.
@@ -216,26 +372,47 @@ def load_from_osm(automotive_data):
         if i % 50 == 0:
             print(i)
 
-        snapped = point_in_way(adr.latitude, adr.longitude, way)
-        if way is None or len(snapped) == 0:
-            way = get_way(adr.latitude, adr.longitude)
-        else:
-            snapped_points.append(snapped)
-            continue
+        snapped, way = find_point_projections(adr, way, i)
+        snapped_points.append(snapped)
 
-        snapped = point_in_way(adr.latitude, adr.longitude, way, force=True)
+    return snapped_points
 
-        snapped_points.append(snapped)
 
-        if way is None or len(snapped) == 0:
-            print('way is null for i:', i, adr.latitude, adr.longitude)
+# Moves a point to the best projection, using the projections of the points correction_range behind and ahead.
+# input: adr - AutomotiveDataRow
+#        snapped - projections of the point
+#        before - projections of the point correction_range behind, None if the point is at the start of the trip
+#        after - projections of the point correction_range ahead, None if the point is at the end of the trip
+def snap_point(adr, snapped, before, after, similarity_threshold=0.3):
+    if len(snapped) == 0:
+        return
+
+    if before is None or after is None:
+        adr.latitude = snapped[0][1]
+        adr.longitude = snapped[0][2]
+        return
+
+    found = False
+    best_similarity = 0
+    best_similarity_way = None
+    for s in snapped:
+        try:
+            similarity = way_similarity_grade(before[0][0], after[0][0]) * way_similarity_grade(after[0][0], s[0])
+            if similarity >= similarity_threshold and similarity > best_similarity:
+                best_similarity = similarity
+                best_similarity_way = s
+                found = True
+                break
+        except IndexError:
+            pass
 
-    for i in range(len(automotive_data)):
-        snapped = snapped_points[i]
-        snapped = sorted(snapped, key=lambda p: p[3])
-        snapped_points[i] = snapped
+    if found:
+        adr.latitude = best_similarity_way[1]
+        adr.longitude = best_similarity_way[2]
 
-    return snapped_points
+    if not found:
+        adr.latitude = snapped[0][1]
+        adr.longitude = snapped[0][2]
 
 
 # Tries to move each point to the best projection. Looks at points ahead and behind to find ways with better similarity grades.
@@ -248,66 +425,97 @@ def load_from_osm(automotive_data):
 #                                                 it does not move the point.
 def snap_points_to_nearest_nodes(automotive_data, snapped_points, correction_range=36, similarity_threshold=0.3):
     for i in range(len(automotive_data)):
-        snapped = snapped_points[i]
-
-        if len(snapped) == 0:
-            continue
-
-        if i < correction_range or i > len(automotive_data) - 1 - correction_range and len(snapped) >= 1:
-            automotive_data[i].latitude = snapped[0][1]
-            automotive_data[i].longitude = snapped[0][2]
-            continue
-
-        after_5 = snapped_points[i + correction_range]
-        before_5 = snapped_points[i - correction_range]
-
-        found = False
-        best_similarity = 0
-        best_similarity_way = None
-        for s in snapped:
-            try:
-                similarity = way_similarity_grade(before_5[0][0], after_5[0][0]) * way_similarity_grade(after_5[0][0], s[0])
-                if similarity >= similarity_threshold and similarity > best_similarity:
-                    best_similarity = similarity
-                    best_similarity_way = s
-                    found = True
-                    break
-            except IndexError:
-                pass
-
-        if found:
-            automotive_data[i].latitude = best_similarity_way[1]
-            automotive_data[i].longitude = best_similarity_way[2]
-
-        if not found:
-            automotive_data[i].latitude = snapped[0][1]
-            automotive_data[i].longitude = snapped[0][2]
-
-
-def process_data():
-    # loads data from file
-    automotive_data, header = load_csv(INPUT_FILE)
-
-    new_ad = [automotive_data[0]]
-
-    # converts sequences of points when the car was stationary - no distance increase - to a single row.
-    for i in range(1, len(automotive_data)):
-        if automotive_data[i].distance == automotive_data[i - 1].distance:
-            continue
-        new_ad.append(automotive_data[i])
-    automotive_data = new_ad
-    new_ad = None
-
-    print("Size of sanitised data:", len(automotive_data))
-
-    # loads ways that are in range
-    points = load_from_osm(automotive_data)
+        before = None
+        after = None
+        if correction_range <= i <= len(automotive_data) - 1 - correction_range:
+            before = snapped_points[i - correction_range]
+            after = snapped_points[i + correction_range]
+
+        snap_point(automotive_data[i], snapped_points[i], before, after, similarity_threshold)
+
+
+# Converts sequences of points when the car was stationary - no distance increase - to a single row. The distance of the
+#   last row is carried over between chunks.
+# input: chunks - iterable of lists of AutomotiveDataRow, i.e. iter_csv()
+# returns: generator of AutomotiveDataRow
+def collapse_stationary(chunks):
+    previous_distance = None
+    first = True
+    for chunk in chunks:
+        for adr in chunk:
+            if not first and adr.distance == previous_distance:
+                continue
+            first = False
+            previous_distance = adr.distance
+            yield adr
+
+
+# Streaming version of load_from_osm followed by snap_points_to_nearest_nodes. Only the projections of the last
+#   2 * correction_range + 1 points are kept, each point is moved and given back as soon as the point correction_range
+#   ahead of it is known. The result is the same as snapping the whole trip at once.
+# input: automotive_data - iterable of AutomotiveDataRow
+#        frame - LocalFrame or None - see point_in_way
+#        network - RoadNetwork or None - see get_way
+# returns: generator of the moved AutomotiveDataRows, in the same order
+def snap_stream(automotive_data, correction_range=36, similarity_threshold=0.3, frame=None, network=None):
+    window = collections.deque(maxlen=2 * correction_range + 1)
+    way = None
+    i = 0
 
-    # attempts to move the points
-    snap_points_to_nearest_nodes(automotive_data, points)
+    for adr in automotive_data:
+        i += 1
+        if i % 50 == 0:
+            print(i)
 
-    # writes the data to the csv
-    write_to_csv(automotive_data, header, OUTPUT_FILE)
+        snapped, way = find_point_projections(adr, way, i, frame, network)
+        window.append((adr, snapped))
+
+        # the point correction_range behind the newest one can be moved now
+        if i > correction_range:
+            current, current_snapped = window[-1 - correction_range]
+            before = window[0][1] if len(window) == window.maxlen else None
+            snap_point(current, current_snapped, before, snapped, similarity_threshold)
+            yield current
+
+    # the last points have no point correction_range ahead
+    for current, current_snapped in list(window)[max(len(window) - min(i, correction_range), 0):]:
+        snap_point(current, current_snapped, None, None, similarity_threshold)
+        yield current
+
+
+# Loads, sanitizes, collapses stationary rows and snaps the points of a trip, a chunk of the file at a time.
+# input: frame - LocalFrame or None - see point_in_way, i.e. load_trip_cached(input_file).local_frame()
+#        network - RoadNetwork or None - see get_way, i.e. load_road_network(OSM_FILE)
+#        overpass_cache - directory of the tiles loaded for the whole trip when network is None, see prefetch_trip.
+#                         None queries the Overpass API point by point
+# returns: generator of the snapped AutomotiveDataRows
+def snap_trip(input_file, chunk_size=4096, row_filter=None, correction_range=36, similarity_threshold=0.3, frame=None,
+              network=None, overpass_cache=OVERPASS_CACHE):
+    if network is None and overpass_cache is not None:
+        # imported here, overpass_cache builds on this module
+        from DataPreprocessing.overpass_cache import prefetch_trip
+        network = prefetch_trip(input_file, row_filter, overpass_cache)
+    return snap_stream(collapse_stationary(iter_csv(input_file, chunk_size, row_filter)), correction_range,
+                       similarity_threshold, frame, network)
+
+
+# Collapses stationary rows, snaps the points and writes them, a chunk of the input file at a time. Memory use does not
+#   depend on the length of the trip.
+# input: osm_file - OSM extract to snap on without network access, see load_road_network. None for the Overpass API
+#        overpass_cache - see snap_trip
+def process_data(input_file=INPUT_FILE, output_file=OUTPUT_FILE, chunk_size=4096, correction_range=36,
+                 similarity_threshold=0.3, osm_file=OSM_FILE, overpass_cache=OVERPASS_CACHE):
+    header = read_header(input_file)
+    print(header)
+    network = load_road_network(osm_file) if osm_file is not None else None
+
+    with CsvWriter(output_file, header) as writer:
+        for adr in snap_trip(input_file, chunk_size, correction_range=correction_range,
+                             similarity_threshold=similarity_threshold, network=network,
+                             overpass_cache=overpass_cache):
+            writer.write(adr)
+
+    print("Size of sanitised data:", writer.count)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,303 @@
+import json
+import math
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import numpy
+import requests
+
+from DataPreprocessing import move_nodes_to_road_median_axis
+from DataPreprocessing.Model.RoadNetwork import DEFAULT_RADIUS, RADIUS_STEP, RoadNetwork
+from DataPreprocessing.Model.RowFilter import DEFAULT_FILTER
+from DataPreprocessing.Model.TripData import load_trip_cached
+
+CACHE_DIRECTORY = move_nodes_to_road_median_axis.OVERPASS_CACHE
+# degrees of latitude and longitude on the side of a tile, about 1.1 x 0.75 km around the recorded trips
+TILE_SIZE = 0.01
+# s after which a tile is fetched again, the ways of a stale tile are still used if the Overpass API cannot be reached
+MAX_AGE = 30 * 24 * 3600
+# bytes the tiles can take on disk, the least recently used tiles are removed beyond it
+MAX_SIZE = 256 * 1024 * 1024
+# m around the points of a trip whose tiles prefetch loads
+PREFETCH_MARGIN = 50
+# m the radius of get_way grows to at most. Ways farther away are never close enough for point_in_way
+MAX_RADIUS = 1000
+# m in a degree of latitude
+METERS_PER_DEGREE = 111320
+# most tiles requested in one query, and s the Overpass API is given to answer it
+MAX_TILES_PER_REQUEST = 256
+REQUEST_TIMEOUT = 180
+
+# bumped when the format of the tile files changes, which fetches every tile again
+TILE_VERSION = 1
+
+
+# Highway ways of the Overpass API, fetched by TILE_SIZE tiles and kept on disk, so the roads of a trip are only
+# requested the first time they are driven. Answers get_way like RoadNetwork, from the tiles around the point, fetching
+# the tiles it does not have. Every tile is a json file in the cache directory, holding the time it was fetched and its
+# ways with the coordinates of their nodes:
+#   - a tile older than max_age is fetched again when it is needed
+#   - a tile is touched every time it is read, and the least recently used tiles are removed when the tiles take more
+#     than max_size bytes
+#   - files are written to a temporary file and renamed, so an interrupted write leaves no broken tile
+# The ways of the tiles read by a process stay in memory, in one RoadNetwork.
+class OverpassTiles:
+    _directory = None
+    _tile_size = None
+    _url = None
+    _max_age = None
+    _max_size = None
+    # tile -> list of (id, tags, [(ref, latitude, longitude)])
+    _tiles = None
+    _network = None
+    # amount of requests sent to the Overpass API
+    _requests = 0
+
+    # input: url - of the Overpass API, None for overpass_url of move_nodes_to_road_median_axis
+    def __init__(self, directory=CACHE_DIRECTORY, tile_size=TILE_SIZE, max_age=MAX_AGE, max_size=MAX_SIZE, url=None):
+        self._directory = directory
+        self._tile_size = tile_size
+        self._url = url
+        self._max_age = max_age
+        self._max_size = max_size
+        self._tiles = {}
+        self._requests = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def requests(self):
+        return self._requests
+
+    # returns: set of the tiles around the points, closer than margin m to one of them
+    def tiles_around(self, latitudes, longitudes, margin):
+        latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+        longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+        valid = numpy.isfinite(latitudes) & numpy.isfinite(longitudes)
+        latitudes, longitudes = latitudes[valid], longitudes[valid]
+        d_latitude = margin / METERS_PER_DEGREE
+        d_longitude = margin / (METERS_PER_DEGREE * numpy.maximum(numpy.cos(numpy.radians(latitudes)), 1e-6))
+
+        size = self._tile_size
+        south = numpy.floor((latitudes - d_latitude) / size).astype(numpy.int64)
+        north = numpy.floor((latitudes + d_latitude) / size).astype(numpy.int64)
+        west = numpy.floor((longitudes - d_longitude) / size).astype(numpy.int64)
+        east = numpy.floor((longitudes + d_longitude) / size).astype(numpy.int64)
+        tiles = set()
+        # a margin smaller than a tile spans at most 2 tiles each way, larger ones are rare enough to loop over
+        for s, n, w, e in set(zip(south.tolist(), north.tolist(), west.tolist(), east.tolist())):
+            for x in range(s, n + 1):
+                for y in range(w, e + 1):
+                    tiles.add((x, y))
+        return tiles
+
+    # Loads the tiles of a trip at once, the missing ones in one request or a few, so the trip is snapped without
+    # waiting for the API point by point.
+    # input: latitudes, longitudes - the points of the trip, NaN are ignored
+    def prefetch(self, latitudes, longitudes, margin=PREFETCH_MARGIN):
+        self._load(self.tiles_around(latitudes, longitudes, margin))
+
+    # Gets the highway ways around a point, see RoadNetwork.get_way. The tiles are loaded as the radius grows, so after
+    # prefetch only the points farther than the prefetch margin from every way load more. The radius grows up to
+    # MAX_RADIUS.
+    # returns: list of ET.Element or None if there is no way within MAX_RADIUS
+    def get_way(self, latitude, longitude, radius=DEFAULT_RADIUS):
+        reach = max(radius, RADIUS_STEP)
+        while True:
+            reach = min(reach, MAX_RADIUS)
+            self._load(self.tiles_around([latitude], [longitude], reach))
+            ways = None
+            if self._network is not None:
+                ways = self._network.get_way(latitude, longitude, radius, reach)
+            if ways is not None or reach >= MAX_RADIUS:
+                return ways
+            reach *= 2
+
+    # Makes sure the ways of the tiles are in the network. The tiles that are not on disk, or are stale, are requested
+    # together, see _fetch.
+    def _load(self, tiles):
+        missing = [t for t in tiles if t not in self._tiles]
+        if len(missing) == 0:
+            return
+
+        stale = {}
+        for tile in missing:
+            stored, fresh = self._read_tile(tile)
+            if fresh:
+                self._tiles[tile] = stored
+            else:
+                stale[tile] = stored
+        for first in range(0, len(stale), MAX_TILES_PER_REQUEST):
+            requested = sorted(stale)[first:first + MAX_TILES_PER_REQUEST]
+            try:
+                fetched = self._fetch(requested)
+            except requests.RequestException:
+                if any(stale[t] is None for t in requested):
+                    raise
+                print("Using", len(requested), "stale tiles, the Overpass API cannot be reached")
+                fetched = {t: stale[t] for t in requested}
+            else:
+                for tile in requested:
+                    self._write_tile(tile, fetched[tile])
+            self._tiles.update(fetched)
+
+        self._evict()
+        self._build_network()
+
+    def _build_network(self):
+        ways = {}
+        nodes = {}
+        for tile_ways in self._tiles.values():
+            for way_id, tags, way_nodes in tile_ways:
+                if way_id in ways:
+                    continue
+                ways[way_id] = (way_id, tags, [ref for ref, latitude, longitude in way_nodes])
+                for ref, latitude, longitude in way_nodes:
+                    nodes[ref] = (latitude, longitude)
+        self._network = RoadNetwork.from_ways(list(ways.values()), nodes) if len(ways) > 0 else None
+
+    def _tile_file(self, tile):
+        return os.path.join(self._directory, '%s_%d_%d.json' % (repr(self._tile_size), tile[0], tile[1]))
+
+    # returns: the ways stored for a tile, None if there are none, and if they are recent enough to be used
+    def _read_tile(self, tile):
+        file = self._tile_file(tile)
+        try:
+            with open(file, 'r') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None, False
+        if stored.get('version') != TILE_VERSION:
+            return None, False
+        if time.time() - stored['fetched'] > self._max_age:
+            return stored['ways'], False
+
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        return stored['ways'], True
+
+    # returns: south, west, north, east of a tile
+    def _bounds(self, tile):
+        size = self._tile_size
+        return tile[0] * size, tile[1] * size, (tile[0] + 1) * size, (tile[1] + 1) * size
+
+    # Requests the highway ways of tiles in one query, a union of boxes. The tiles next to each other in a row of the
+    # grid are one box. The ways crossing a box are given out whole, and every way is given to the tiles its bounding
+    # box overlaps, so a tile holds every way crossing it and a few long ways passing by its corners.
+    # returns: dict tile -> ways
+    def _fetch(self, tiles):
+        boxes = []
+        for tile in sorted(tiles):
+            if len(boxes) > 0 and boxes[-1][1] == (tile[0], tile[1] - 1):
+                boxes[-1][1] = tile
+            else:
+                boxes.append([tile, tile])
+        statements = []
+        for first, last in boxes:
+            south, west, _, _ = self._bounds(first)
+            _, _, north, east = self._bounds(last)
+            statements.append(f'way["highway"]({south!r},{west!r},{north!r},{east!r});')
+        overpass_query = """
+    [out:xml][timeout:%d];
+    (
+      %s
+    );
+    out geom;
+    """ % (REQUEST_TIMEOUT, '\n      '.join(statements))
+
+        self._requests += 1
+        response = requests.post(self._url if self._url is not None else move_nodes_to_road_median_axis.overpass_url,
+                                 data=overpass_query, timeout=REQUEST_TIMEOUT + 30)
+        response.raise_for_status()
+
+        fetched = {tile: [] for tile in tiles}
+        size = self._tile_size
+        for way in parse_ways(response.text):
+            latitudes = [latitude for ref, latitude, longitude in way[2]]
+            longitudes = [longitude for ref, latitude, longitude in way[2]]
+            if len(latitudes) == 0:
+                continue
+            for x in range(math.floor(min(latitudes) / size), math.floor(max(latitudes) / size) + 1):
+                for y in range(math.floor(min(longitudes) / size), math.floor(max(longitudes) / size) + 1):
+                    if (x, y) in fetched:
+                        fetched[(x, y)].append(way)
+        return fetched
+
+    def _write_tile(self, tile, ways):
+        file = self._tile_file(tile)
+        # the temporary file is named after the process, so the processes of process_trips do not write over each other
+        temporary = '%s.%d.tmp' % (file, os.getpid())
+        try:
+            with open(temporary, 'w') as f:
+                json.dump({'version': TILE_VERSION, 'tile': list(tile), 'fetched': time.time(), 'ways': ways}, f)
+            os.replace(temporary, file)
+        except OSError as e:
+            print("Could not cache the tile", tile, e)
+
+    # removes the least recently used tiles until the tiles take at most max_size bytes
+    def _evict(self):
+        files = []
+        total = 0
+        for name in os.listdir(self._directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        for mtime, size, name in sorted(files):
+            if total <= self._max_size:
+                break
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except OSError:
+                continue
+            total -= size
+
+
+# Reads the highway ways of an Overpass "out geom" answer.
+# returns: list of (id, tags, [(ref, latitude, longitude)])
+def parse_ways(xml_data):
+    ways = []
+    for element in ET.fromstring(xml_data):
+        if element.tag != 'way' or not move_nodes_to_road_median_axis.is_highway(element):
+            continue
+        tags = {t.attrib['k']: t.attrib['v'] for t in element if t.tag == 'tag'}
+        nodes = [(int(nd.attrib['ref']), float(nd.attrib['lat']), float(nd.attrib['lon'])) for nd in element
+                 if nd.tag == 'nd' and 'lat' in nd.attrib]
+        ways.append((int(element.attrib['id']), tags, nodes))
+    return ways
+
+
+# caches already opened by this process, by directory
+_opened = {}
+
+
+# Opens the tile cache of a directory. A process keeps the caches it opened, so the trips it processes share the tiles
+# in memory.
+# input: url - see OverpassTiles
+def open_tiles(directory=CACHE_DIRECTORY, url=None):
+    key = (os.path.abspath(directory), url)
+    if key not in _opened:
+        _opened[key] = OverpassTiles(directory, url=url)
+    return _opened[key]
+
+
+# Opens the tile cache of a directory and loads the tiles around the points of a trip that are snapped, the rows that
+# pass row_filter, in the fewest requests. Snapping the trip on the returned tiles then sends no request of its own.
+# input: row_filter - RowFilter, None for DEFAULT_FILTER, see iter_csv
+#        url - see OverpassTiles
+# returns: OverpassTiles - network for get_way
+def prefetch_trip(input_file, row_filter=None, directory=CACHE_DIRECTORY, url=None):
+    if row_filter is None:
+        row_filter = DEFAULT_FILTER
+    trip = load_trip_cached(input_file)
+    mask = row_filter.mask(trip)
+    tiles = open_tiles(directory, url)
+    tiles.prefetch(trip['LATITUDE'][mask], trip['LONGITUDE'][mask])
+    return tiles
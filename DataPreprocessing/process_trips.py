@@ -0,0 +1,198 @@
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+
+from Accelerometer.AccelerometerCalibration import AccelerometerCalibration
+from DataPreprocessing.get_corners_from_route import METRIC_MIN_DETERMINANT_ABS, METRIC_STRAIGHT_RADIUS_THRESHOLD, \
+    split_into_corners, write_corners
+from DataPreprocessing.Model.AutomotiveDataRow import CsvWriter, iter_csv
+from DataPreprocessing.Model.CornerFile import CORNER_FILE_EXTENSION
+from DataPreprocessing.Model.RoadNetwork import load_road_network
+from DataPreprocessing.Model.RowFilter import sanitary_filter
+from DataPreprocessing.Model.TripData import load_trip_cached, read_header
+from DataPreprocessing.move_nodes_to_road_median_axis import collapse_stationary, snap_stream
+from DataPreprocessing.overpass_cache import CACHE_DIRECTORY, prefetch_trip
+
+INPUT_DIRECTORY = 'Data/Raw'
+OUTPUT_DIRECTORY = 'Data/Processed'
+# amount of processes, None for one per core
+WORKERS = None
+
+# bumped when the processing changes in a way the parameters do not show, which reprocesses every trip
+PIPELINE_VERSION = 3
+
+# parameters of every step of the pipeline. A change to any of them reprocesses the trips
+DEFAULT_PARAMETERS = {
+    # sanitization, see sanitary_filter
+    'speed_threshold': 10,
+    # snapping to the road median axis, see snap_points_to_nearest_nodes. False keeps the gps coordinates, for working
+    # without the Overpass API
+    'snap': True,
+    # local OSM extract, .osm or .pbf, snapped on instead of the Overpass API, see RoadNetwork. None queries the API
+    'osm_file': None,
+    # directory of the tiles of the Overpass API answers, see OverpassTiles. The roads of a trip are requested once
+    # and snapped on from the disk afterwards. None queries the API for every point that leaves its road
+    'overpass_cache': CACHE_DIRECTORY,
+    # url of the Overpass API the tiles are requested from, i.e. an OverpassEmulator. None for overpass_url of
+    # move_nodes_to_road_median_axis
+    'overpass_url': None,
+    # work on the coordinates projected to the local frame of the trip, in m, instead of degrees. The frame is stored
+    # in the trip cache, see TripData.local_frame. Snapping then uses distances in m and corner splitting the metric
+    # thresholds
+    'local_frame': False,
+    'correction_range': 36,
+    'similarity_threshold': 0.3,
+    # accelerometer calibration file, see AccelerometerCalibration
+    'calibration_file': None,
+    # corner splitting, see get_corners_from_route
+    'straight_radius_threshold': 0.006,
+    'min_determinant_abs': float('2e-10'),
+    'succesive_0s_for_straight': 7,
+    # the corner splitting thresholds in m and m^2, used instead of the ones above with local_frame
+    'metric_straight_radius_threshold': METRIC_STRAIGHT_RADIUS_THRESHOLD,
+    'metric_min_determinant_abs': METRIC_MIN_DETERMINANT_ABS,
+    # with local_frame, m between the nodes the curvature is computed on and odd amount of nodes to smooth the route
+    # over, see resample_nodes. None keeps a node per gps position
+    'resample_spacing': None,
+    'smoothing_window': None,
+    # m, drops the nodes within this distance of the simplified route before splitting, see split_into_corners. None
+    # keeps every node
+    'simplify_tolerance': None,
+}
+
+
+def _file_key(file):
+    stat = os.stat(file)
+    return {'path': os.path.abspath(file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# Key of the result of a trip. It changes when the trip, the calibration file, the parameters or the pipeline change.
+def result_key(input_file, parameters):
+    key = {'version': PIPELINE_VERSION, 'input': _file_key(input_file), 'parameters': parameters}
+    if parameters['calibration_file'] is not None:
+        key['calibration'] = _file_key(parameters['calibration_file'])
+    if parameters['osm_file'] is not None:
+        key['osm'] = _file_key(parameters['osm_file'])
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+# returns: paths of the snapped csv, of the corners and of the result summary of a trip. The corners are written in the
+#          binary format of CornerFile, load_corners reads them
+def output_files(input_file, output_directory):
+    name = os.path.splitext(os.path.basename(input_file))[0]
+    return (os.path.join(output_directory, 'snap_' + name + '.csv'),
+            os.path.join(output_directory, 'split_' + name + CORNER_FILE_EXTENSION),
+            os.path.join(output_directory, name + '.result.json'))
+
+
+def _read_result(result_file):
+    try:
+        with open(result_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Runs the whole pipeline on one trip: load, sanitization, stationary collapse, snapping, node building and corner
+# splitting. The snapped rows and the corners are written to the output directory, with a summary keyed by
+# result_key. If the summary matches, the trip was already processed with the same parameters and is skipped.
+# returns: dict - the summary: input, snapped and corners files, rows, corners, fuel used, distance, cached. On failure
+#          the summary has an error instead of the results
+def process_trip(input_file, output_directory, parameters):
+    snapped_file, corners_file, result_file = output_files(input_file, output_directory)
+    key = result_key(input_file, parameters)
+
+    result = _read_result(result_file)
+    if result is not None and result.get('key') == key and os.path.exists(snapped_file) and \
+            os.path.exists(corners_file):
+        result['cached'] = True
+        return result
+
+    result = {'key': key, 'input': input_file, 'snapped': snapped_file, 'corners_file': corners_file}
+    try:
+        frame = None
+        if parameters['local_frame']:
+            frame = load_trip_cached(input_file).local_frame()
+
+        row_filter = sanitary_filter(speed_threshold=parameters['speed_threshold'])
+        automotive_data = collapse_stationary(iter_csv(input_file, row_filter=row_filter))
+        if parameters['snap']:
+            network = None
+            if parameters['osm_file'] is not None:
+                network = load_road_network(parameters['osm_file'])
+            elif parameters['overpass_cache'] is not None:
+                network = prefetch_trip(input_file, row_filter, parameters['overpass_cache'],
+                                        parameters['overpass_url'])
+            automotive_data = snap_stream(automotive_data, parameters['correction_range'],
+                                          parameters['similarity_threshold'], frame, network)
+
+        snapped = []
+        with CsvWriter(snapped_file, read_header(input_file)) as writer:
+            for adr in automotive_data:
+                writer.write(adr)
+                snapped.append(adr)
+
+        if parameters['calibration_file'] is not None:
+            AccelerometerCalibration.load(parameters['calibration_file']).apply_to_rows(snapped)
+
+        if frame is None:
+            corners = split_into_corners(snapped, parameters['straight_radius_threshold'],
+                                         parameters['min_determinant_abs'], parameters['succesive_0s_for_straight'],
+                                         simplify_tolerance=parameters['simplify_tolerance'])
+        else:
+            corners = split_into_corners(snapped, parameters['metric_straight_radius_threshold'],
+                                         parameters['metric_min_determinant_abs'],
+                                         parameters['succesive_0s_for_straight'], frame,
+                                         parameters['resample_spacing'], parameters['smoothing_window'],
+                                         parameters['simplify_tolerance'])
+        write_corners(corners, corners_file)
+    except Exception as e:
+        result['error'] = repr(e)
+        result['cached'] = False
+        return result
+
+    result['rows'] = len(snapped)
+    result['corners'] = len(corners)
+    result['fuel_used'] = sum(corner.fuel_used for corner in corners)
+    result['distance'] = sum(corner.distance_traveled for corner in corners)
+    with open(result_file, 'w') as f:
+        json.dump(result, f, indent=4)
+    result['cached'] = False
+    return result
+
+
+# Processes trips in a process pool. Trips that were already processed with the same parameters are not processed
+# again.
+# input: input_files - list of trip csvs
+#        parameters - dict - overrides of DEFAULT_PARAMETERS
+#        workers - amount of processes, None for one per core. 1 processes the trips in this process
+# returns: list of summaries, see process_trip, in the order of input_files whatever the order the trips finish in
+def process_trips(input_files, output_directory, parameters=None, workers=None):
+    all_parameters = dict(DEFAULT_PARAMETERS)
+    if parameters is not None:
+        unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+        if len(unknown) > 0:
+            raise ValueError("Unknown parameters: " + ", ".join(sorted(unknown)))
+        all_parameters.update(parameters)
+
+    os.makedirs(output_directory, exist_ok=True)
+    if workers == 1:
+        return [process_trip(file, output_directory, all_parameters) for file in input_files]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(process_trip, input_files, [output_directory] * len(input_files),
+                                 [all_parameters] * len(input_files)))
+
+
+if __name__ == '__main__':
+    input_files = sorted(glob.glob(os.path.join(INPUT_DIRECTORY, '*.csv')))
+    results = process_trips(input_files, OUTPUT_DIRECTORY, workers=WORKERS)
+
+    for result in results:
+        if 'error' in result:
+            print(result['input'], "FAILED:", result['error'])
+            continue
+        print(result['input'], "rows:", result['rows'], "corners:", result['corners'], "fuel used:",
+              result['fuel_used'], "distance:", result['distance'], "(cached)" if result['cached'] else "")
@@ -0,0 +1,232 @@
+import math
+
+import numpy
+
+from DataPreprocessing.Model.Node import NodeStore, SAMPLE_COLUMNS
+
+
+# Savitzky-Golay smoothing: every value is replaced by a polynomial of degree polyorder fitted by least squares on the
+# window around it. At the ends, where the window does not fit, the polynomial of the first and of the last window is
+# evaluated, like scipy.signal.savgol_filter(mode='interp') does.
+# input: values - numpy array of equidistant values
+#        window - odd number of values in a window
+#        polyorder - degree of the polynomial, smaller than window
+# returns: numpy array - the smoothed values. The values are returned as they are if there are fewer than window
+def savgol_smooth(values, window, polyorder=2):
+    if window % 2 != 1 or polyorder >= window:
+        raise ValueError("window must be odd and greater than polyorder")
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if len(values) < window:
+        return values.copy()
+
+    half = window // 2
+    positions = numpy.arange(-half, half + 1, dtype=numpy.float64)
+    # row i gives the coefficient of x^i of the fitted polynomial from the values of a window
+    fit = numpy.linalg.pinv(numpy.vander(positions, polyorder + 1, increasing=True))
+
+    windows = numpy.lib.stride_tricks.sliding_window_view(values, window)
+    smoothed = numpy.empty_like(values)
+    smoothed[half:len(values) - half] = windows @ fit[0]
+
+    edge = numpy.vander(positions[:half], polyorder + 1, increasing=True)
+    smoothed[:half] = edge @ (fit @ values[:window])
+    edge = numpy.vander(positions[half + 1:], polyorder + 1, increasing=True)
+    smoothed[len(values) - half:] = edge @ (fit @ values[-window:])
+    return smoothed
+
+
+# Resamples a path to points spacing apart along it. The first and last points are kept.
+# input: x, y - numpy arrays - the points, in m
+# returns: x, y of the new points, the position along the path of the new points and of the given points
+def resample_path(x, y, spacing):
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    steps = numpy.hypot(numpy.diff(x), numpy.diff(y))
+    positions = numpy.concatenate([[0], numpy.cumsum(steps)])
+    length = positions[-1]
+
+    count = max(int(math.ceil(length / spacing)), 1)
+    targets = numpy.linspace(0, length, count + 1) if length > 0 else numpy.zeros(1)
+    # interp needs increasing positions, points that do not move the path forward are left out
+    moving = numpy.concatenate([[True], steps > 0])
+    return (numpy.interp(targets, positions[moving], x[moving]), numpy.interp(targets, positions[moving], y[moving]),
+            targets, positions)
+
+
+# Resamples nodes built by get_nodes to nodes spacing m apart along the route, so curvature is computed on the same
+# amount of nodes per km whatever the speed and the gps rate. The samples of every node are given to the closest new
+# node along the route, so the samples of the trip are all kept and the new nodes aggregate them: fuel used and
+# distance are the extremes over their samples and the altitude is the one of their last sample, like Node does. New
+# nodes without samples get the fuel used and distance interpolated along the route, so the fuel and distance of a
+# corner are defined whatever node it starts and ends at, and no altitude. The new nodes share the sample columns of
+# the given nodes without copying them when the given nodes are contiguous in their store.
+# input: nodes - list of Node, in the order of the route
+#        frame - LocalFrame - the nodes are resampled in its coordinates
+#        spacing - m between the new nodes
+#        smoothing_window - odd amount of new nodes to smooth the route over with savgol_smooth, None not to smooth
+# returns: list of Node
+def resample_nodes(nodes, frame, spacing, smoothing_window=None, polyorder=2):
+    if len(nodes) < 2:
+        return list(nodes)
+
+    north, east, positions = _project_nodes(nodes, frame)
+    north, east, targets, positions = resample_path(north, east, spacing)
+    if smoothing_window is not None:
+        north = savgol_smooth(north, smoothing_window, polyorder)
+        east = savgol_smooth(east, smoothing_window, polyorder)
+    latitudes, longitudes = frame.to_geodetic(north, east)
+
+    # the new node every given node belongs to, never decreasing along the route
+    if len(targets) > 1:
+        owners = numpy.clip(numpy.rint(positions / (targets[1] - targets[0])).astype(numpy.int64), 0,
+                            len(targets) - 1)
+    else:
+        owners = numpy.zeros(len(nodes), dtype=numpy.int64)
+    firsts = numpy.searchsorted(owners, numpy.arange(len(targets) + 1))
+
+    return _regroup(nodes, firsts, latitudes, longitudes, positions, targets)
+
+
+# Builds new nodes from groups of nodes, the new node k holds the samples of the nodes [firsts[k], firsts[k + 1]).
+# input: latitudes, longitudes - numpy arrays - the coordinates of the new nodes
+#        positions, targets - numpy arrays - the positions along the route of the nodes and of the new nodes
+def _regroup(nodes, firsts, latitudes, longitudes, positions, targets):
+    store, indices = _node_samples(nodes)
+    counts = numpy.array([n.sample_count for n in nodes], dtype=numpy.int64)
+    sample_offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+    offsets = sample_offsets[firsts]
+
+    values = _aggregate_values(nodes, counts, firsts, positions, targets)
+    values['latitude'] = latitudes.tolist()
+    values['longitude'] = longitudes.tolist()
+    if indices is None:
+        columns = {name: store.samples_range(name, nodes[0].index, nodes[-1].index + 1) for name in SAMPLE_COLUMNS}
+    else:
+        columns = {name: store.take(name, indices) for name in SAMPLE_COLUMNS}
+    return NodeStore(columns, offsets, values).nodes()
+
+
+# returns: the store of the nodes and None if they follow each other in one store, the store and their indices in it
+#          if they are in one store, a store holding a copy of them otherwise
+def _node_samples(nodes):
+    store = nodes[0].store
+    indices = [n.index for n in nodes]
+    if all(n.store is store for n in nodes):
+        if indices == list(range(indices[0], indices[0] + len(indices))):
+            return store, None
+        return store, indices
+    arrays = [[n.latitude, n.longitude, n.Xs, n.Ys, n.Zs, n.max_fuel_used, n.max_distance, n.min_distance,
+               n.min_fuel_used, n.altitude, n.speeds, n.maps, n.calc_loads] for n in nodes]
+    return NodeStore.from_arrays(arrays), list(range(len(nodes)))
+
+
+# Aggregates the values of the given nodes over the new nodes, the new node k holds the given nodes
+# [firsts[k], firsts[k + 1]). positions and targets are the positions of the given and of the new nodes along the route.
+def _aggregate_values(nodes, counts, firsts, positions, targets):
+    store = nodes[0].store
+    contiguous = all(n.store is store for n in nodes) and nodes[-1].index - nodes[0].index == len(nodes) - 1
+
+    def column(name, missing):
+        if contiguous:
+            values = store.values_range(name, nodes[0].index, nodes[-1].index + 1)
+        else:
+            values = [getattr(n, name) for n in nodes]
+        return numpy.array([missing if v is None else v for v in values], dtype=numpy.float64)
+
+    groups = len(firsts) - 1
+    filled = firsts[1:] > firsts[:-1]
+    # reduceat over the starts of the new nodes that hold given nodes, each reduces up to the start of the next one
+    starts = firsts[:-1][filled]
+    sample_counts = numpy.add.reduceat(counts, starts)
+    without_samples = numpy.ones(groups, dtype=bool)
+    without_samples[filled] = sample_counts == 0
+    with_samples = counts > 0
+
+    values = {}
+    for name, reduce, missing, interpolated in [('max_fuel_used', numpy.maximum, 0, 'min_fuel_used'),
+                                                ('max_distance', numpy.maximum, 0, 'min_distance'),
+                                                ('min_distance', numpy.minimum, math.inf, 'min_distance'),
+                                                ('min_fuel_used', numpy.minimum, math.inf, 'min_fuel_used')]:
+        reduced = numpy.full(groups, missing, dtype=numpy.float64)
+        reduced[filled] = reduce.reduceat(column(name, missing), starts)
+        if numpy.any(with_samples) and numpy.any(without_samples):
+            reduced[without_samples] = numpy.interp(targets[without_samples], positions[with_samples],
+                                                    column(interpolated, missing)[with_samples])
+        values[name] = reduced.tolist()
+
+    # the altitude of the last given node with samples
+    last = numpy.full(groups, -1, dtype=numpy.int64)
+    last[filled] = numpy.maximum.reduceat(numpy.where(with_samples, numpy.arange(len(nodes)), -1), starts)
+    values['altitude'] = [None if i < 0 else nodes[i].altitude for i in last.tolist()]
+
+    return values
+
+
+# Douglas-Peucker simplification: keeps the points the polyline cannot do without to stay within tolerance of every
+# point. The points between two kept points are all closer than tolerance to the segment joining them.
+# input: x, y - numpy arrays - the points, in m
+#        tolerance - m
+#        keep - numpy boolean array or None - points that must be kept. The first and last points are always kept
+# returns: numpy boolean array - the kept points
+def douglas_peucker(x, y, tolerance, keep=None):
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    kept = numpy.zeros(len(x), dtype=bool) if keep is None else numpy.array(keep, dtype=bool)
+    if len(x) == 0:
+        return kept
+    kept[0] = True
+    kept[-1] = True
+
+    anchors = numpy.flatnonzero(kept).tolist()
+    stack = list(zip(anchors[:-1], anchors[1:]))
+    while len(stack) > 0:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(x[first + 1:last], y[first + 1:last], x[first], y[first], x[last], y[last])
+        farthest = int(numpy.argmax(distances))
+        if distances[farthest] <= tolerance:
+            continue
+        middle = first + 1 + farthest
+        kept[middle] = True
+        stack.append((first, middle))
+        stack.append((middle, last))
+    return kept
+
+
+# returns: numpy array - the distances of the points x, y to the segment a, b
+def _segment_distances(x, y, xa, ya, xb, yb):
+    dx = xb - xa
+    dy = yb - ya
+    length = dx * dx + dy * dy
+    if length == 0:
+        return numpy.hypot(x - xa, y - ya)
+    t = numpy.clip(((x - xa) * dx + (y - ya) * dy) / length, 0, 1)
+    return numpy.hypot(x - xa - t * dx, y - ya - t * dy)
+
+
+# returns: north, east of the nodes in the frame, and their positions along the route
+def _project_nodes(nodes, frame):
+    north, east = frame.to_local(numpy.array([n.latitude for n in nodes], dtype=numpy.float64),
+                                 numpy.array([n.longitude for n in nodes], dtype=numpy.float64))
+    positions = numpy.concatenate([[0], numpy.cumsum(numpy.hypot(numpy.diff(north), numpy.diff(east)))])
+    return north, east, positions
+
+
+# Simplifies the route of nodes with douglas_peucker. A kept node takes over the samples of the dropped nodes that
+# follow it, so every sample of the trip is still in a node and the corners built on the kept nodes aggregate the same
+# samples, as long as their first and last nodes are kept.
+# input: nodes - list of Node, in the order of the route
+#        frame - LocalFrame - tolerance is in its m
+#        keep - numpy boolean array or None - nodes that must be kept
+# returns: indices of the kept nodes, list of the new nodes
+def simplify_nodes(nodes, frame, tolerance, keep=None):
+    if len(nodes) < 3:
+        return list(range(len(nodes))), list(nodes)
+
+    north, east, positions = _project_nodes(nodes, frame)
+    kept = numpy.flatnonzero(douglas_peucker(north, east, tolerance, keep))
+    firsts = numpy.concatenate([kept, [len(nodes)]])
+    latitudes = numpy.array([nodes[i].latitude for i in kept.tolist()], dtype=numpy.float64)
+    longitudes = numpy.array([nodes[i].longitude for i in kept.tolist()], dtype=numpy.float64)
+    return kept.tolist(), _regroup(nodes, firsts, latitudes, longitudes, positions, positions[kept])
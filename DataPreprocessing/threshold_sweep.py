@@ -0,0 +1,278 @@
+import concurrent.futures
+import inspect
+import itertools
+import json
+import os
+
+from DataPreprocessing.Model.AutomotiveDataRow import load_csv
+from DataPreprocessing.Model.TripData import load_trip_cached
+from DataPreprocessing.classify_corners_manually_export_gpx import load_corners
+from DataPreprocessing.get_corners_from_route import METRIC_MIN_DETERMINANT_ABS, METRIC_STRAIGHT_RADIUS_THRESHOLD, \
+    classify_triples, find_corners, get_nodes, get_triples, split_into_corners
+
+# snapped trips and the corners they were split into and labeled with, see classify_corners_manually_export_gpx. The
+# corners must be the split of the snapped trip with the default thresholds, see check_labeled_trips
+LABELED_TRIPS = [
+    ('Data/MovedToMapNodes/snap_points_test_15_05_2024_1_trimmed.csv',
+     'Data/CornersSplitAndLabels/split_15_05_2024_1.json', 'Data/CornersSplitAndLabels/labels_15_05_2024_1_2.json'),
+    ('Data/MovedToMapNodes/snap_floresti_centura_retur.csv',
+     'Data/CornersSplitAndLabels/split_floresti_centura_retur.json',
+     'Data/CornersSplitAndLabels/labels_floresti_centura_retur.json'),
+    ('Data/MovedToMapNodes/snap_floresti_centura_tur.csv', 'Data/CornersSplitAndLabels/split_floresti_centura_tur.json',
+     'Data/CornersSplitAndLabels/labels_floresti_centura_tur.json'),
+]
+OUTPUT_FILE = 'Data/threshold_sweep.json'
+# amount of processes, None for one per core
+WORKERS = None
+# split the trips in the local frame of every trip, the thresholds are then in m and m^2 and METRIC_GRID is swept, see
+# split_into_corners
+LOCAL_FRAME = False
+
+# values of every threshold of split_into_corners, every combination of them is evaluated
+GRID = {
+    'straight_radius_threshold': [0.004, 0.005, 0.006, 0.007, 0.008, 0.01],
+    'min_determinant_abs': [float('5e-11'), float('1e-10'), float('2e-10'), float('5e-10')],
+    'succesive_0s_for_straight': [3, 5, 7, 9, 11],
+}
+# GRID in m and m^2, the same multiples of the metric thresholds as GRID of the default ones
+METRIC_GRID = {
+    'straight_radius_threshold': [METRIC_STRAIGHT_RADIUS_THRESHOLD * n / 6 for n in [4, 5, 6, 7, 8, 10]],
+    'min_determinant_abs': [METRIC_MIN_DETERMINANT_ABS * f for f in [0.25, 0.5, 1, 2.5]],
+    'succesive_0s_for_straight': GRID['succesive_0s_for_straight'],
+}
+# label of the straights, the other labels grade the corners
+STRAIGHT_LABEL = 'str'
+# amount of combinations printed
+SHOWN = 10
+# fraction of the labeled corners a combination has to find for its straight agreement to rank it, fewer matched
+# corners leave the straight agreement to chance
+MIN_MATCH_RATE = 0.5
+
+
+# A labeled trip ready to be split with any thresholds: its nodes, the determinants and radiuses of its node triples
+# before the thresholds, and the boundaries and labels of the corners it was labeled with. Built once per trip and sent
+# to the processes of the sweep, which only apply the thresholds and run find_corners.
+class SweepTrip:
+    _name = None
+    _store = None
+    _nodes = None
+    _determinants = None
+    _radiuses = None
+    _reference = None
+    _labels = None
+
+    # input: name - str
+    #        nodes - list of Node of the trip, sharing one NodeStore
+    #        determinants, radiuses - numpy arrays given by get_triples
+    #        reference - list of Corner - the labeled corners
+    #        labels - list of str, one per labeled corner. Corners after the last label are not labeled
+    def __init__(self, name, nodes, determinants, radiuses, reference, labels):
+        self._name = name
+        self._nodes = nodes
+        self._store = nodes[0].store if len(nodes) > 0 else None
+        self._determinants = determinants
+        self._radiuses = radiuses
+        self._reference = [_bounds(c) for c in reference]
+        self._labels = labels
+
+    # only the store is pickled, the nodes are built again from it
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_nodes'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._nodes = self._store.nodes() if self._store is not None else []
+
+    @property
+    def name(self):
+        return self._name
+
+    # Splits the trip with the given thresholds, like split_into_corners.
+    # returns: list of Corner
+    def split(self, straight_radius_threshold, min_determinant_abs, succesive_0s_for_straight):
+        determinants, radiuses = classify_triples(self._determinants, self._radiuses, straight_radius_threshold,
+                                                  min_determinant_abs)
+        return find_corners(self._nodes, determinants, radiuses, succesive_0s_for_straight)
+
+    # Compares corners with the labeled ones. Corners are the same when they start and end at the same coordinates.
+    # returns: dict with:
+    #   corners, straights - amount of corners and of straights among them
+    #   boundaries, reference_boundaries, common_boundaries - amount of points where the corners, the labeled corners
+    #                                                         and both start or end
+    #   labeled - amount of labeled corners
+    #   matched - amount of labeled corners that are one of the corners
+    #   agreeing - amount of matched corners that are straights exactly when they are labeled STRAIGHT_LABEL
+    def compare(self, corners):
+        bounds = {_bounds(c): c.direction for c in corners}
+        found = _boundaries([_bounds(c) for c in corners])
+        reference = _boundaries(self._reference)
+
+        matched = 0
+        agreeing = 0
+        for bound, label in zip(self._reference, self._labels):
+            if bound not in bounds:
+                continue
+            matched += 1
+            if (bounds[bound] == 'straight') == (label == STRAIGHT_LABEL):
+                agreeing += 1
+
+        return {'corners': len(corners), 'straights': sum(1 for c in corners if c.direction == 'straight'),
+                'boundaries': len(found), 'reference_boundaries': len(reference),
+                'common_boundaries': len(found & reference), 'labeled': min(len(self._labels), len(self._reference)),
+                'matched': matched, 'agreeing': agreeing}
+
+
+# returns: the coordinates of the first and of the last node of a corner
+def _bounds(corner):
+    first = corner.nodes[0]
+    last = corner.nodes[-1]
+    return first.latitude, first.longitude, last.latitude, last.longitude
+
+
+# returns: set of the coordinates where the corners start or end
+def _boundaries(bounds):
+    points = set()
+    for bound in bounds:
+        points.add(bound[:2])
+        points.add(bound[2:])
+    return points
+
+
+# Loads a labeled trip and computes the geometry of its nodes. The csv is read through its cache, like load_csv does.
+# input: local_frame - boolean - compute the geometry in the local frame of the trip
+def load_sweep_trip(snapped_file, corners_file, labels_file, local_frame=False):
+    frame = load_trip_cached(snapped_file).local_frame() if local_frame else None
+    automotive_data, header = load_csv(snapped_file)
+    nodes = get_nodes(automotive_data)
+    determinants, radiuses = get_triples(nodes, frame)
+    with open(labels_file, 'r') as f:
+        labels = json.load(f)
+    name = os.path.splitext(os.path.basename(snapped_file))[0]
+    return SweepTrip(name, nodes, determinants, radiuses, load_corners(corners_file), labels)
+
+
+# Adds up the comparisons of the trips and computes the rates:
+#   precision, recall - fraction of the boundaries that are labeled boundaries and of the labeled boundaries found
+#   f1 - harmonic mean of precision and recall
+#   match_rate - fraction of the labeled corners found
+#   straight_agreement - fraction of the matched corners that agree with their label on being a straight
+def summarize(comparisons):
+    total = {}
+    for comparison in comparisons:
+        for name, value in comparison.items():
+            total[name] = total.get(name, 0) + value
+
+    def rate(numerator, denominator):
+        return total.get(numerator, 0) / total[denominator] if total.get(denominator, 0) > 0 else 0
+
+    total['precision'] = rate('common_boundaries', 'boundaries')
+    total['recall'] = rate('common_boundaries', 'reference_boundaries')
+    total['f1'] = 0 if total['precision'] + total['recall'] == 0 else \
+        2 * total['precision'] * total['recall'] / (total['precision'] + total['recall'])
+    total['match_rate'] = rate('matched', 'labeled')
+    total['straight_agreement'] = rate('agreeing', 'matched')
+    return total
+
+
+# returns: dict - the thresholds split_into_corners uses by default, keyed like GRID
+def default_thresholds():
+    parameters = inspect.signature(split_into_corners).parameters
+    return {name: parameters[name].default for name in GRID}
+
+
+# Checks that the labeled corners of every trip are the split of its snapped csv with the default thresholds, which
+# they were made with. Corners paired with another csv, i.e. a trimmed copy of the trip, would bias every score.
+# raises: ValueError - naming the trips whose corners start or end elsewhere
+def check_labeled_trips(labeled_trips):
+    mismatched = []
+    for files in labeled_trips:
+        trip = load_sweep_trip(*files)
+        comparison = trip.compare(trip.split(**default_thresholds()))
+        if comparison['common_boundaries'] != comparison['reference_boundaries'] or \
+                comparison['common_boundaries'] != comparison['boundaries']:
+            mismatched.append("%s: %d of %d boundaries" % (files[0], comparison['common_boundaries'],
+                                                           comparison['reference_boundaries']))
+    if len(mismatched) > 0:
+        raise ValueError("Labeled corners that are not the default split of their trip: " + "; ".join(mismatched))
+
+
+# trips of the processes of the sweep, set once per process by _init_worker
+_trips = None
+
+
+def _init_worker(trips):
+    global _trips
+    _trips = trips
+
+
+# Splits every trip with one combination of thresholds.
+# returns: dict - the parameters, the comparison of every trip, or its error, and their summary
+def _evaluate(parameters):
+    result = {'parameters': parameters, 'trips': {}}
+    comparisons = []
+    for trip in _trips:
+        try:
+            comparison = trip.compare(trip.split(**parameters))
+        except (ValueError, AssertionError, IndexError) as e:
+            result['trips'][trip.name] = {'error': repr(e)}
+            continue
+        result['trips'][trip.name] = comparison
+        comparisons.append(comparison)
+    result['total'] = summarize(comparisons)
+    return result
+
+
+# returns: list of dict - every combination of the values of grid, keyed like grid
+def combinations(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+# Evaluates every combination of thresholds on the labeled trips. The trips are loaded and their geometry computed once,
+# the combinations are split in a process pool, each process receiving the trips once. The labeled trips are checked
+# with check_labeled_trips first.
+# The combinations are ranked by how the corners agree with the labels. The f1 of the boundaries is only a diagnostic:
+# the labeled corners are the split with the default thresholds, which always have an f1 of 1.
+# input: labeled_trips - list of (snapped csv, labeled corners, labels), see LABELED_TRIPS
+#        grid - dict split_into_corners parameter -> list of values, see GRID. None for GRID, or METRIC_GRID with
+#               local_frame
+#        local_frame - see load_sweep_trip
+#        workers - amount of processes, None for one per core. 1 evaluates the combinations in this process
+# returns: list of results, see _evaluate, best first by the straight agreement, the ones matching fewer than
+#          MIN_MATCH_RATE of the labeled corners last, then by the match rate
+# raises: ValueError - if local_frame is given with GRID, whose thresholds are in degrees
+def sweep(labeled_trips, grid=None, local_frame=False, workers=None):
+    if grid is None:
+        grid = METRIC_GRID if local_frame else GRID
+    elif local_frame and grid is GRID:
+        raise ValueError("GRID is in degrees, sweep METRIC_GRID in the local frame")
+    check_labeled_trips(labeled_trips)
+    trips = [load_sweep_trip(*files, local_frame=local_frame) for files in labeled_trips]
+    parameters = combinations(grid)
+
+    if workers == 1:
+        _init_worker(trips)
+        results = [_evaluate(p) for p in parameters]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(trips,)) as executor:
+            results = list(executor.map(_evaluate, parameters, chunksize=max(len(parameters) // 64, 1)))
+
+    results.sort(key=lambda r: (r['total']['match_rate'] >= MIN_MATCH_RATE, r['total']['straight_agreement'],
+                                r['total']['match_rate']), reverse=True)
+    return results
+
+
+if __name__ == '__main__':
+    results = sweep(LABELED_TRIPS, local_frame=LOCAL_FRAME, workers=WORKERS)
+    with open(OUTPUT_FILE, 'w') as f:
+        json.dump(results, f, indent=4)
+
+    print("combinations:", len(results))
+    for result in results[:SHOWN]:
+        total = result['total']
+        print(result['parameters'], "corners:", total.get('corners', 0),
+              "straight agreement: %.3f" % total['straight_agreement'], "matched: %.3f" % total['match_rate'],
+              "f1: %.3f" % total['f1'])
@@ -0,0 +1,244 @@
+import csv
+import datetime
+import glob
+import json
+import os
+
+import numpy
+
+from DataPreprocessing.Model.TripData import load_trip_cached
+
+DATA_DIRECTORIES = ['Data/Raw', 'Data/MovedToMapNodes']
+INDEX_FILE = 'Data/catalog.json'
+
+# bumped when the fields of the entries change, which rebuilds the whole index
+CATALOG_VERSION = 3
+
+
+# Converts a datetime, or a timestamp in ns, to ns since the epoch. Naive datetimes are taken as UTC, like the logger's
+# timestamps.
+def _to_ns(moment):
+    if moment is None or isinstance(moment, int):
+        return moment
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp()) * 10 ** 9 + moment.microsecond * 1000
+
+
+def _span(column):
+    values = column[~numpy.isnan(column)] if column.dtype.kind == 'f' else column
+    if len(values) == 0:
+        return None
+    return float(numpy.max(values) - numpy.min(values))
+
+
+# Reads the LATEST column of a trip csv as floats, for the values TripData leaves NaN because they are not integer
+# literals, i.e. 1.71586E+18 written by spreadsheet editors. The rows are the ones TripData keeps.
+# returns: numpy array of float64, NaN where the value is not a number
+def _written_latest(file, header):
+    index = header.index('LATEST')
+    values = []
+    with open(file, 'r', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        next(csv_reader)
+        for row in csv_reader:
+            if len(row) != len(header) or row == header:
+                continue
+            try:
+                values.append(float(row[index]))
+            except ValueError:
+                values.append(numpy.nan)
+    return numpy.array(values, dtype=numpy.float64)
+
+
+# returns: amount of accelerometer samples in the X, Y, Z columns. Every row repeats the last sample read, so a sample
+#          is counted when the values change. A new sample equal to the previous one cannot be told apart and is missed
+def _accelerometer_samples(trip):
+    xyz = numpy.column_stack([trip['X'], trip['Y'], trip['Z']]).astype(numpy.float64)
+    xyz = xyz[~numpy.isnan(xyz).any(axis=1)]
+    if len(xyz) == 0:
+        return 0
+    return 1 + int(numpy.count_nonzero((xyz[1:] != xyz[:-1]).any(axis=1)))
+
+
+# Computes the catalog entry of a trip csv.
+# returns: dict with:
+#   rows - amount of rows
+#   start, end - first and last LATEST timestamp in ns since the epoch, None if the trip has none. Rows logged before
+#                the clock was set have LATEST 0 and are ignored
+#   time_rounded - start and end come from LATEST values written in E-notation, i.e. 1.71586E+18, and are only as
+#                  precise as the digits written, hours for 6 digits
+#   bbox - [min latitude, min longitude, max latitude, max longitude] of the valid coordinates or None
+#   distance, fuel_used - increase of DISTANCE and FUEL_USED over the trip or None
+#   sensors - csv column -> fraction of the rows that have a value
+#   sample_rates - rows, gps fixes and accelerometer samples per second, see _accelerometer_samples, None without a
+#                  time range or when it is rounded, hours off on trips of minutes
+def describe_trip(file):
+    trip = load_trip_cached(file)
+    rows = len(trip)
+    entry = {'rows': rows, 'columns': trip.header, 'start': None, 'end': None, 'time_rounded': False, 'bbox': None,
+             'distance': None, 'fuel_used': None, 'sensors': {}, 'sample_rates': None}
+
+    for name in trip.header:
+        column = trip[name]
+        if column.dtype.kind in 'US':
+            present = numpy.count_nonzero(column != '')
+        else:
+            present = numpy.count_nonzero(~numpy.isnan(column))
+        entry['sensors'][name] = present / rows if rows > 0 else 0
+
+    if 'LATEST' in trip:
+        latest = trip['LATEST']
+        rounded = False
+        if latest.dtype.kind == 'f':
+            written = _written_latest(file, trip.header)
+            from_written = numpy.isnan(latest) & (written > 0)
+            rounded = bool(numpy.any(from_written))
+            latest = numpy.where(from_written, written, latest)
+            latest = latest[~numpy.isnan(latest)]
+        latest = latest[latest > 0]
+        if len(latest) > 0:
+            entry['start'] = int(numpy.min(latest))
+            entry['end'] = int(numpy.max(latest))
+            entry['time_rounded'] = rounded
+
+    if 'LATITUDE' in trip and 'LONGITUDE' in trip:
+        latitude = trip['LATITUDE']
+        longitude = trip['LONGITUDE']
+        valid = ~numpy.isnan(latitude) & ~numpy.isnan(longitude) & (latitude != 0) & (longitude != 0)
+        if numpy.any(valid):
+            entry['bbox'] = [float(numpy.min(latitude[valid])), float(numpy.min(longitude[valid])),
+                             float(numpy.max(latitude[valid])), float(numpy.max(longitude[valid]))]
+
+    if 'DISTANCE' in trip:
+        entry['distance'] = _span(trip['DISTANCE'])
+    if 'FUEL_USED' in trip:
+        entry['fuel_used'] = _span(trip['FUEL_USED'])
+
+    if entry['start'] is not None and entry['end'] > entry['start'] and not entry['time_rounded']:
+        duration = (entry['end'] - entry['start']) / 10 ** 9
+        rates = {'rows': rows / duration, 'gps': None, 'accelerometer': None}
+        if 'TIME_GPS' in trip:
+            fixes = numpy.unique(trip['TIME_GPS'])
+            rates['gps'] = len(fixes[fixes != '']) / duration
+        if 'X' in trip and 'Y' in trip and 'Z' in trip:
+            rates['accelerometer'] = _accelerometer_samples(trip) / duration
+        entry['sample_rates'] = rates
+
+    return entry
+
+
+# Index of the trips in the data directories, kept in a small json file. Refreshing only reads the trips that were
+# added or changed since the last refresh, queries only use the index.
+class TripCatalog:
+    _index_file = None
+    _entries = None
+
+    def __init__(self, index_file=INDEX_FILE):
+        self._index_file = index_file
+        self._entries = {}
+        try:
+            with open(index_file, 'r') as f:
+                index = json.load(f)
+            if index.get('version') == CATALOG_VERSION:
+                self._entries = index['trips']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    # paths are kept relative to the directory of the index file, so the data directory can be moved
+    def _key(self, file):
+        return os.path.relpath(file, os.path.dirname(os.path.abspath(self._index_file)))
+
+    # returns: str - the path of an entry, usable from the current directory
+    def path(self, entry):
+        return os.path.relpath(os.path.join(os.path.dirname(os.path.abspath(self._index_file)), entry['path']))
+
+    # Scans the directories for trip csvs. New and modified trips are read, trips that no longer exist are removed.
+    # returns: (added or updated, removed) - amounts of trips
+    def refresh(self, directories=None):
+        if directories is None:
+            directories = DATA_DIRECTORIES
+
+        found = set()
+        updated = 0
+        for directory in directories:
+            for file in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+                key = self._key(file)
+                found.add(key)
+                stat = os.stat(file)
+                entry = self._entries.get(key)
+                if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                    continue
+                try:
+                    entry = describe_trip(file)
+                except (OSError, ValueError, StopIteration) as e:
+                    print("Could not read", file, e)
+                    continue
+                entry['path'] = key
+                entry['size'] = stat.st_size
+                entry['mtime_ns'] = stat.st_mtime_ns
+                self._entries[key] = entry
+                updated += 1
+
+        scanned = [self._key(directory) for directory in directories]
+        removed = [key for key in self._entries if key not in found and os.path.dirname(key) in scanned]
+        for key in removed:
+            del self._entries[key]
+
+        self.save()
+        return updated, len(removed)
+
+    def save(self):
+        temporary = self._index_file + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'version': CATALOG_VERSION, 'trips': self._entries}, f, indent=4)
+        os.replace(temporary, self._index_file)
+
+    def entries(self):
+        return [self._entries[key] for key in sorted(self._entries)]
+
+    # Finds the trips matching every given condition.
+    # input: bbox - (min latitude, min longitude, max latitude, max longitude) - the bounding box of the trip intersects it
+    #        start, end - datetime or ns since the epoch - the time range of the trip overlaps [start, end)
+    #        sensors - list of csv columns - the trip has a value in at least min_availability of its rows for each
+    #        min_rows - minimum amount of rows
+    # returns: list of entries
+    def query(self, bbox=None, start=None, end=None, sensors=(), min_availability=0.5, min_rows=0):
+        start = _to_ns(start)
+        end = _to_ns(end)
+        result = []
+        for entry in self.entries():
+            if entry['rows'] < min_rows:
+                continue
+            if bbox is not None:
+                trip_bbox = entry['bbox']
+                if trip_bbox is None or trip_bbox[0] > bbox[2] or trip_bbox[2] < bbox[0] or \
+                        trip_bbox[1] > bbox[3] or trip_bbox[3] < bbox[1]:
+                    continue
+            if start is not None or end is not None:
+                if entry['start'] is None:
+                    continue
+                if start is not None and entry['end'] < start:
+                    continue
+                if end is not None and entry['start'] >= end:
+                    continue
+            if any(entry['sensors'].get(name, 0) < min_availability for name in sensors):
+                continue
+            result.append(entry)
+        return result
+
+
+if __name__ == '__main__':
+    catalog = TripCatalog()
+    updated, removed = catalog.refresh()
+    print("Trips:", len(catalog), "read:", updated, "removed:", removed)
+
+    # trips crossing Floresti in May 2024 that have accelerometer data
+    may = catalog.query(bbox=(46.74, 23.46, 46.77, 23.54), start=datetime.datetime(2024, 5, 1),
+                        end=datetime.datetime(2024, 6, 1), sensors=['X', 'Y', 'Z'])
+    for entry in may:
+        print(catalog.path(entry), entry['rows'], datetime.datetime.fromtimestamp(entry['start'] / 10 ** 9,
+                                                                                 datetime.timezone.utc))
@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+
+from Accelerometer.Accelerometer import AccelerometerADXL313 as Protocol
+
+
+# Stand-in for the Arduino board running Accelerometer.ino. It speaks the same serial protocol on a device endpoint
+# from Emulators.transports: it waits for BEGIN, answers SER_SUCCESS and ACC_SUCCESS, serves REQUEST_FRAME and the
+# settings commands, and streams ACC_FRAMEs while in interrupt mode.
+class AccelerometerEmulator:
+    _endpoint = None
+    _thread = None
+    _running = False
+    _connected = False
+    _interrupt_mode = False
+    _frame_source = None
+    _boot_delay = None
+    _interval_override = None
+
+    range = 3
+    activity_threshold = 7
+    inactivity_timeout = 5
+    interrupt_mode_interval = 50
+    frames_sent = 0
+
+    # input: endpoint - device side endpoint from Emulators.transports
+    #        frame_source - function() returning x, y, z - defaults to a sensor at rest with some noise
+    #        interrupt_mode_interval - int or None - ms between frames in interrupt mode, 0 streams as fast as the link
+    #                                  allows. If None, the value set with SET_INT_INTERVAL is used, like the board
+    #        boot_delay - float - seconds before the board starts listening, like the Arduino bootloader
+    def __init__(self, endpoint, frame_source=None, interrupt_mode_interval=None, boot_delay=0):
+        self._endpoint = endpoint
+        self._frame_source = frame_source if frame_source is not None else resting_frame
+        self._interval_override = interrupt_mode_interval
+        self._boot_delay = boot_delay
+        self.frames_sent = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._endpoint.close()
+        if self._thread is not None:
+            self._thread.join(1)
+
+    def _println(self, message):
+        self._endpoint.write((str(message) + '\r\n').encode())
+
+    def _readline(self, timeout):
+        return self._endpoint.readline(timeout).decode(errors='replace').strip()
+
+    def _send_frame(self):
+        x, y, z = self._frame_source()
+        self._endpoint.write((Protocol.ACC_FRAME + '\r\n' + str(x) + ' ' + str(y) + ' ' + str(z) + '\r\n').encode())
+        self.frames_sent += 1
+
+    def _interval(self):
+        if self._interval_override is not None:
+            return self._interval_override / 1000
+        return self.interrupt_mode_interval / 1000
+
+    def _reset(self):
+        self._connected = False
+        self._interrupt_mode = False
+
+    def _run(self):
+        time.sleep(self._boot_delay)
+        next_frame = time.monotonic()
+        while self._running:
+            if not self._connected:
+                request = self._readline(0.1)
+                if request == '':
+                    continue
+                if request == Protocol.BEGIN.strip():
+                    self._println(Protocol.SER_SUCCESS)
+                    self._println(Protocol.ACC_SUCCESS)
+                    self._connected = True
+                else:
+                    self._println(Protocol.SER_FAIL)
+                continue
+
+            timeout = 0.1
+            if self._interrupt_mode:
+                timeout = max(0.0, next_frame - time.monotonic())
+            request = self._readline(timeout)
+            if request != '':
+                self._handle_request(request)
+            if self._interrupt_mode and time.monotonic() >= next_frame:
+                self._send_frame()
+                next_frame = time.monotonic() + self._interval()
+
+    def _read_parameter(self):
+        parameter = self._readline(5)
+        if parameter == '':
+            self._println(Protocol.UNKNOWN_ERR)
+            return None
+        return parameter
+
+    def _handle_request(self, request):
+        if request == Protocol.REQUEST_FRAME.strip():
+            self._send_frame()
+        elif request == Protocol.SET_RANGE.strip():
+            parameter = self._read_parameter()
+            if parameter is not None:
+                self.range = int(parameter)
+                self._println(self.range)
+        elif request == Protocol.END.strip():
+            self._reset()
+        elif request == Protocol.ENABLE_INTERRUPTS.strip():
+            self._interrupt_mode = True
+            self._println(Protocol.ENABLED_INTERRUPTS)
+        elif request == Protocol.DISABLE_INTERRUPTS.strip():
+            self._interrupt_mode = False
+            self._println(Protocol.DISABLED_INTERRUPTS)
+        elif request == Protocol.SET_ACTIVITY_THRESHOLD.strip():
+            parameter = self._read_parameter()
+            if parameter is None:
+                return
+            if self._interrupt_mode:
+                self._println(Protocol.ILLEGAL_ACTION)
+                return
+            self.activity_threshold = int(parameter)
+            self._println(self.activity_threshold)
+        elif request == Protocol.SET_INACTIVITY_TIMEOUT.strip():
+            parameter = self._read_parameter()
+            if parameter is None:
+                return
+            if self._interrupt_mode:
+                self._println(Protocol.ILLEGAL_ACTION)
+                return
+            self.inactivity_timeout = int(parameter)
+            self._println(self.inactivity_timeout)
+        elif request == Protocol.SET_INTERRUPT_MODE_INTERVAL.strip():
+            parameter = self._read_parameter()
+            if parameter is not None:
+                self.interrupt_mode_interval = int(parameter)
+                self._println(self.interrupt_mode_interval)
+        else:
+            self._println(Protocol.UNKNOWN_ERR)
+
+
+# A sensor lying flat at the 4g range, with a little noise
+def resting_frame():
+    return random.randint(-2, 2), random.randint(-3, 1), random.randint(121, 125)
@@ -0,0 +1,100 @@
+import datetime
+import threading
+import time
+from functools import reduce
+
+# default route, a few points on the Floresti ring road
+DEFAULT_ROUTE = [(46.763863, 23.531176), (46.764410, 23.530402), (46.765012, 23.529586), (46.765650, 23.528860)]
+
+
+# NMEA checksum, the xor of every character between $ and *
+def checksum(sentence):
+    return '%02X' % reduce(lambda c, ch: c ^ ord(ch), sentence, 0)
+
+
+def _sentence(body):
+    return '$' + body + '*' + checksum(body) + '\r\n'
+
+
+# Formats a coordinate as NMEA (d)ddmm.mmmm and the hemisphere.
+def _coordinate(value, degrees_digits, positive, negative):
+    hemisphere = positive if value >= 0 else negative
+    value = abs(value)
+    degrees = int(value)
+    minutes = (value - degrees) * 60
+    return ('%0' + str(degrees_digits) + 'd%07.4f') % (degrees, minutes), hemisphere
+
+
+# Builds the GGA, RMC and VTG sentences for one fix. These carry every value read by GPS/gps.py.
+def fix_sentences(timestamp, latitude, longitude, altitude=395.3, speed_kmh=30.0, course=323.7):
+    hhmmss = timestamp.strftime('%H%M%S') + '.%02d' % (timestamp.microsecond // 10000)
+    ddmmyy = timestamp.strftime('%d%m%y')
+    lat, lat_hemisphere = _coordinate(latitude, 2, 'N', 'S')
+    lon, lon_hemisphere = _coordinate(longitude, 3, 'E', 'W')
+    knots = speed_kmh / 1.852
+
+    gga = 'GPGGA,%s,%s,%s,%s,%s,1,08,0.9,%.1f,M,35.0,M,,' % (hhmmss, lat, lat_hemisphere, lon, lon_hemisphere,
+                                                            altitude)
+    rmc = 'GPRMC,%s,A,%s,%s,%s,%s,%.3f,%.1f,%s,,,A' % (hhmmss, lat, lat_hemisphere, lon, lon_hemisphere, knots,
+                                                      course, ddmmyy)
+    vtg = 'GPVTG,%.1f,T,,M,%.3f,N,%.3f,K,A' % (course, knots, speed_kmh)
+    return _sentence(gga) + _sentence(rmc) + _sentence(vtg)
+
+
+# Stand-in for the serial GPS receiver. Streams fixes along a route, interpolating between its points, on a device
+# endpoint from Emulators.transports.
+class GPSEmulator:
+    _endpoint = None
+    _thread = None
+    _running = False
+    _route = None
+    _rate = None
+    fixes_sent = 0
+
+    # input: endpoint - device side endpoint from Emulators.transports
+    #        rate - float or None - fixes per second, None streams as fast as the link allows. Real receivers send 1-10
+    #        route - list of (latitude, longitude) - the points the fixes move along, in a loop
+    #        points_per_segment - int - fixes between two points of the route
+    def __init__(self, endpoint, rate=1.0, route=None, points_per_segment=10):
+        self._endpoint = endpoint
+        self._rate = rate
+        self._route = route if route is not None else DEFAULT_ROUTE
+        self._points_per_segment = points_per_segment
+        self.fixes_sent = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._endpoint.close()
+        if self._thread is not None:
+            self._thread.join(1)
+
+    def _position(self, i):
+        segment = (i // self._points_per_segment) % len(self._route)
+        p = (i % self._points_per_segment) / self._points_per_segment
+        lat1, lon1 = self._route[segment]
+        lat2, lon2 = self._route[(segment + 1) % len(self._route)]
+        return lat1 + (lat2 - lat1) * p, lon1 + (lon2 - lon1) * p
+
+    def _run(self):
+        next_fix = time.monotonic()
+        i = 0
+        while self._running:
+            if self._rate is not None:
+                delay = next_fix - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_fix += 1 / self._rate
+            latitude, longitude = self._position(i)
+            try:
+                self._endpoint.write(fix_sentences(datetime.datetime.now(datetime.timezone.utc), latitude,
+                                                   longitude).encode('ascii'))
+            except OSError:
+                break
+            self.fixes_sent += 1
+            i += 1
@@ -0,0 +1,95 @@
+import http.server
+import re
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+from DataPreprocessing.Model.RoadNetwork import RoadNetwork, load_road_network
+
+# the statements of the queries sent by move_nodes_to_road_median_axis and overpass_cache
+_AROUND = re.compile(r'way\(around:([-\d.e]+),([-\d.e]+),([-\d.e]+)\)')
+_BOUNDS = re.compile(r'way\["highway"\]\(([-\d.e]+),([-\d.e]+),([-\d.e]+),([-\d.e]+)\)')
+
+
+# Stand-in for the Overpass API, answering from the highway ways of a local OSM extract over http on localhost. It
+# understands the queries the snapping sends: the way(around:radius,latitude,longitude) of get_way and the unions of
+# way["highway"](south,west,north,east) of OverpassTiles, and answers them with the ways as "out geom" xml. Point
+# overpass_url, or the url of OverpassTiles, to its url.
+class OverpassEmulator:
+    _network = None
+    _server = None
+    _thread = None
+    _delay = None
+    requests_served = 0
+
+    # input: network - RoadNetwork or the path of an OSM extract, see load_road_network
+    #        delay - float - seconds every answer waits for, like the latency of the real API
+    #        port - int - 0 picks a free port
+    def __init__(self, network, delay=0, port=0):
+        if not isinstance(network, RoadNetwork):
+            network = load_road_network(network)
+        self._network = network
+        self._delay = delay
+        self.requests_served = 0
+
+        emulator = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                emulator._answer(self, body)
+
+            def do_GET(self):
+                emulator._answer(self, urllib.parse.urlparse(self.path).query)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/api/interpreter' % self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(1)
+
+    # the query, sent as the raw body like requests.post(url, data=query) does, or as the data form field
+    @staticmethod
+    def _query(body):
+        if body.startswith('data='):
+            return urllib.parse.parse_qs(body)['data'][0]
+        return body
+
+    def _answer(self, handler, body):
+        self.requests_served += 1
+        if self._delay > 0:
+            time.sleep(self._delay)
+        query = self._query(body)
+
+        found = set()
+        for match in _AROUND.finditer(query):
+            radius, latitude, longitude = (float(v) for v in match.groups())
+            found.update(self._network.nearby(latitude, longitude, radius))
+        for match in _BOUNDS.finditer(query):
+            found.update(self._network.within_bounds(*(float(v) for v in match.groups())))
+
+        root = ET.Element('osm', version='0.6', generator='OverpassEmulator')
+        for way in sorted((self._network.way(i) for i in found), key=lambda w: int(w.attrib['id'])):
+            root.append(way)
+        data = ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/osm3s+xml')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
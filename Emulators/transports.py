@@ -0,0 +1,205 @@
+import os
+import select
+import threading
+import time
+import tty
+
+import serial
+
+
+# Default transport. Opens a real serial port. Every transport factory takes the same parameters and returns an object
+# with the pyserial methods used by the readers: write, readline, flush, open, close and is_open.
+def open_serial(port, baudrate, timeout=None):
+    if timeout is None:
+        return serial.Serial(port, baudrate=baudrate)
+    return serial.Serial(port, baudrate=baudrate, timeout=timeout)
+
+
+# One direction of an in-process byte stream. Writes block while the pipe is full, like a real serial link that
+# cannot be written faster than it is read.
+class _BytePipe:
+    _buffer = None
+    _capacity = None
+    _condition = None
+    _closed = False
+
+    def __init__(self, capacity=4096):
+        self._buffer = bytearray()
+        self._capacity = capacity
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def write(self, data):
+        with self._condition:
+            offset = 0
+            while offset < len(data):
+                while len(self._buffer) >= self._capacity and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return offset
+                chunk = data[offset:offset + self._capacity - len(self._buffer)]
+                self._buffer += chunk
+                offset += len(chunk)
+                self._condition.notify_all()
+            return offset
+
+    # Reads up to and including the next newline. On timeout, returns what was received so far, like pyserial.
+    # input: timeout - float or None - seconds to wait, None to wait forever
+    def readline(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                end = self._buffer.find(b'\n')
+                if end >= 0:
+                    line = bytes(self._buffer[:end + 1])
+                    del self._buffer[:end + 1]
+                    self._condition.notify_all()
+                    return line
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if self._closed or remaining is not None and remaining <= 0:
+                    line = bytes(self._buffer)
+                    self._buffer.clear()
+                    self._condition.notify_all()
+                    return line
+                self._condition.wait(remaining)
+
+    def clear(self):
+        with self._condition:
+            self._buffer.clear()
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+# Device side of a transport, used by the emulators.
+class LoopbackEndpoint:
+    _incoming = None
+    _outgoing = None
+
+    def __init__(self, incoming, outgoing):
+        self._incoming = incoming
+        self._outgoing = outgoing
+
+    def readline(self, timeout=None):
+        return self._incoming.readline(timeout)
+
+    def write(self, data):
+        self._outgoing.write(data)
+
+    def close(self):
+        self._incoming.close()
+        self._outgoing.close()
+
+
+# Host side of an in-process loopback. Behaves like a pyserial port connected to the device endpoint.
+class LoopbackSerial:
+    _incoming = None
+    _outgoing = None
+    timeout = None
+    is_open = False
+
+    def __init__(self, incoming, outgoing, timeout=None):
+        self._incoming = incoming
+        self._outgoing = outgoing
+        self.timeout = timeout
+        self.is_open = True
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def write(self, data):
+        return self._outgoing.write(data)
+
+    def readline(self):
+        return self._incoming.readline(self.timeout)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self._incoming.clear()
+
+
+# Creates a connected pair of in-process endpoints.
+# returns: transport, endpoint
+#          transport - factory with the signature of open_serial, returning the host side. The port and baudrate are
+#                      ignored. It can only be called once.
+#          endpoint - LoopbackEndpoint - the device side, to be given to an emulator
+def loopback(capacity=4096):
+    host_to_device = _BytePipe(capacity)
+    device_to_host = _BytePipe(capacity)
+    endpoint = LoopbackEndpoint(host_to_device, device_to_host)
+
+    def transport(port=None, baudrate=None, timeout=None):
+        return LoopbackSerial(device_to_host, host_to_device, timeout)
+
+    return transport, endpoint
+
+
+# Device side of a pseudo-terminal. The host opens PseudoTerminal.port with a real serial.Serial, so the whole pyserial
+# and kernel tty path is exercised without hardware.
+class PseudoTerminal:
+    _master = None
+    _slave = None
+    _pending = None
+    port = None
+
+    def __init__(self):
+        self._master, self._slave = os.openpty()
+        # no echo and no newline translation, like a USB serial device
+        tty.setraw(self._slave)
+        tty.setraw(self._master)
+        self._pending = bytearray()
+        self.port = os.ttyname(self._slave)
+
+    def readline(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            end = self._pending.find(b'\n')
+            if end >= 0:
+                line = bytes(self._pending[:end + 1])
+                del self._pending[:end + 1]
+                return line
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self._master], [], [], remaining)
+            if not readable:
+                line = bytes(self._pending)
+                self._pending.clear()
+                return line
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                data = b''
+            if not data:
+                line = bytes(self._pending)
+                self._pending.clear()
+                return line
+            self._pending += data
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            written = os.write(self._master, view)
+            view = view[written:]
+
+    # returns: a transport factory opening the slave side of the pseudo-terminal with pyserial
+    def transport(self):
+        port = self.port
+
+        def factory(_port=None, baudrate=9600, timeout=None):
+            return open_serial(port, baudrate, timeout)
+
+        return factory
+
+    def close(self):
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
@@ -11,10 +11,18 @@ TIME_GPS = None
 DATE_GPS = None
 
 
-def read_serial_gps(serial_port):
+# Reads NMEA sentences from the GPS receiver and updates the module variables.
+# input: serial_port - string - the serial port the receiver is on
+#        transport - function(port, baudrate, timeout) - opens the connection, defaults to serial.Serial. Emulators use
+#                    it to replace the receiver
+#        stop_event - threading.Event or None - the function returns once the event is set. Runs forever if None
+#        callback - function(msg) or None - called after each parsed sentence
+def read_serial_gps(serial_port, transport=None, stop_event=None, callback=None):
     global LATITUDE, LONGITUDE, SPEED_KMH_GPS, HEADING, ALTITUDE, ALTITUDE_UNITS, DATE_GPS, TIME_GPS
-    conn = serial.Serial(serial_port, 9600, timeout=1.05)
-    while True:
+    if transport is None:
+        transport = serial.Serial
+    conn = transport(serial_port, 9600, timeout=1.05)
+    while stop_event is None or not stop_event.is_set():
         try:
             line = conn.readline().decode('ascii')
             msg = pynmea2.parse(line)
@@ -42,3 +50,8 @@ def read_serial_gps(serial_port):
 
         if hasattr(msg, 'spd_over_grnd_kmph'):
             SPEED_KMH_GPS = msg.spd_over_grnd_kmph
+
+        if callback is not None:
+            callback(msg)
+
+    conn.close()
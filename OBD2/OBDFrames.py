@@ -173,29 +173,42 @@ def decode(data):
     return [pid, a, b, time.time_ns()]
 
 
-async def init_scanner_connection(device_address, characteristic_handle):
+# Connects to the scanner and waits until the ECM answers. Instead of sleeping for a fixed time, a request is sent every
+# retry_interval until a valid response is decoded or ready_timeout expires.
+# input: device_address - the Bluetooth address of the scanner
+#        characteristic_handle - int - the handle of the characteristic used for the serial communication
+#        ready_timeout - float - default 15s, the maximum amount of time to wait for the ECM to answer
+#        retry_interval - float - default 0.25s, the time between two requests
+# returns: the connected bleak.BleakClient
+# raises: TimeoutError - if the ECM did not answer in time
+async def init_scanner_connection(device_address, characteristic_handle, ready_timeout=15, retry_interval=0.25):
     client = bleak.BleakClient(device_address)
     await client.connect()
 
-    # wait for the scanner to initialise
-    await asyncio.sleep(3)
-
-    # await for the scanner to be ready to receive a command
-    await client.read_gatt_char(characteristic_handle)
-
-    # request data in order for the scanner to initialise a connection to the ECM
-    await client.write_gatt_char(characteristic_handle, OBDLiveDataPIDs.THROTTLE_POSITION, response=False)
-    await client.read_gatt_char(characteristic_handle)
-    await client.read_gatt_char(characteristic_handle)
-    await client.read_gatt_char(characteristic_handle)
-
-    # repeat to make sure that a connection was made and the ECM is communicating
-    await asyncio.sleep(5)
-    await client.write_gatt_char(characteristic_handle, OBDLiveDataPIDs.THROTTLE_POSITION, response=False)
-    await client.read_gatt_char(characteristic_handle)
-    await client.read_gatt_char(characteristic_handle)
-    await client.read_gatt_char(characteristic_handle)
-
-    # get repeatedly each command by turns
-    print("READING")
-    return client
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ready_timeout
+
+    # request data in order for the scanner to initialise a connection to the ECM, until the ECM is communicating
+    while loop.time() < deadline:
+        try:
+            await client.write_gatt_char(characteristic_handle, OBDLiveDataPIDs.THROTTLE_POSITION, response=False)
+            for i in range(3):
+                response = await client.read_gatt_char(characteristic_handle)
+                if decode_safe(response):
+                    print("READING")
+                    return client
+        except bleak.BleakError:
+            pass
+        await asyncio.sleep(retry_interval)
+
+    await client.disconnect()
+    raise TimeoutError("The scanner did not get a response from the ECM in " + str(ready_timeout) + "s")
+
+
+# decodes a frame like decode, but returns False instead of raising for frames that cannot be decoded, which the scanner
+# sends while it is still initialising
+def decode_safe(data):
+    try:
+        return decode(data)
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return False
@@ -2,6 +2,12 @@ from OBD2.OBDFrames import OBDLiveDataPIDs
 
 ACCELEROMETER_PORT = "/dev/tty.usbserial-110"
 GPS_PORT = "/dev/tty.usbmodem1301"
+# json file written by Accelerometer/AccelerometerCalibration.py, None to log raw values only
+ACCELEROMETER_CALIBRATION = None
+# ms between the frames the accelerometer sends in interrupt mode, all of them are summarized in the logged rows
+ACCELEROMETER_INTERVAL = 20
+# seconds to wait at start-up for the GPS receiver to send its first sentence
+GPS_READY_TIMEOUT = 5
 
 SERVICE_UUID = "0000ffe0-0000-1000-8000-00805f9b34fb"
 CHARACTERISTIC_UUID = "0000ffe1-0000-1000-8000-00805f9b34fb"
@@ -40,6 +46,8 @@ UPDATE_CYCLE = [
     OBDLiveDataPIDs.IAT]
 
 OUTPUT = './test-final.csv'
+# json lines file the corners found while driving are appended to, see LiveCorners. None to only log the rows
+CORNERS_OUTPUT = None
 
 INTERVAL = 0.18
 
@@ -11,12 +11,19 @@ import requests
 
 import Scripts.obd_computer_configs
 from Accelerometer.Accelerometer import AccelerometerException, AccelerometerADXL313
+from Accelerometer.AccelerometerCalibration import AccelerometerCalibration
+from DataPreprocessing.corner_segmenter import LiveCorners
 from GPS.gps import LATITUDE, LONGITUDE, SPEED_KMH_GPS, HEADING, ALTITUDE, TIME_GPS
 from GPS.gps import read_serial_gps
 from OBD2.OBDFrames import nanoseconds_to_seconds, OBDFrame, decode, init_scanner_connection
 from Scripts.obd_computer_configs import ACCELEROMETER_PORT, GPS_PORT, PRINT_TO_SCREEN, INTERVAL, CHARACTERISTIC_HANDLE, \
-    DEVICE_ADDRESS, OPEN_WEATHER_API_KEY, CORRECTION_COEFFICIENT
+    DEVICE_ADDRESS, OPEN_WEATHER_API_KEY, CORRECTION_COEFFICIENT, ACCELEROMETER_CALIBRATION, GPS_READY_TIMEOUT, \
+    ACCELEROMETER_INTERVAL
 from Scripts.constants import THEORETICAL_AIR_INTAKE, AFR, ATMOSPHERIC, FUEL_DENSITY
+from Scripts.startup_timer import StartupTimer
+
+# start-up timing breakdown. Created on import, so that the time spent importing the libraries is included
+STARTUP = StartupTimer()
 
 # engine live data, available to all threads
 # kPa
@@ -42,6 +49,11 @@ accelerometer = None
 accelerometerX = None
 accelerometerY = None
 accelerometerZ = None
+accelerometer_calibration = None
+# columns with the aggregates of all accelerometer frames read between two logged rows. The _G columns hold the mean
+# converted to g in the vehicle frame, if a calibration is configured
+ACCELEROMETER_SUMMARY_HEADER = ["ACC_SAMPLES", "X_MEAN", "Y_MEAN", "Z_MEAN", "X_MIN", "Y_MIN", "Z_MIN", "X_MAX",
+                                "Y_MAX", "Z_MAX", "X_RMS", "Y_RMS", "Z_RMS", "X_G", "Y_G", "Z_G"]
 
 # latest time in ns
 LATEST = 0
@@ -54,12 +66,10 @@ DISTANCE = 0.000001
 INSTANT_FUEL_CONSUMPTION = 0
 
 
-# function to be called on accelerometer interrupt
+# function to be called on accelerometer interrupt, keeps the latest frame for the X, Y, Z columns
 def handle_accelerometer_interrupt():
     global accelerometerX, accelerometerY, accelerometerZ
-    accelerometerX = accelerometer.get_x()
-    accelerometerY = accelerometer.get_y()
-    accelerometerZ = accelerometer.get_z()
+    accelerometerX, accelerometerY, accelerometerZ = accelerometer.get_xyz()
 
 
 def estimated_lambda():
@@ -167,20 +177,42 @@ def get_aat_aap():
     print(AAP, AAT)
 
 
-# runs continuously and prints the data to csv
+# gets the summary of all the accelerometer frames read since the last logged row
+# input: seq - int - the sequence number returned by the previous call, 0 on the first call
+# returns: summary, seq - a list of values matching ACCELEROMETER_SUMMARY_HEADER and the sequence number for the next call
+def accelerometer_summary(seq):
+    if accelerometer is None:
+        return [0] + [None] * (len(ACCELEROMETER_SUMMARY_HEADER) - 1), seq
+
+    window, seq = accelerometer.get_window_since(seq)
+    if window is None:
+        return [0] + [None] * (len(ACCELEROMETER_SUMMARY_HEADER) - 1), seq
+
+    mean_g = [None, None, None]
+    if accelerometer_calibration is not None:
+        mean_g = list(accelerometer_calibration.transform_sample(*window.mean))
+
+    return [window.count] + window.mean + window.min + window.max + window.rms + mean_g, seq
+
+
+# runs continuously and prints the data to csv. If CORNERS_OUTPUT is set, the rows are also split into corners
 def print_cycle():
     global FUEL_USED, DISTANCE, RPM, SPEED, LOAD, LATEST, MAP, IAT
     global accelerometerX, accelerometerY, accelerometerZ
     writer = None
     file = None
+    live_corners = None
     if Scripts.obd_computer_configs.OUTPUT is not None:
         file = open(Scripts.obd_computer_configs.OUTPUT, 'a')
         writer = csv.writer(file)
         csv_header = ["LATEST", "SPEED", "LOAD", "MAP", "IAT", "RPM", "DISTANCE", "FUEL_USED",
                       "FUEL_CONSUMPTION", "INSTANT_FUEL_CONSUMPTION", "LATITUDE", "LONGITUDE", "ALTITUDE", "HEADING",
-                      "SPEED_GPS", "TIME_GPS", "X", "Y", "Z", "AAT", "AAP"]
+                      "SPEED_GPS", "TIME_GPS", "X", "Y", "Z", "AAT", "AAP"] + ACCELEROMETER_SUMMARY_HEADER
         writer.writerow(csv_header)
+        if Scripts.obd_computer_configs.CORNERS_OUTPUT is not None:
+            live_corners = LiveCorners(csv_header, Scripts.obd_computer_configs.CORNERS_OUTPUT)
 
+    accelerometer_seq = 0
     while True:
         fuel_consumption = grams_to_L(FUEL_USED) / DISTANCE * 100000
         if PRINT_TO_SCREEN:
@@ -193,24 +225,28 @@ def print_cycle():
             print("INSTANT FUEL CONSUMPTION:", INSTANT_FUEL_CONSUMPTION)
 
         if writer is not None:
+            summary, accelerometer_seq = accelerometer_summary(accelerometer_seq)
             row = [LATEST, SPEED, LOAD, MAP, IAT, RPM,
                    DISTANCE, FUEL_USED, fuel_consumption, INSTANT_FUEL_CONSUMPTION, LATITUDE, LONGITUDE,
                    ALTITUDE,
-                   HEADING, SPEED_KMH_GPS, TIME_GPS, accelerometerX, accelerometerY, accelerometerZ, AAT, AAP]
+                   HEADING, SPEED_KMH_GPS, TIME_GPS, accelerometerX, accelerometerY, accelerometerZ, AAT,
+                   AAP] + summary
             writer.writerow(row)
+            if live_corners is not None:
+                live_corners.add(row)
+            if STARTUP.get_mark("first row") is None:
+                STARTUP.mark("first row")
+                print(STARTUP.report())
 
         time.sleep(INTERVAL)
 
 
-# reads engine data continuously
-async def engine_data_read_cycle():
-    global MAP, IAT, RPM, SPEED, LOAD, LATEST
-    # connect to the given OBD-II scanner
+# connects to the given OBD-II scanner and reads the initial values of the PIDs
+# returns: the connected client
+async def connect_engine():
     client = await init_scanner_connection(DEVICE_ADDRESS,
                                            CHARACTERISTIC_HANDLE)
 
-    # update cycle for PIDs. the computer is currently able to run approx. 6 queries / second
-
     for i in Scripts.obd_computer_configs.INITIAL_READINGS:
         await client.write_gatt_char(CHARACTERISTIC_HANDLE, i, response=False)
         decoded = False
@@ -220,6 +256,13 @@ async def engine_data_read_cycle():
 
         process_frame(decoded)
 
+    return client
+
+
+# reads engine data continuously
+async def engine_data_read_cycle(client):
+    global MAP, IAT, RPM, SPEED, LOAD, LATEST
+    # update cycle for PIDs. the computer is currently able to run approx. 6 queries / second
     LATEST = time.time_ns()
     while True:
         for i in Scripts.obd_computer_configs.UPDATE_CYCLE:
@@ -236,16 +279,6 @@ async def engine_data_read_cycle():
                 beepy.beep(sound="error")
 
 
-def read_accelerometer():
-    global accelerometer, accelerometerX, accelerometerY, accelerometerZ
-    while True:
-        try:
-            accelerometerX, accelerometerY, accelerometerZ = accelerometer.get_frame()
-            time.sleep(0.18)
-        except AccelerometerException:
-            continue
-
-
 def update_aat_aap():
     while True:
         try:
@@ -255,19 +288,75 @@ def update_aat_aap():
         time.sleep(12000)
 
 
-if __name__ == '__main__':
-    print_thread = threading.Thread(target=print_cycle)
-    read_gps_thread = threading.Thread(target=read_serial_gps, kwargs={'serial_port': GPS_PORT})
-    read_accelerometer_thread = threading.Thread(target=read_accelerometer)
-    update_aat_aap_thread = threading.Thread(target=update_aat_aap)
+# opens the accelerometer port, waits for the board handshake and enables interrupt mode, so every frame the board
+# sends is buffered for accelerometer_summary
+def connect_accelerometer():
+    global accelerometer, accelerometer_calibration
+    device = AccelerometerADXL313(ACCELEROMETER_PORT, 115200)
+    if ACCELEROMETER_CALIBRATION is not None:
+        accelerometer_calibration = AccelerometerCalibration.load(ACCELEROMETER_CALIBRATION)
+        device.set_calibration(accelerometer_calibration)
+    device.connect_to_slave()
+    device.set_interrupt_mode_interval(str(ACCELEROMETER_INTERVAL) + "\n")
+    # set before the first interrupt, which reads it
+    accelerometer = device
+    try:
+        device.enable_interrupts(handle_accelerometer_interrupt)
+    except AccelerometerException:
+        accelerometer = None
+        raise
+
+
+# starts the GPS reader thread. ready is set when the first sentence is parsed. The first fix is marked in STARTUP
+def start_gps(ready):
+    def on_message(msg):
+        ready.set()
+        if getattr(msg, 'latitude', None):
+            STARTUP.mark("gps fix")
+
+    read_gps_thread = threading.Thread(target=read_serial_gps, kwargs={'serial_port': GPS_PORT,
+                                                                       'callback': on_message})
+    read_gps_thread.start()
 
-    accelerometer = AccelerometerADXL313(ACCELEROMETER_PORT, 115200)
-    accelerometer.connect_to_slave()
-    time.sleep(3)
 
-    read_gps_thread.start()
-    read_accelerometer_thread.start()
-    print_thread.start()
-    update_aat_aap_thread.start()
+# waits for the GPS receiver to send a sentence. A fix can take much longer and is not waited for
+def wait_for_gps(ready):
+    if not ready.wait(GPS_READY_TIMEOUT):
+        raise TimeoutError("No NMEA sentence received in " + str(GPS_READY_TIMEOUT) + "s")
+
+
+# brings up the OBD-II scanner, the GPS and the accelerometer concurrently. The logger starts as soon as the scanner is
+# ready. A device that fails to start is reported and logged as missing values.
+async def bring_up_devices():
+    gps_ready = threading.Event()
+    STARTUP.measure("gps thread", start_gps, gps_ready)
+
+    client, accelerometer_result, gps_result = await asyncio.gather(
+        STARTUP.measure_async("obd", connect_engine()),
+        asyncio.to_thread(STARTUP.measure, "accelerometer", connect_accelerometer),
+        asyncio.to_thread(STARTUP.measure, "gps", wait_for_gps, gps_ready),
+        return_exceptions=True)
 
-    asyncio.run(engine_data_read_cycle())
+    if isinstance(client, BaseException):
+        print(STARTUP.report())
+        raise client
+    for name, result in [("ACCELEROMETER", accelerometer_result), ("GPS", gps_result)]:
+        if isinstance(result, BaseException):
+            print(name, "NOT READY:", repr(result))
+            beepy.beep(sound="error")
+
+    return client
+
+
+async def main():
+    client = await bring_up_devices()
+    print(STARTUP.report())
+
+    threading.Thread(target=print_cycle).start()
+    threading.Thread(target=update_aat_aap).start()
+
+    await engine_data_read_cycle(client)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
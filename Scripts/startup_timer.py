@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+# Records how long each step of the on-board computer start-up takes. Steps may run concurrently. Times are measured
+# from the creation of the timer, which should be done as early as possible.
+class StartupTimer:
+    _start = None
+    _steps = None
+    _marks = None
+    _lock = None
+
+    def __init__(self):
+        self._start = time.monotonic()
+        self._steps = []
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def _record(self, name, started, error=None):
+        ended = time.monotonic()
+        with self._lock:
+            self._steps.append([name, started - self._start, ended - self._start, error])
+
+    # Runs function and records its duration. Exceptions are recorded and raised again.
+    def measure(self, name, function, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self._record(name, started, repr(e))
+            raise
+        self._record(name, started)
+        return result
+
+    # Awaits the coroutine and records its duration. Exceptions are recorded and raised again.
+    async def measure_async(self, name, coroutine):
+        started = time.monotonic()
+        try:
+            result = await coroutine
+        except Exception as e:
+            self._record(name, started, repr(e))
+            raise
+        self._record(name, started)
+        return result
+
+    # Records the moment an event happened, only the first time it is called for a name. i.e. the first logged row
+    def mark(self, name):
+        now = time.monotonic() - self._start
+        with self._lock:
+            if name not in self._marks:
+                self._marks[name] = now
+
+    # returns: the time in seconds when the event was marked or None
+    def get_mark(self, name):
+        return self._marks.get(name)
+
+    def report(self):
+        with self._lock:
+            steps = sorted(self._steps, key=lambda s: s[1])
+            marks = sorted(self._marks.items(), key=lambda m: m[1])
+
+        lines = ["STARTUP TIMES (s):"]
+        for name, started, ended, error in steps:
+            line = "  %-24s %7.3f -> %7.3f  (%.3f)" % (name, started, ended, ended - started)
+            if error is not None:
+                line += "  FAILED: " + error
+            lines.append(line)
+        for name, at in marks:
+            lines.append("  %-24s %7.3f" % (name, at))
+        return "\n".join(lines)